@@ -2,9 +2,8 @@ import gzip
 import numpy as np
 import struct
 import os
-from array import array
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler
 
 
 class SPOT10Loader:
@@ -12,28 +11,47 @@ class SPOT10Loader:
         pass
 
     @staticmethod
-    def get_data(dataset_dir, kind='train'):
+    def _read_idx(path, expected_magic):
+        """解压 IDX 文件, 直接从缓冲区构造数组, 不逐张拷贝"""
+        with gzip.open(path, 'rb') as file:
+            magic = struct.unpack(">I", file.read(4))[0]
+            if magic != expected_magic:
+                raise ValueError('Magic number mismatch, expected {}, got {}'.format(expected_magic, magic))
+            ndim = magic & 0xFF
+            shape = struct.unpack(">" + "I" * ndim, file.read(4 * ndim))
+            data = np.frombuffer(file.read(), dtype=np.uint8, count=int(np.prod(shape)))
+        return data.reshape(shape)
+
+    @staticmethod
+    def _cached(gz_path, expected_magic, use_cache):
+        """
+        第一次读取时在 .gz 旁边写一份解压后的 .npy, 之后以内存映射方式读取;
+        .gz 比缓存新时重新生成
+        """
+        cache_path = gz_path[:-len('.gz')] + '.npy'
+        if use_cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(gz_path):
+            return np.load(cache_path, mmap_mode='r')
+
+        data = SPOT10Loader._read_idx(gz_path, expected_magic)
+        if use_cache:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+            try:
+                np.save(tmp_path, data)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                # 数据集目录只读时不缓存
+                pass
+        return data
+
+    @staticmethod
+    def get_data(dataset_dir, kind='train', use_cache=True):
         """Load custom MNIST data from `path`"""
         labels_path = os.path.join(dataset_dir, f'{kind}-labels-idx1-ubyte.gz')
         images_path = os.path.join(dataset_dir, f'{kind}-images-idx3-ubyte.gz')
 
-        with gzip.open(labels_path, 'rb') as file:
-            magic, size = struct.unpack(">II", file.read(8))
-            if magic != 2049:
-                raise ValueError('Magic number mismatch, expected 2049, got {}'.format(magic))
-            labels = array("B", file.read())
-
-        with gzip.open(images_path, 'rb') as file:
-            magic, size, rows, cols = struct.unpack(">IIII", file.read(16))
-            if magic != 2051:
-                raise ValueError('Magic number mismatch, expected 2051, got {}'.format(magic))
-            image_data = array("B", file.read())
-
-        images = np.zeros((size, rows, cols), dtype=np.uint8)
-        for i in range(size):
-            images[i] = np.array(image_data[i * rows * cols:(i + 1) * rows * cols]).reshape(rows, cols)
-
-        return np.array(images), np.array(labels)
+        labels = SPOT10Loader._cached(labels_path, 2049, use_cache)
+        images = SPOT10Loader._cached(images_path, 2051, use_cache)
+        return images, labels
 
 
 class SPOT10Dataset(Dataset):
@@ -59,20 +77,87 @@ class SPOT10Dataset(Dataset):
         return torch.tensor(image, dtype=torch.float32), torch.tensor(label, dtype=torch.long)
 
 
-def get_data_loaders(batch_size=64):
+class SPOT10TensorDataset(Dataset):
+    """
+    一次性把整个划分归一化成连续的 (N,1,H,W) float 张量, 下标可以是整数、切片或下标张量,
+    配合 SPOT10BatchSampler 每次直接取出一整个批次
+    """
+
+    def __init__(self, images, labels, share_memory=False, return_index=False):
+        images = torch.from_numpy(np.array(images, dtype=np.uint8))  # 内存映射的缓存是只读的, 先拷贝一份
+        self.images = (images.float() / 255.0).unsqueeze(1).contiguous()
+        self.labels = torch.from_numpy(np.asarray(labels, dtype=np.int64))
+        self.return_index = return_index
+        self.indices = torch.arange(len(self.labels))
+        if share_memory:
+            # 多个 worker 共用同一份数据, 不再各自拷贝
+            self.images.share_memory_()
+            self.labels.share_memory_()
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, idx):
+        if self.return_index:
+            # 返回样本下标, 用于按下标读取教师 logits 缓存
+            return self.images[idx], self.labels[idx], self.indices[idx]
+        return self.images[idx], self.labels[idx]
+
+
+class SPOT10BatchSampler(Sampler):
+    """每次产出一个批次的下标: shuffle 时为随机下标张量, 否则为连续切片(不拷贝)"""
+
+    def __init__(self, num_samples, batch_size, shuffle=False, drop_last=False, generator=None):
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+
+    def __iter__(self):
+        perm = torch.randperm(self.num_samples, generator=self.generator) if self.shuffle else None
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            end = min(start + self.batch_size, self.num_samples)
+            yield perm[start:end] if self.shuffle else slice(start, end)
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+
+def _tensor_loader(dataset, batch_size, shuffle, num_workers):
+    sampler = SPOT10BatchSampler(len(dataset), batch_size, shuffle=shuffle)
+    # batch_size=None 关闭自动拼批, 数据集直接返回整个批次
+    return DataLoader(dataset, sampler=sampler, batch_size=None, num_workers=num_workers)
+
+
+def get_data_loaders(batch_size=64, dataset_dir="./dataset", preload=False, num_workers=2, return_index=False):
+    """
+    preload 为 True 时整个划分预先归一化到内存中, 按批次切片读取;
+    数据很小, 此时一般设 num_workers=0 直接在主进程取数据
+    return_index 为 True 时训练集的每个批次额外返回样本下标 (仅 preload 模式)
+    """
     data_loader = SPOT10Loader()
 
     # Load training data
-    train_images, train_labels = data_loader.get_data(dataset_dir="./dataset", kind='train')
-    test_images, test_labels = data_loader.get_data(dataset_dir="./dataset", kind='test')
+    train_images, train_labels = data_loader.get_data(dataset_dir=dataset_dir, kind='train')
+    test_images, test_labels = data_loader.get_data(dataset_dir=dataset_dir, kind='test')
+
+    if preload:
+        share_memory = num_workers > 0
+        train_dataset = SPOT10TensorDataset(train_images, train_labels, share_memory, return_index)
+        test_dataset = SPOT10TensorDataset(test_images, test_labels, share_memory)
+        return (_tensor_loader(train_dataset, batch_size, True, num_workers),
+                _tensor_loader(test_dataset, batch_size, False, num_workers))
 
     # Create datasets
     train_dataset = SPOT10Dataset(train_images, train_labels)
     test_dataset = SPOT10Dataset(test_images, test_labels)
 
     # Create data loaders
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=2)
-    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, num_workers=2)
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
 
     return train_loader, test_loader
 
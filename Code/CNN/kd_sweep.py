@@ -0,0 +1,189 @@
+"""
+蒸馏超参数的并行搜索
+每组 (alpha_start, alpha_end, T_start, T_end) 在进程池中独立运行 train_student_kd,
+每个进程绑定一组 CPU 核; 训练集/测试集放在共享内存中, 教师 logits 预先缓存, 各进程只读共用
+使用 ASHA 的异步 successive halving 规则: 运行到某个 rung (min_epochs, min_epochs*eta, ...) 时,
+准确率不在已到达该 rung 的前 1/eta 内就提前停止
+
+示例:
+  python kd_sweep.py --teacher best_teacher.pth --alpha-start 0.1 0.3 0.5 --alpha-end 0.7 0.9 \
+      --T-start 4 8 --T-end 2 3 --epochs 60 --min-epochs 5 --eta 3 --threads-per-run 2
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+import torch.multiprocessing as mp
+
+from data_loader import SPOT10Loader, SPOT10TensorDataset, _tensor_loader
+from model import SimpleResNetTeacher
+from teacher_cache import TeacherLogitCache
+from train import Trainer
+
+PARAM_NAMES = ("alpha_start", "alpha_end", "T_start", "T_end")
+
+
+def make_configs(alpha_start, alpha_end, T_start, T_end):
+    """各参数取值的笛卡尔积"""
+    return [dict(zip(PARAM_NAMES, values)) for values in itertools.product(alpha_start, alpha_end, T_start, T_end)]
+
+
+def make_rungs(min_epochs, max_epochs, eta):
+    """rung 所在的 epoch: min_epochs, min_epochs*eta, ... (小于 max_epochs)"""
+    rungs = []
+    r = min_epochs
+    while r < max_epochs:
+        rungs.append(r)
+        r *= eta
+    return rungs
+
+
+class RungBoard:
+    """
+    各进程共享的 rung 记录
+    一次运行到达某个 rung 时记下准确率; 该 rung 已有至少 eta 个记录且它不在前 1/eta 内时停止,
+    不需要等同一批配置都到达该 rung (异步)
+    """
+
+    def __init__(self, manager, rungs, eta):
+        self.records = manager.dict({r: [] for r in rungs})
+        self.lock = manager.Lock()
+        self.eta = eta
+
+    def report(self, epoch, acc):
+        """返回 True 表示应停止"""
+        if epoch not in self.records:
+            return False
+        with self.lock:
+            accs = self.records[epoch] + [acc]
+            self.records[epoch] = accs
+        if len(accs) < self.eta:
+            return False
+        k = max(1, len(accs) // self.eta)
+        return acc < sorted(accs, reverse=True)[k - 1]
+
+
+# ---------------- 子进程 ----------------
+_worker = {}
+
+
+def _init_worker(train_set, test_set, core_groups, threads):
+    """每个进程领取一组 CPU 核并绑定, 数据集通过共享内存传入, 不拷贝"""
+    group = core_groups.get()
+    if group and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, group)
+    torch.set_num_threads(threads)
+    _worker.update(train=train_set, test=test_set)
+
+
+def run_config(run_id, config, cache_dir, run_dir, epochs, board, batch_size, seed):
+    torch.manual_seed(seed)
+    os.makedirs(run_dir, exist_ok=True)
+    train_loader = _tensor_loader(_worker["train"], batch_size, True, 0)
+    test_loader = _tensor_loader(_worker["test"], batch_size, False, 0)
+    trainer = Trainer("cpu", num_threads=torch.get_num_threads())
+
+    history = []
+
+    def on_epoch(ep, acc):
+        history.append(acc)
+        return board.report(ep + 1, acc)
+
+    save_path = os.path.join(run_dir, "best_student.pth")
+    start = time.time()
+    best = trainer.train_student_kd(train_loader, test_loader, None, "cpu", epochs=epochs,
+                                    teacher_cache=TeacherLogitCache(cache_dir), save_path=save_path,
+                                    epoch_callback=on_epoch, verbose=False, **config)
+    return dict(run=run_id, **config, best_acc=best, epochs_run=len(history), stopped=len(history) < epochs,
+                checkpoint=save_path, seconds=time.time() - start)
+
+
+# ---------------- 主进程 ----------------
+def run_sweep(configs, teacher_path, dataset_dir="./dataset", sweep_dir="sweep_runs", cache_dir="teacher_cache",
+              epochs=60, min_epochs=5, eta=3, workers=None, threads_per_run=1, batch_size=128,
+              num_variants=4, seed=0):
+    """
+    并行运行所有配置, 返回按 best_acc 从高到低排序的结果列表,
+    同时写入 sweep_dir/results.csv 和 results.json
+    """
+    loader = SPOT10Loader()
+    train_images, train_labels = loader.get_data(dataset_dir=dataset_dir, kind="train")
+    test_images, test_labels = loader.get_data(dataset_dir=dataset_dir, kind="test")
+    train_set = SPOT10TensorDataset(train_images, train_labels, share_memory=True, return_index=True)
+    test_set = SPOT10TensorDataset(test_images, test_labels, share_memory=True)
+
+    teacher = SimpleResNetTeacher()
+    teacher.load_state_dict(torch.load(teacher_path, map_location="cpu"))
+    cache = Trainer("cpu").build_teacher_cache(teacher, train_set, "cpu", cache_dir=cache_dir,
+                                               num_variants=num_variants, seed=seed)
+
+    # 把可用的核按 threads_per_run 分组, 每个进程一组
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    groups = [cores[i:i + threads_per_run] for i in range(0, len(cores), threads_per_run)]
+    groups = [g for g in groups if len(g) == threads_per_run] or [cores]
+    workers = min(workers or len(groups), len(configs))
+
+    os.makedirs(sweep_dir, exist_ok=True)
+    ctx = mp.get_context("spawn")
+    with ctx.Manager() as manager:
+        board = RungBoard(manager, make_rungs(min_epochs, epochs, eta), eta)
+        core_groups = manager.Queue()
+        for k in range(workers):
+            core_groups.put(groups[k % len(groups)] if workers <= len(groups) else None)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(train_set, test_set, core_groups, threads_per_run)) as pool:
+            futures = [pool.submit(run_config, i, cfg, cache.cache_dir, os.path.join(sweep_dir, f"run_{i:03d}"),
+                                   epochs, board, batch_size, seed)
+                       for i, cfg in enumerate(configs)]
+            results = [f.result() for f in futures]
+
+    results.sort(key=lambda r: r["best_acc"], reverse=True)
+    with open(os.path.join(sweep_dir, "results.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    with open(os.path.join(sweep_dir, "results.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+    return results
+
+
+def format_results(results):
+    lines = ["run  α_start α_end T_start T_end | best_acc epochs   time | checkpoint"]
+    for r in results:
+        lines.append(f"{r['run']:>3d}  {r['alpha_start']:>7.2f} {r['alpha_end']:>5.2f} {r['T_start']:>7.1f} "
+                     f"{r['T_end']:>5.1f} | {r['best_acc']:>7.2f}% {r['epochs_run']:>6d}{'*' if r['stopped'] else ' '}"
+                     f"{r['seconds']:>6.0f}s | {r['checkpoint']}")
+    return "\n".join(lines) + "\n(* 被提前停止)"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并行搜索蒸馏超参数 (ASHA 提前停止)")
+    parser.add_argument("--teacher", default="best_teacher.pth", help="教师权重")
+    parser.add_argument("--dataset-dir", default="./dataset")
+    parser.add_argument("--sweep-dir", default="sweep_runs", help="每个配置一个子目录, 保存 best_student.pth")
+    parser.add_argument("--cache-dir", default="teacher_cache", help="教师 logits 缓存目录")
+    parser.add_argument("--alpha-start", type=float, nargs="+", default=[0.3])
+    parser.add_argument("--alpha-end", type=float, nargs="+", default=[0.9])
+    parser.add_argument("--T-start", type=float, nargs="+", default=[8.0])
+    parser.add_argument("--T-end", type=float, nargs="+", default=[3.0])
+    parser.add_argument("--epochs", type=int, default=60)
+    parser.add_argument("--min-epochs", type=int, default=5, help="第一个 rung 的 epoch 数")
+    parser.add_argument("--eta", type=int, default=3, help="每个 rung 保留前 1/eta")
+    parser.add_argument("--workers", type=int, help="进程数, 默认为 CPU 核数 / threads-per-run")
+    parser.add_argument("--threads-per-run", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--variants", type=int, default=4, help="教师缓存的增强变体数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    configs = make_configs(args.alpha_start, args.alpha_end, args.T_start, args.T_end)
+    print(f"{len(configs)} configs, rungs at {make_rungs(args.min_epochs, args.epochs, args.eta)}")
+    results = run_sweep(configs, args.teacher, args.dataset_dir, args.sweep_dir, args.cache_dir, args.epochs,
+                        args.min_epochs, args.eta, args.workers, args.threads_per_run, args.batch_size,
+                        args.variants, args.seed)
+    print(format_results(results))
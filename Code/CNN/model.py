@@ -1,26 +1,93 @@
+import copy
+import time
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
 
+def fuse_conv_bn(conv, bn):
+    """
+    把 eval 模式下的 BatchNorm2d 折叠进前面的 Conv2d, 返回带偏置的新卷积
+    w' = w * γ/sqrt(var+eps),  b' = (b - mean) * γ/sqrt(var+eps) + β
+    """
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride,
+                      conv.padding, conv.dilation, conv.groups, bias=True, padding_mode=conv.padding_mode)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    with torch.no_grad():
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias.copy_((bias - bn.running_mean) * scale + bn.bias)
+    return fused.to(conv.weight.device)
+
+
+def _fold_conv_bn_pairs(module):
+    """
+    递归查找容器中紧挨着注册的 Conv2d -> BatchNorm2d, 折叠后把 BN 换成 Identity
+    (教师模型中 BN 总是注册在它所归一化的卷积之后, 包括 downsample 的1×1分支)
+    """
+    children = list(module.named_children())
+    for (name, child), (next_name, next_child) in zip(children, children[1:]):
+        if isinstance(child, nn.Conv2d) and isinstance(next_child, nn.BatchNorm2d):
+            setattr(module, name, fuse_conv_bn(child, next_child))
+            setattr(module, next_name, nn.Identity())
+    for child in module.children():
+        _fold_conv_bn_pairs(child)
+
+
+def fuse_for_inference(model):
+    """
+    返回只用于推理的副本: BN 折叠进卷积, 冻结参数, 使用 channels_last 内存布局
+    原模型不受影响; 调用方应在 torch.inference_mode() 下使用, 输入会自动转成 channels_last
+    """
+    fused = copy.deepcopy(model).eval()
+    _fold_conv_bn_pairs(fused)
+    for p in fused.parameters():
+        p.requires_grad_(False)
+    fused = fused.to(memory_format=torch.channels_last)
+    fused.register_forward_pre_hook(_channels_last_input)
+    return fused
+
+
+def _channels_last_input(module, args):
+    return (args[0].contiguous(memory_format=torch.channels_last),) + args[1:]
+
+
+def benchmark_inference(model, x, iters=20, warmup=3):
+    """在 inference_mode 下测量吞吐量, 返回 images/sec"""
+    model.eval()
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(x)
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(x)
+    return iters * x.size(0) / (time.perf_counter() - start)
+
+
 class LeNet5(nn.Module):
-    def __init__(self, num_classes=10):
+    def __init__(self, num_classes=10, channels=(6, 16, 32), hidden=(120, 120, 84)):
+        """channels: 三个卷积层的输出通道数; hidden: 前三个全连接层的输出维度 (结构化剪枝后变小)"""
         super(LeNet5, self).__init__()
+        c1, c2, c3 = channels
+        h1, h2, h3 = hidden
+        self.channels = tuple(channels)
+        self.hidden = tuple(hidden)
         # 输入: 1×32×32
-        self.conv1 = nn.Conv2d(1, 6, kernel_size=5, stride=1, padding=2, bias=False)  # 输出: 6×32×32
+        self.conv1 = nn.Conv2d(1, c1, kernel_size=5, stride=1, padding=2, bias=False)  # 输出: 6×32×32
         self.pool1 = nn.MaxPool2d(kernel_size=2, stride=2)  # 输出: 6×16×16
 
-        self.conv2 = nn.Conv2d(6, 16, kernel_size=5, bias=False)  # 输出: 16×12×12
+        self.conv2 = nn.Conv2d(c1, c2, kernel_size=5, bias=False)  # 输出: 16×12×12
         self.pool2 = nn.MaxPool2d(kernel_size=2, stride=2)  # 输出: 16×6×6
 
-        self.conv3 = nn.Conv2d(16, 32, kernel_size=3, padding=1, bias=False)  # 输出: 32×6×6
+        self.conv3 = nn.Conv2d(c2, c3, kernel_size=3, padding=1, bias=False)  # 输出: 32×6×6
         self.pool3 = nn.MaxPool2d(kernel_size=2, stride=2)  # 输出: 32×3×3
 
         # 计算全连接层输入尺寸: 32 * 3 * 3 = 288
-        self.fc1 = nn.Linear(32 * 3 * 3, 120, bias=False)
-        self.fc2 = nn.Linear(120, 120, bias=False)
-        self.fc3 = nn.Linear(120, 84, bias=False)
-        self.fc4 = nn.Linear(84, num_classes, bias=False)
+        self.fc1 = nn.Linear(c3 * 3 * 3, h1, bias=False)
+        self.fc2 = nn.Linear(h1, h2, bias=False)
+        self.fc3 = nn.Linear(h2, h3, bias=False)
+        self.fc4 = nn.Linear(h3, num_classes, bias=False)
         self.dropout = nn.Dropout(0.5)
 
     def forward(self, x):
@@ -120,6 +187,10 @@ class ResNetTeacher(nn.Module):
         x = self.fc(x)
         return x
 
+    def fuse_for_inference(self):
+        """BN 折叠进卷积的推理副本, 见 fuse_for_inference"""
+        return fuse_for_inference(self)
+
 
 class SimpleResNetTeacher(nn.Module):
     def __init__(self, num_classes=10):
@@ -191,6 +262,10 @@ class SimpleResNetTeacher(nn.Module):
         x = self.fc(x)
         return x
 
+    def fuse_for_inference(self):
+        """BN 折叠进卷积的推理副本, 见 fuse_for_inference"""
+        return fuse_for_inference(self)
+
 
 # Test the model
 if __name__ == "__main__":
@@ -216,4 +291,26 @@ if __name__ == "__main__":
     total_params = sum(p.numel() for p in teacher.parameters())
     print(f"Simple ResNet Teacher total parameters: {total_params:,}")
 
+    # BN 折叠前后的输出应一致, 并比较推理吞吐量
+    print("Testing Conv-BN folding...")
+    xb = torch.randn(64, 1, 32, 32)
+    for teacher in (SimpleResNetTeacher(), ResNetTeacher()):
+        # 随机化 BN 的统计量和仿射参数, 否则折叠前后都接近恒等变换
+        for m in teacher.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.running_mean.uniform_(-0.5, 0.5)
+                m.running_var.uniform_(0.5, 2.0)
+                nn.init.uniform_(m.weight, 0.5, 1.5)
+                nn.init.uniform_(m.bias, -0.5, 0.5)
+        teacher.eval()
+        fused = teacher.fuse_for_inference()
+        with torch.inference_mode():
+            ref, out = teacher(x), fused(x)
+        err = (ref - out).abs().max().item()
+        assert torch.allclose(ref, out, rtol=1e-4, atol=1e-4), err
+        assert not any(isinstance(m, nn.BatchNorm2d) for m in fused.modules())
+        print(f"{type(teacher).__name__}: max abs diff {err:.2e} | "
+              f"unfused {benchmark_inference(teacher, xb, iters=5):.0f} img/s | "
+              f"fused {benchmark_inference(fused, xb, iters=5):.0f} img/s")
+
     print("All models working correctly!")
\ No newline at end of file
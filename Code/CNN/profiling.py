@@ -0,0 +1,133 @@
+"""
+训练循环的性能插桩
+PhaseTimer 统计每个阶段的墙钟耗时、吞吐量和峰值内存, 每个 epoch 可输出一行 JSON;
+profile_window 用 torch.profiler 记录若干个 step, 导出为 Chrome trace (chrome://tracing 或 Perfetto 中打开),
+PhaseTimer 的每个阶段在 trace 中显示为同名的 record_function 区间
+"""
+import collections
+import contextlib
+import json
+import time
+
+import torch
+
+try:
+    import resource  # 仅 Unix
+except ImportError:
+    resource = None
+
+
+class PhaseTimer:
+    """
+    按阶段累计耗时
+    sync=True 时在每个阶段前后同步 CUDA, 计时准确但会打断异步执行, 仅在需要分析时打开
+    """
+
+    def __init__(self, device="cpu", sync=False):
+        self.cuda = torch.device(device).type == "cuda"
+        self.sync = sync and self.cuda
+        self.reset()
+
+    def reset(self):
+        self.seconds = collections.defaultdict(float)
+        self.start = time.perf_counter()
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self.sync:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        with torch.profiler.record_function(name):
+            yield
+        if self.sync:
+            torch.cuda.synchronize()
+        self.seconds[name] += time.perf_counter() - start
+
+    def iterate(self, iterable, name="data"):
+        """遍历 iterable, 取下一个元素的时间计入 name 阶段"""
+        it = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def summary(self, images, **extra):
+        """
+        返回本轮的统计: 总耗时、images/sec、各阶段的耗时和占比 (未计入任何阶段的部分记为 other)、峰值内存
+        extra 原样写入结果
+        """
+        total = time.perf_counter() - self.start
+        phases = dict(self.seconds)
+        phases["other"] = max(0.0, total - sum(phases.values()))
+        result = dict(extra)
+        result.update({
+            "images": images,
+            "seconds": total,
+            "images_per_sec": images / total if total > 0 else 0.0,
+            "phases": {name: {"seconds": s, "fraction": s / total if total > 0 else 0.0}
+                       for name, s in phases.items()},
+            "peak_rss_mb": peak_rss_mb(),
+        })
+        if self.cuda:
+            result["peak_cuda_mb"] = torch.cuda.max_memory_allocated() / 2 ** 20
+        return result
+
+
+def peak_rss_mb():
+    """进程的峰值常驻内存 (MB), 不支持的平台返回 None"""
+    if resource is None:
+        return None
+    # Linux 上 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def format_phases(summary):
+    """一行的阶段占比, 按耗时从大到小排列"""
+    phases = sorted(summary["phases"].items(), key=lambda kv: kv[1]["seconds"], reverse=True)
+    line = " | ".join(f"{name} {p['seconds']:.2f}s ({p['fraction'] * 100:.0f}%)" for name, p in phases)
+    if summary.get("peak_rss_mb") is not None:
+        line += f" | peak RSS {summary['peak_rss_mb']:.0f} MB"
+    if "peak_cuda_mb" in summary:
+        line += f" | peak CUDA {summary['peak_cuda_mb']:.0f} MB"
+    return line
+
+
+def append_json_line(path, record):
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+class _NullProfiler:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def step(self):
+        pass
+
+
+def profile_window(trace_path=None, wait=1, warmup=1, active=5):
+    """
+    torch.profiler 的记录窗口: 跳过 wait 个 step, 预热 warmup 个 step, 记录 active 个 step,
+    结束后导出 Chrome trace 到 trace_path; trace_path 为 None 时返回什么也不做的同名接口
+    用法: with profile_window(path) as prof: ... 每个 batch 结束时 prof.step()
+    """
+    if trace_path is None:
+        return _NullProfiler()
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    return torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(wait=wait, warmup=warmup, active=active, repeat=1),
+        on_trace_ready=lambda prof: prof.export_chrome_trace(trace_path),
+        record_shapes=True,
+        profile_memory=True,
+    )
@@ -0,0 +1,229 @@
+"""
+LeNet5 的结构化剪枝
+按重要性 (删除后 logits 的变化) 删除卷积核和全连接神经元, 每一步按 "重要性 / 节省的乘加数" 贪心选择,
+优先删除硬件上最贵又最不重要的单元, 每层每步最多删除一半;
+每步之后用教师蒸馏微调, 准确率下降超过 max_drop 时停止, 保留上一步的结果;
+最后导出 hex 权重 (quantification.py, 附带 layers.json) 并用 simulate.py 的仿真模型验证
+
+示例:
+  python prune.py --student best_student.pth --teacher best_teacher.pth --target 0.5 --steps 3 --epochs 10
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+from data_loader import get_data_loaders
+from model import LeNet5, SimpleResNetTeacher
+from quantification import save_weights_mixed_precision_hex
+from train import Trainer
+
+# 可剪枝的层, 按数据流顺序; fc4 的输出为类别数, 不剪
+PRUNABLE = ("conv1", "conv2", "conv3", "fc1", "fc2", "fc3")
+POOL3_AREA = 3 * 3  # conv3 池化后每个通道展平为 3×3 个 fc1 输入
+
+
+def count_macs(channels, hidden, num_classes=10):
+    """每张图各层的乘加次数, 与 IntegrationConvPart / ANNfull 的周期数和权重存储成正比"""
+    c1, c2, c3 = channels
+    h1, h2, h3 = hidden
+    return {
+        "conv1": c1 * 1 * 5 * 5 * 32 * 32,
+        "conv2": c2 * c1 * 5 * 5 * 12 * 12,
+        "conv3": c3 * c2 * 3 * 3 * 6 * 6,
+        "fc1": c3 * POOL3_AREA * h1,
+        "fc2": h1 * h2,
+        "fc3": h2 * h3,
+        "fc4": h3 * num_classes,
+    }
+
+
+def _widths(keep):
+    return tuple(len(keep[n]) for n in PRUNABLE[:3]), tuple(len(keep[n]) for n in PRUNABLE[3:])
+
+
+def _total_macs(keep):
+    return sum(count_macs(*_widths(keep)).values())
+
+
+def calibration_images(loader, count=512):
+    """从 loader 中取前 count 张图片, 用于估计单元的重要性"""
+    images, total = [], 0
+    for batch in loader:
+        images.append(batch[0])
+        total += len(batch[0])
+        if total >= count:
+            break
+    return torch.cat(images)[:count]
+
+
+def unit_importance(model, images):
+    """
+    每个可剪枝单元 (卷积核/神经元) 的重要性: 把它的输出置零后, images 上 logits 的均方变化
+    模型没有偏置, 置零等价于删除该单元; 各层都用 logits 的变化衡量, 不同层之间可以直接比较
+    """
+    was_training = model.training
+    model.eval()
+    images = images.to(model.fc1.weight.device)
+    scores = {}
+    with torch.no_grad():
+        base = model(images)
+        for name in PRUNABLE:
+            layer = getattr(model, name)
+            s = np.empty(layer.weight.shape[0])
+            for j in range(len(s)):
+                handle = layer.register_forward_hook(lambda module, inputs, out, j=j: out.index_fill(1, torch.tensor(
+                    [j], device=out.device), 0))
+                s[j] = (model(images) - base).pow(2).mean().item()
+                handle.remove()
+            scores[name] = s
+    model.train(was_training)
+    return scores
+
+
+def select_units(model, target_macs, images, min_units=2, max_fraction=0.5):
+    """
+    贪心删除单元直到总乘加数不超过 target_macs
+    每次在各层最不重要的单元中, 选 重要性/节省的乘加数 最小的一个删除 (删除卷积核同时减少下一层的输入);
+    每层最多删除 max_fraction 的单元, 所有层都到上限时提前停止
+    返回 {层名: 保留的下标 (升序)}
+    """
+    scores = unit_importance(model, images)
+    keep = {name: list(np.argsort(-s)) for name, s in scores.items()}  # 按重要性从高到低
+    floor = {name: max(min_units, int(np.ceil(len(s) * (1 - max_fraction)))) for name, s in scores.items()}
+    while _total_macs(keep) > target_macs:
+        best = None
+        for name in PRUNABLE:
+            if len(keep[name]) <= floor[name]:
+                continue
+            trial = dict(keep, **{name: keep[name][:-1]})
+            saving = _total_macs(keep) - _total_macs(trial)
+            cost = scores[name][keep[name][-1]] / saving
+            if best is None or cost < best[0]:
+                best = (cost, name)
+        if best is None:
+            break
+        keep[best[1]] = keep[best[1]][:-1]
+    return {name: sorted(int(i) for i in idx) for name, idx in keep.items()}
+
+
+def prune_model(model, keep):
+    """按保留的下标构造更小的 LeNet5 并拷贝对应的权重"""
+    channels, hidden = _widths(keep)
+    pruned = LeNet5(num_classes=model.fc4.out_features, channels=channels, hidden=hidden)
+    prev = torch.arange(1)  # 输入图像只有一个通道
+    with torch.no_grad():
+        for name in PRUNABLE + ("fc4",):
+            w = getattr(model, name).weight
+            rows = torch.tensor(keep[name]) if name in keep else torch.arange(w.shape[0])
+            if name == "fc1":
+                # conv3 保留的每个通道对应 fc1 的 3×3 列
+                prev = (prev[:, None] * POOL3_AREA + torch.arange(POOL3_AREA)).reshape(-1)
+            getattr(pruned, name).weight.copy_(w[rows][:, prev])
+            prev = rows
+    return pruned.to(model.fc1.weight.device)
+
+
+def save_pruned(model, path):
+    torch.save({"channels": model.channels, "hidden": model.hidden, "state_dict": model.state_dict()}, path)
+
+
+def load_pruned(path, map_location="cpu"):
+    ckpt = torch.load(path, map_location=map_location, weights_only=True)
+    model = LeNet5(channels=ckpt["channels"], hidden=ckpt["hidden"])
+    model.load_state_dict(ckpt["state_dict"])
+    return model
+
+
+def simulate_accuracy(weight_dir, test_loader, mode="float"):
+    """用 simulate.py 的仿真模型 (形状取自导出的 layers.json) 在测试集上推理"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from simulate import LeNetSim
+
+    images = test_loader.dataset.images.numpy().astype(np.float16)
+    labels = test_loader.dataset.labels.numpy()
+    predictions, _ = LeNetSim(weight_dir).predict_batch(images, mode=mode)
+    return 100.0 * float(np.mean(predictions == labels))
+
+
+def prune_pipeline(student, teacher, train_loader, test_loader, device, target=0.5, steps=3, epochs=10,
+                   max_drop=1.0, output_dir="pruned", trainer=None):
+    """
+    分 steps 步把乘加数降到原来的 target 倍, 每步蒸馏微调 epochs 个 epoch
+    某一步之后测试准确率比原模型低 max_drop 以上时停止, 返回上一步的模型
+    返回: (剪枝后的模型, 每一步的记录)
+    """
+    trainer = trainer or Trainer(device)
+    os.makedirs(output_dir, exist_ok=True)
+    base_macs = sum(count_macs(student.channels, student.hidden).values())
+    base_acc = trainer.evaluate(student, test_loader, device)
+    calibration = calibration_images(train_loader)
+    cache = trainer.build_teacher_cache(teacher, train_loader.dataset, device,
+                                        cache_dir=os.path.join(output_dir, "teacher_cache"))
+    history = [{"step": 0, "channels": student.channels, "hidden": student.hidden, "macs": base_macs,
+                "test_acc": base_acc}]
+    print(f"Base: channels={student.channels} hidden={student.hidden} macs={base_macs} acc={base_acc:.2f}%")
+
+    current = student
+    for step in range(1, steps + 1):
+        ratio = 1.0 - (1.0 - target) * step / steps
+        pruned = prune_model(current, select_units(current, ratio * base_macs, calibration))
+        path = os.path.join(output_dir, f"step{step}_student.pth")
+        trainer.train_student_kd(train_loader, test_loader, teacher, device, epochs=epochs, teacher_cache=cache,
+                                 save_path=path, student=pruned)
+        pruned.load_state_dict(torch.load(path, map_location=device, weights_only=True))
+        acc = trainer.evaluate(pruned, test_loader, device)
+        macs = sum(count_macs(pruned.channels, pruned.hidden).values())
+        history.append({"step": step, "channels": pruned.channels, "hidden": pruned.hidden, "macs": macs,
+                        "test_acc": acc})
+        print(f"Step {step}: channels={pruned.channels} hidden={pruned.hidden} "
+              f"macs={macs} ({macs / base_macs * 100:.1f}%) acc={acc:.2f}%")
+        if base_acc - acc > max_drop:
+            print(f"Accuracy drop {base_acc - acc:.2f}% > {max_drop}%, keeping step {step - 1}")
+            break
+        current = pruned
+
+    with open(os.path.join(output_dir, "history.json"), "w") as f:
+        json.dump(history, f, indent=2)
+    save_pruned(current, os.path.join(output_dir, "pruned_student.pth"))
+    return current, history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LeNet5 结构化剪枝 + 蒸馏微调 + 导出")
+    parser.add_argument("--student", default="best_student.pth")
+    parser.add_argument("--teacher", default="best_teacher.pth")
+    parser.add_argument("--dataset-dir", default="./dataset")
+    parser.add_argument("--target", type=float, default=0.5, help="目标乘加数占原模型的比例")
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--epochs", type=int, default=10, help="每步微调的 epoch 数")
+    parser.add_argument("--max-drop", type=float, default=1.0, help="允许的最大准确率下降 (百分点)")
+    parser.add_argument("--output", default="pruned", help="输出目录")
+    parser.add_argument("--rtl", action="store_true", help="同时用按位模拟硬件的 rtl 模式验证 (较慢)")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    train_loader, test_loader = get_data_loaders(batch_size=128, dataset_dir=args.dataset_dir, preload=True,
+                                                 num_workers=0, return_index=True)
+    student = LeNet5()
+    student.load_state_dict(torch.load(args.student, map_location=device, weights_only=True))
+    teacher = SimpleResNetTeacher()
+    teacher.load_state_dict(torch.load(args.teacher, map_location=device, weights_only=True))
+    student, teacher = student.to(device), teacher.to(device)
+
+    model, history = prune_pipeline(student, teacher, train_loader, test_loader, device, args.target, args.steps,
+                                    args.epochs, args.max_drop, args.output)
+
+    weight_dir = os.path.join(args.output, "weights_mixed_hex")
+    save_weights_mixed_precision_hex(model.cpu(), output_dir=weight_dir)
+    print("\nlayer   default MACs  pruned MACs")
+    default, pruned = count_macs((6, 16, 32), (120, 120, 84)), count_macs(model.channels, model.hidden)
+    for name in default:
+        print(f"{name:<6} {default[name]:>13d} {pruned[name]:>12d}")
+    print(f"total  {sum(default.values()):>13d} {sum(pruned.values()):>12d}")
+    print(f"Simulated accuracy (float): {simulate_accuracy(weight_dir, test_loader):.2f}%")
+    if args.rtl:
+        print(f"Simulated accuracy (rtl):   {simulate_accuracy(weight_dir, test_loader, 'rtl'):.2f}%")
@@ -0,0 +1,189 @@
+"""
+LeNet5 的 INT8 训练后量化
+在训练集上统计每层输入的范围, 得到 uint8 激活的缩放因子; 权重对称量化为 int8,
+卷积按输出通道、全连接按整层各一个缩放因子; 每层的再量化系数 (输入缩放 × 权重缩放 / 下一层输入缩放)
+表示为 16 位乘数和移位数, 整数运算的定义见 ../rtlInt.py
+
+导出目录 (同时包含浮点权重, simulate.py 的 float/rtl/int8 三种模式都可以直接使用):
+  conv1_hex.txt ...         浮点权重与 layers.json (quantification.py)
+  conv1_int8_hex.txt ...    int8 权重, 布局与浮点权重相同 (卷积每行一个输出通道, 全连接 [in, out] 每行一个)
+  conv1_mult_hex.txt ...    16 位再量化乘数, 每行一个 (卷积每个输出通道一个, 全连接一个); fc4 不再量化, 没有
+  conv1_shift_hex.txt ...   8 位移位数, 同上
+  quant.json                各层的浮点缩放因子和 logits 的缩放因子
+
+示例:
+  python ptq.py --student best_student.pth --output int8_weights --calib-batches 20 --method percentile
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+from data_loader import get_data_loaders
+from model import LeNet5
+from quantification import save_weights_mixed_precision_hex
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hexCodec import bits_to_hex  # noqa: E402
+from rtlInt import ACT_MAX, WEIGHT_MAX, quantize_multiplier  # noqa: E402
+
+LAYERS = ("conv1", "conv2", "conv3", "fc1", "fc2", "fc3", "fc4")
+INPUT_SCALE = 1.0 / 255  # 输入像素为 k/255, uint8 激活正好等于原始像素值
+QUANT_VERSION = 1
+
+
+def calibrate(model, loader, device, num_batches=None, method="max", percentile=99.99):
+    """
+    统计 conv2 ~ fc4 每层输入的范围 (均为 ReLU/池化之后, 非负), 返回 {层名: 激活缩放因子}
+    method: "max" 取最大值; "percentile" 取每个 batch 的 percentile 分位数的平均, 忽略少量离群值
+    conv1 的输入为图片, 固定为 INPUT_SCALE
+    """
+    stats = {name: [] for name in LAYERS[1:]}
+
+    def hook(name):
+        def record(module, inputs):
+            x = inputs[0].detach().float()
+            if method == "max":
+                stats[name].append(x.max().item())
+            else:
+                stats[name].append(float(np.percentile(x.cpu().numpy(), percentile)))
+        return record
+
+    handles = [getattr(model, name).register_forward_pre_hook(hook(name)) for name in LAYERS[1:]]
+    model.eval()
+    try:
+        with torch.inference_mode():
+            for i, batch in enumerate(loader):
+                if num_batches is not None and i >= num_batches:
+                    break
+                model(batch[0].to(device))
+    finally:
+        for h in handles:
+            h.remove()
+
+    reduce = max if method == "max" else (lambda v: sum(v) / len(v))
+    scales = {"conv1": INPUT_SCALE}
+    for name, values in stats.items():
+        scales[name] = max(reduce(values), 1e-8) / ACT_MAX
+    return scales
+
+
+def quantize_weights(weight, per_channel):
+    """对称量化为 int8, 返回 (int8 权重, 缩放因子 (per_channel 时每个输出通道一个))"""
+    w = weight.detach().cpu().double().numpy()
+    if per_channel:
+        amax = np.abs(w.reshape(w.shape[0], -1)).max(axis=1)
+    else:
+        amax = np.array([np.abs(w).max()])
+    scale = np.where(amax > 0, amax, 1.0) / WEIGHT_MAX
+    shaped = scale.reshape(-1, *([1] * (w.ndim - 1))) if per_channel else scale[0]
+    return np.clip(np.rint(w / shaped), -WEIGHT_MAX, WEIGHT_MAX).astype(np.int8), scale
+
+
+def quantize_model(model, act_scales):
+    """
+    返回 {"input_scale", "output_scale", "layers": {层名: {...}}}
+    每层: weight (int8, 卷积 [out, in, kH, kW], 全连接 [in, out]), weight_scale, input_scale,
+    以及除 fc4 外的 requant_scale / mult / shift
+    """
+    layers = {}
+    for i, name in enumerate(LAYERS):
+        module = getattr(model, name)
+        conv = name.startswith("conv")
+        weight, w_scale = quantize_weights(module.weight, per_channel=conv)
+        layer = {"weight": weight if conv else weight.T, "weight_scale": w_scale,
+                 "input_scale": act_scales[name]}
+        if i + 1 < len(LAYERS):
+            real = act_scales[name] * w_scale / act_scales[LAYERS[i + 1]]
+            layer["requant_scale"] = real
+            layer["mult"], layer["shift"] = quantize_multiplier(real)
+        layers[name] = layer
+    fc4 = layers["fc4"]
+    return {"input_scale": INPUT_SCALE, "output_scale": float(fc4["input_scale"] * fc4["weight_scale"][0]),
+            "layers": layers}
+
+
+def export_int8(quant, output_dir, calibration=None):
+    """写 int8 权重、再量化常数 (hex) 和 quant.json"""
+    os.makedirs(output_dir, exist_ok=True)
+    meta = {"version": QUANT_VERSION, "input_scale": quant["input_scale"], "output_scale": quant["output_scale"],
+            "calibration": calibration or {}, "layers": {}}
+    for name, layer in quant["layers"].items():
+        path = os.path.join(output_dir, name)
+        weight = layer["weight"].view(np.uint8)
+        with open(f"{path}_int8_hex.txt", "w") as f:
+            if weight.ndim == 4:  # 卷积每行一个输出通道
+                f.write("".join(bits_to_hex(row, 8) + "\n" for row in weight.reshape(weight.shape[0], -1)))
+            else:  # 全连接每行一个
+                f.write(bits_to_hex(weight, 8, "\n") + "\n")
+        info = {"shape": list(weight.shape), "weight_scale": layer["weight_scale"].tolist(),
+                "input_scale": layer["input_scale"]}
+        if "mult" in layer:
+            with open(f"{path}_mult_hex.txt", "w") as f:
+                f.write(bits_to_hex(layer["mult"], 16, "\n") + "\n")
+            with open(f"{path}_shift_hex.txt", "w") as f:
+                f.write(bits_to_hex(layer["shift"], 8, "\n") + "\n")
+            info.update(requant_scale=layer["requant_scale"].tolist(), mult=layer["mult"].tolist(),
+                        shift=layer["shift"].tolist())
+        meta["layers"][name] = info
+    with open(os.path.join(output_dir, "quant.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def simulate_accuracy(weight_dir, test_loader, modes=("float", "int8")):
+    """用 simulate.py 的仿真模型在测试集上推理, 返回 {模式: (准确率, 预测)}"""
+    from simulate import LeNetSim
+
+    images = test_loader.dataset.images.numpy().astype(np.float16)
+    labels = test_loader.dataset.labels.numpy()
+    sim = LeNetSim(weight_dir)
+    results = {}
+    for mode in modes:
+        predictions, _ = sim.predict_batch(images, mode=mode)
+        results[mode] = (100.0 * float(np.mean(predictions == labels)), predictions)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LeNet5 的 INT8 训练后量化与导出")
+    parser.add_argument("--student", default="best_student.pth")
+    parser.add_argument("--pruned", action="store_true", help="--student 为 prune.py 保存的剪枝模型")
+    parser.add_argument("--dataset-dir", default="./dataset")
+    parser.add_argument("--output", default="int8_weights")
+    parser.add_argument("--calib-batches", type=int, help="校准用的训练集 batch 数, 默认整个训练集")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--method", choices=["max", "percentile"], default="max")
+    parser.add_argument("--percentile", type=float, default=99.99)
+    parser.add_argument("--rtl", action="store_true", help="同时用 rtl 模式评估浮点硬件 (较慢)")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    train_loader, test_loader = get_data_loaders(batch_size=args.batch_size, dataset_dir=args.dataset_dir,
+                                                 preload=True, num_workers=0)
+    if args.pruned:
+        from prune import load_pruned
+        model = load_pruned(args.student, map_location=device)
+    else:
+        model = LeNet5()
+        model.load_state_dict(torch.load(args.student, map_location=device, weights_only=True))
+    model = model.to(device).eval()
+
+    act_scales = calibrate(model, train_loader, device, args.calib_batches, args.method, args.percentile)
+    quant = quantize_model(model, act_scales)
+    save_weights_mixed_precision_hex(model.cpu(), output_dir=args.output)
+    export_int8(quant, args.output, {"method": args.method, "percentile": args.percentile,
+                                     "batches": args.calib_batches, "batch_size": args.batch_size})
+
+    print("\nlayer   input scale   requant mult/shift (first channel)")
+    for name, layer in quant["layers"].items():
+        requant = f"{layer['mult'].flat[0]} >> {layer['shift'].flat[0]}" if "mult" in layer else "-"
+        print(f"{name:<6} {layer['input_scale']:>12.6g}   {requant}")
+
+    results = simulate_accuracy(args.output, test_loader, ("float", "int8", "rtl") if args.rtl else ("float", "int8"))
+    agreement = 100.0 * float(np.mean(results["int8"][1] == results["float"][1]))
+    for mode, (acc, _) in results.items():
+        print(f"Simulated accuracy ({mode}): {acc:.2f}%")
+    print(f"int8 / float prediction agreement: {agreement:.2f}%")
@@ -1,11 +1,17 @@
+import json
 import torch
 import numpy as np
 import os
+import sys
 from model import LeNet5
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hexCodec import bits_to_hex  # noqa: E402
+
 
 def save_weights_mixed_precision_hex(model, output_dir="weights_mixed_hex"):
     os.makedirs(output_dir, exist_ok=True)
+    layers = {}
 
     for name, module in model.named_modules():
         if isinstance(module, (torch.nn.Conv2d, torch.nn.Linear)):
@@ -24,24 +30,23 @@ def save_weights_mixed_precision_hex(model, output_dir="weights_mixed_hex"):
 
             weight_file = os.path.join(output_dir, f"{name.replace('.', '_')}_hex.txt")
 
+            width = 16 if layer_type == "conv" else 32
             with open(weight_file, "w") as f:
-                if param.ndim == 4:  # conv: [in_ch, out_ch, kH, kW]
+                if param.ndim == 4:  # conv: 每个输出通道一行, [in_ch, kH, kW] 依次拼接
                     for o in range(param.shape[0]):
-                        line = ''
-                        for i in range(param.shape[1]):
-                            line += "".join(f"{w:04x}" for w in param_hex[o, i].flatten())
-                        f.write(line + "\n")
-                elif param.ndim == 2:  # fc: [in, out]
-                    for i in range(param.shape[0]):
-                        line = "\n".join(f"{w:08x}" for w in param_hex[i])
-                        f.write(line + "\n")
+                        f.write(bits_to_hex(param_hex[o], width) + "\n")
+                elif param.ndim == 2:  # fc: [in, out], 每个数一行
+                    f.write(bits_to_hex(param_hex, width, "\n") + "\n")
                 else:
                     # 其他维度直接 flatten
-                    line = " ".join(f"{w:04x}" if layer_type == "conv" else f"{w:08x}"
-                                    for w in param_hex.flatten())
-                    f.write(line + "\n")
+                    f.write(bits_to_hex(param_hex, width, " ") + "\n")
 
             print(f"Saved {layer_type} weights -> {weight_file}, shape={param.shape}, dtype={param_dtype}")
+            layers[name.replace('.', '_')] = {"shape": list(param.shape), "width": width}
+
+    # 各层形状 (卷积 [out, in, kH, kW], 全连接 [in, out]), 剪枝后的模型由 simulate.py 按此读取
+    with open(os.path.join(output_dir, "layers.json"), "w") as f:
+        json.dump(layers, f, indent=2)
 
     print(f"卷积层 FP16 和全连接层 FP32 权重已保存为 16 进制 TXT 文件 -> {output_dir}/")
 
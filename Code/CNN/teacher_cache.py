@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+
+CACHE_VERSION = 4  # 2: 平移与旋转合并为一次 grid_sample; 3: meta 增加数据集校验和与 autocast 类型; 4: 只对旋转的样本 grid_sample
+
+
+class TeacherLogitCache:
+    """
+    教师 logits 的内存映射缓存, 按 (增强变体, 样本下标) 索引
+    logits.npy: (V, N, C) float32, 第v个增强变体下每个样本的教师输出
+    params.npy: (V, N, 3) float32, 每个变体每个样本的增强参数 (top, left, angle)
+    meta.json:  样本数、类别数、每个变体的随机种子、教师权重和训练数据的校验和、前向的 autocast 类型,
+                最后写入, 缺失时视为缓存不完整
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.logits = np.load(os.path.join(cache_dir, 'logits.npy'), mmap_mode='r')
+        self.params = np.load(os.path.join(cache_dir, 'params.npy'), mmap_mode='r')
+
+    @property
+    def num_variants(self):
+        return self.logits.shape[0]
+
+    def __len__(self):
+        return self.logits.shape[1]
+
+    def lookup(self, indices, variants):
+        """
+        indices, variants: (B,) 下标张量
+        返回: (教师 logits (B,C), 增强参数 (B,3))
+        """
+        indices = indices.cpu().numpy()
+        variants = variants.cpu().numpy()
+        return (torch.from_numpy(np.ascontiguousarray(self.logits[variants, indices])),
+                torch.from_numpy(np.ascontiguousarray(self.params[variants, indices])))
+
+    @staticmethod
+    def make_meta(num_samples, num_classes, seeds, augment, teacher_hash, data_hash, autocast_dtype=None):
+        """autocast_dtype: 教师前向的 autocast 类型 (如 "bfloat16"), 不使用 autocast 时为 None"""
+        return {'version': CACHE_VERSION, 'num_samples': int(num_samples), 'num_classes': int(num_classes),
+                'seeds': [int(s) for s in seeds], 'augment': bool(augment), 'teacher_hash': teacher_hash,
+                'data_hash': data_hash, 'autocast': autocast_dtype}
+
+    @staticmethod
+    def load_if_valid(cache_dir, meta):
+        """meta 与已有缓存一致时返回缓存, 否则返回 None"""
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            if json.load(f) != meta:
+                return None
+        return TeacherLogitCache(cache_dir)
+
+    @staticmethod
+    def create(cache_dir, meta):
+        """创建空的可写缓存, 写完后调用 finalize"""
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        V, N, C = len(meta['seeds']), meta['num_samples'], meta['num_classes']
+        logits = np.lib.format.open_memmap(os.path.join(cache_dir, 'logits.npy'), mode='w+',
+                                           dtype=np.float32, shape=(V, N, C))
+        params = np.lib.format.open_memmap(os.path.join(cache_dir, 'params.npy'), mode='w+',
+                                           dtype=np.float32, shape=(V, N, 3))
+        return logits, params
+
+    @staticmethod
+    def finalize(cache_dir, meta, logits, params):
+        logits.flush()
+        params.flush()
+        del logits, params
+        with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return TeacherLogitCache(cache_dir)
+
+
+def state_dict_hash(model):
+    """模型权重的校验和, 教师重新训练后缓存自动失效"""
+    h = hashlib.sha256()
+    for name, tensor in sorted(model.state_dict().items()):
+        h.update(name.encode())
+        h.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return h.hexdigest()
+
+
+def dataset_hash(dataset):
+    """训练图像和标签的校验和, 数据集重新生成或修改后缓存自动失效"""
+    h = hashlib.sha256()
+    for tensor in (dataset.images, dataset.labels):
+        tensor = torch.as_tensor(tensor).detach().cpu().contiguous()
+        h.update(f"{tuple(tensor.shape)} {tensor.dtype}".encode())
+        h.update(tensor.numpy().tobytes())
+    return h.hexdigest()
@@ -5,56 +5,302 @@ import torch.nn.functional as F
 from torch.utils.data import DataLoader
 import numpy as np
 from tqdm import tqdm
+import argparse
+import contextlib
+import copy
+import functools
 import math
+import os
+import time
 import random
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
-from model import LeNet5, SimpleResNetTeacher
+from model import LeNet5, SimpleResNetTeacher, fuse_for_inference
 from data_loader import get_data_loaders
 from loss import DistillationLoss, AttentionTransferLoss
+from teacher_cache import TeacherLogitCache, dataset_hash, state_dict_hash
+from profiling import PhaseTimer, append_json_line, format_phases, profile_window
+
+
+@functools.lru_cache(maxsize=8)
+def _augment_basis(H, W, device, dtype):
+    """
+    apply_augment 的采样网格基: (4, H*W*2), 网格 = [cos, sin, top-2, left-2] @ 基
+    即 affine_grid 在 pad 后的 (H+4)×(W+4) 图像上的展开: 每个像素中心的归一化坐标 (x, y) 先缩放 W/(W+4), H/(H+4),
+    再旋转, 最后平移 (left-2, top-2) 像素 (归一化坐标每像素为 2/(W+4))
+    """
+    xs = (torch.arange(W, device=device, dtype=dtype) * 2 + 1) / W - 1
+    ys = (torch.arange(H, device=device, dtype=dtype) * 2 + 1) / H - 1
+    gy, gx = torch.meshgrid(ys, xs, indexing='ij')
+    sx, sy = W / (W + 4), H / (H + 4)
+    zero, one = torch.zeros_like(gx), torch.ones_like(gx)
+    return torch.stack([torch.stack([sx * gx, sy * gy], -1), torch.stack([-sx * gy, sy * gx], -1),
+                        torch.stack([zero, one * 2 / (H + 4)], -1),
+                        torch.stack([one * 2 / (W + 4), zero], -1)]).reshape(4, -1)
+
+
+# ----------------- checkpoint 与异步评估 -----------------
+def _rng_state():
+    state = {'torch': torch.get_rng_state(), 'python': random.getstate(), 'numpy': np.random.get_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def _set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class AsyncEvaluator:
+    """
+    在后台线程中评估模型的权重快照, 训练不等待评估
+    评估和写 checkpoint 按提交顺序在同一个线程中执行, 因此 checkpoint 中的 best 已包含之前所有评估的结果
+    synchronous=True 时直接在调用线程中执行 (与原来每个 epoch 阻塞评估的行为相同)
+    callback(ep, test_acc) 返回 True 时 stopped 置位, 训练循环在下一个 epoch 开始前停止
+    """
+
+    def __init__(self, trainer, test_loader, device, save_path, name, best=0.0, callback=None,
+                 verbose=True, synchronous=False):
+        self.trainer = trainer
+        self.test_loader = test_loader
+        self.device = device
+        self.save_path = save_path
+        self.name = name
+        self.best = best
+        self.callback = callback
+        self.verbose = verbose
+        self.stopped = False
+        self.pool = None if synchronous else ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+
+    def submit(self, fn, *args):
+        if self.pool is None:
+            fn(*args)
+        else:
+            self.futures.append(self.pool.submit(fn, *args))
+            # 及早抛出后台任务中的异常
+            done = [f for f in self.futures if f.done()]
+            self.futures = [f for f in self.futures if not f.done()]
+            for f in done:
+                f.result()
+
+    def evaluate(self, ep, model):
+        """提交第 ep 个 epoch 的评估, 模型先拷贝一份快照, 之后训练可以继续修改原模型"""
+        self.submit(self._evaluate, ep, copy.deepcopy(model))
+
+    def _evaluate(self, ep, model):
+        test_acc = self.trainer.evaluate(model, self.test_loader, self.device)
+        if test_acc > self.best:
+            self.best = test_acc
+            torch.save(model.state_dict(), self.save_path)
+        if self.verbose:
+            print(f"{self.name} Epoch {ep+1}: test_acc={test_acc:.2f}% | best={self.best:.2f}% "
+                  f"| eval {self.trainer.eval_throughput:.0f} img/s")
+        if self.callback is not None and self.callback(ep, test_acc):
+            self.stopped = True
+
+    def close(self):
+        """等待所有评估完成, 返回最优准确率"""
+        if self.pool is not None:
+            for f in self.futures:
+                f.result()
+            self.pool.shutdown()
+        return self.best
 
 
 class Trainer:
-    def __init__(self, device='cuda' if torch.cuda.is_available() else 'cpu'):
+    def __init__(self, device='cuda' if torch.cuda.is_available() else 'cpu', cpu_fast=False, compile=False,
+                 num_threads=None, interop_threads=None, async_eval=True, eval_interval=1, profile_dir=None):
+        """
+        cpu_fast: CPU 训练快速路径, 前向在 bfloat16 autocast 下运行
+        compile: 用 torch.compile 编译学生和教师的前向
+        num_threads / interop_threads: 算子内/算子间线程数, 默认 cpu_fast 时使用全部核
+        async_eval: 在后台线程中评估权重快照, 训练不等待评估
+        eval_interval: 每隔多少个 epoch 评估一次, 最后一个 epoch 总会评估
+        profile_dir: 给出时蒸馏训练输出每个阶段的耗时 (kd_profile.jsonl, 每个 epoch 一行),
+            并用 torch.profiler 记录第一个 epoch 的前几个 step (kd_trace.json, Chrome trace 格式)
+        """
         self.device = device
+        self.cpu_fast = cpu_fast
+        self.compile = compile
+        self.async_eval = async_eval
+        self.eval_interval = eval_interval
+        self.profile_dir = profile_dir
+        self.eval_seconds = None
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        if num_threads or cpu_fast:
+            torch.set_num_threads(num_threads or os.cpu_count())
+        if interop_threads:
+            try:
+                torch.set_num_interop_threads(interop_threads)
+            except RuntimeError:
+                # 算子间线程池只能在第一次并行计算前设置
+                print(f"Warning: interop threads already initialized ({torch.get_num_interop_threads()})")
         self.student_model = LeNet5().to(device)
         self.teacher_model = SimpleResNetTeacher().to(device)
 
-    # ----------------- 轻量增强（Tensor级） -----------------
-    def rand_augment(self, x):
-        # x: (B,1,H,W) float in [0,1] or normalized
+    # ----------------- 轻量增强（Tensor级, 逐样本） -----------------
+    def rand_augment(self, x, generator=None):
+        """
+        x: (B,1,H,W) float in [0,1] or normalized
+        每个样本独立采样平移和旋转, 一次 affine_grid/grid_sample 完成
+        generator: 可选的 torch.Generator (CPU), 给定种子时增强结果可复现
+        """
         if not x.requires_grad:
-            # 随机平移/裁剪: pad=2 后随机裁32×32
-            x = F.pad(x, (2,2,2,2), mode='reflect')
-            H, W = x.shape[-2:]
-            top = random.randint(0, H-32)
-            left = random.randint(0, W-32)
-            x = x[..., top:top+32, left:left+32]
-            # 小角度旋转（-10°~10°）
-            if random.random() < 0.5:
-                angle = (random.random()*20 - 10.0) * math.pi/180.0
-                theta = torch.tensor([[math.cos(angle), -math.sin(angle), 0.0],
-                                      [math.sin(angle),  math.cos(angle), 0.0]],
-                                     device=x.device, dtype=x.dtype).unsqueeze(0).repeat(x.size(0),1,1)
-                grid = F.affine_grid(theta, x.size(), align_corners=False)
-                x = F.grid_sample(x, grid, mode='bilinear', padding_mode='border', align_corners=False)
+            x = self.apply_augment(x, self.sample_augment_params(x.size(0), generator))
         return x
 
+    @staticmethod
+    def sample_augment_params(n, generator=None):
+        """
+        为 n 个样本独立采样增强参数
+        返回: (n,3) [top, left, angle], top/left 为 pad=2 后随机裁剪的偏移 (0~4, 即平移 -2~2 像素),
+        angle 为弧度, 以0.5的概率在 -10°~10° 内均匀采样, 不旋转时为0
+        """
+        top = torch.randint(0, 5, (n,), generator=generator).float()
+        left = torch.randint(0, 5, (n,), generator=generator).float()
+        rotate = torch.rand(n, generator=generator) < 0.5
+        angle = (torch.rand(n, generator=generator) * 20 - 10.0) * math.pi / 180.0
+        return torch.stack([top, left, angle * rotate], dim=1)
+
+    @staticmethod
+    def apply_augment(x, params):
+        """
+        按 sample_augment_params 给出的参数对每个样本做平移和旋转, x: (B,C,H,W)
+        与 "reflect pad=2 后裁剪 (top,left), 再绕中心旋转" 等价:
+          - 所有样本先按整数偏移裁剪: 在 pad 后的一维数据上取重叠窗口, 每个样本的裁剪是其中的一行, 一次 index_select
+          - 只有旋转的样本 (约一半) 再用 grid_sample 双线性采样, 平移和旋转合并成一个采样网格 (一次矩阵乘)
+        不旋转的样本与直接裁剪完全相同
+        """
+        B, C, H, W = x.shape
+        params = params.to(device=x.device, dtype=x.dtype)
+        Hp, Wp = H + 4, W + 4
+        x = F.pad(x, (2,2,2,2), mode='reflect')
+        # 从 (top, left) 开始、跨 H 行的连续区间, 按行距 Wp 取前 W 列即为裁剪结果
+        span = (H - 1) * Wp + W
+        start = (torch.arange(B * C, device=x.device) * (Hp * Wp)).view(B, C) + \
+            (params[:, 0] * Wp + params[:, 1]).long().view(B, 1)
+        out = torch.index_select(x.reshape(-1).unfold(0, span, 1), 0, start.view(-1))
+        out = out.as_strided((B, C, H, W), (C * span, span, Wp, 1)).contiguous()
+
+        rot = params[:, 2].nonzero().squeeze(1)
+        if len(rot):
+            # 子集用 index_select 取, CPU 上比高级索引 x[rot] 快数倍
+            p = params.index_select(0, rot)
+            coeffs = torch.cat([torch.cos(p[:, 2:]), torch.sin(p[:, 2:]), p[:, :2] - 2], 1)
+            grid = (coeffs @ _augment_basis(H, W, x.device, x.dtype)).view(-1, H, W, 2)
+            out.index_copy_(0, rot, F.grid_sample(x.index_select(0, rot), grid, mode='bilinear',
+                                                  padding_mode='border', align_corners=False))
+        return out
+
+    # ----------------- 教师 logits 缓存 -----------------
+    def build_teacher_cache(self, teacher, dataset, device, cache_dir='teacher_cache',
+                            num_variants=4, seed=0, augment=True, batch_size=512):
+        """
+        预先计算教师在每个样本上的 logits, 写入内存映射的缓存
+        dataset: SPOT10TensorDataset; 每个增强变体 v 用种子 seed+v 为所有样本采样增强参数,
+        augment=False 时只缓存一份不增强的 logits
+        教师权重、训练数据、种子和 autocast 类型都不变时直接复用已有缓存
+        """
+        seeds = [seed + v for v in range(num_variants if augment else 1)]
+        meta = TeacherLogitCache.make_meta(len(dataset), 10, seeds, augment, state_dict_hash(teacher),
+                                           dataset_hash(dataset), 'bfloat16' if self.cpu_fast else None)
+        cache = TeacherLogitCache.load_if_valid(cache_dir, meta)
+        if cache is not None:
+            return cache
+
+        logits, params = TeacherLogitCache.create(cache_dir, meta)
+        teacher = fuse_for_inference(teacher)
+        for v, s in enumerate(seeds):
+            g = torch.Generator().manual_seed(s)
+            p = self.sample_augment_params(len(dataset), g) if augment else \
+                torch.tensor([[2.0, 2.0, 0.0]]).repeat(len(dataset), 1)
+            params[v] = p.numpy()
+            for start in tqdm(range(0, len(dataset), batch_size), desc=f"Teacher cache {v+1}/{len(seeds)}"):
+                images = dataset.images[start:start+batch_size].to(device)
+                images = self.apply_augment(images, p[start:start+batch_size])
+                with torch.inference_mode(), self.autocast():
+                    logits[v, start:start+batch_size] = teacher(images).float().cpu().numpy()
+        return TeacherLogitCache.finalize(cache_dir, meta, logits, params)
+
+    # ----------------- CPU 快速路径 -----------------
+    def autocast(self):
+        """cpu_fast 时前向使用 bfloat16 autocast, 否则不做任何事"""
+        if self.cpu_fast:
+            return torch.autocast(device_type=torch.device(self.device).type, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def maybe_compile(self, model):
+        """compile 时返回 torch.compile 后的模块 (与原模型共享参数), 保存权重时仍使用原模型"""
+        return torch.compile(model) if self.compile else model
+
+    # ----------------- checkpoint -----------------
+    def _evaluator(self, test_loader, device, save_path, name, callback=None, verbose=True):
+        return AsyncEvaluator(self, test_loader, device, save_path, name, callback=callback, verbose=verbose,
+                              synchronous=not self.async_eval)
+
+    def _should_evaluate(self, ep, epochs):
+        return (ep + 1) % self.eval_interval == 0 or ep == epochs - 1
+
+    def save_checkpoint(self, evaluator, path, model, opt, epoch, **extra):
+        """
+        完整 checkpoint: 模型、优化器 (含当前学习率)、下一个 epoch、最优准确率和各随机数发生器的状态
+        状态在调用时拷贝一份快照, 排在评估队列中原子地写盘, 训练不等待
+        """
+        state = copy.deepcopy({'model': model.state_dict(), 'optimizer': opt.state_dict(), 'epoch': epoch,
+                               'rng': _rng_state(), **extra})
+
+        def write():
+            state['best'] = evaluator.best
+            tmp = f"{path}.tmp{os.getpid()}"
+            torch.save(state, tmp)
+            os.replace(tmp, path)
+        evaluator.submit(write)
+
+    def load_checkpoint(self, path, model, opt, evaluator):
+        """恢复 save_checkpoint 保存的状态, 返回继续训练的 epoch"""
+        state = torch.load(path, map_location=self.device, weights_only=False)
+        model.load_state_dict(state['model'])
+        opt.load_state_dict(state['optimizer'])
+        _set_rng_state(state['rng'])
+        evaluator.best = state['best']
+        print(f"Resumed from {path} at epoch {state['epoch']} (best={state['best']:.2f}%)")
+        return state['epoch']
+
+    def _resume(self, checkpoint_path, resume, model, opt, evaluator):
+        if resume and checkpoint_path and os.path.exists(checkpoint_path):
+            return self.load_checkpoint(checkpoint_path, model, opt, evaluator)
+        return 0
+
     # ----------------- 评估 -----------------
     def evaluate(self, model, test_loader, device):
         model.eval()
-        correct = total = 0
-        with torch.no_grad():
-            for images, labels in test_loader:
-                images, labels = images.to(device), labels.to(device)
+        correct = torch.zeros((), dtype=torch.long, device=device)
+        total = 0
+        start = time.perf_counter()
+        with torch.inference_mode(), self.autocast():
+            for batch in test_loader:
+                images, labels = batch[0].to(device), batch[1].to(device)
                 outputs = model(images)
-                _, predicted = outputs.max(1)
-                correct += (predicted == labels).sum().item()
+                correct += (outputs.argmax(1) == labels).sum()
                 total   += labels.size(0)
-        return 100.0 * correct / total
+        self.eval_seconds = time.perf_counter() - start
+        self.eval_throughput = total / self.eval_seconds
+        return 100.0 * correct.item() / total
 
     # ----------------- 教师训练（稳健设置） -----------------
-    def train_teacher(self, train_loader, test_loader, device, epochs=30):
+    def train_teacher(self, train_loader, test_loader, device, epochs=30, checkpoint_path=None, resume=False):
+        """
+        checkpoint_path: 每个 epoch 结束后保存完整 checkpoint 的路径
+        resume: checkpoint_path 存在时从中恢复, 继续训练
+        """
         teacher = SimpleResNetTeacher().to(device)
+        teacher_fwd = self.maybe_compile(teacher)
         opt = optim.SGD(teacher.parameters(), lr=0.05, momentum=0.9, weight_decay=5e-4, nesterov=True)
         # 线性warmup 3 epoch + 余弦退火
         def lr_schedule(ep):
@@ -64,37 +310,60 @@ class Trainer:
             return 0.5*(1+math.cos(math.pi*t))
         criterion = nn.CrossEntropyLoss(label_smoothing=0.05)
 
-        best = 0.0
-        for ep in range(epochs):
+        evaluator = self._evaluator(test_loader, device, 'best_teacher.pth', 'Teacher')
+        start_ep = self._resume(checkpoint_path, resume, teacher, opt, evaluator)
+        for ep in range(start_ep, epochs):
             teacher.train()
-            total_loss = correct = total = 0
-            for images, labels in tqdm(train_loader, desc=f"Teacher {ep+1}/{epochs}"):
-                images, labels = images.to(device), labels.to(device)
+            # 指标累加在设备上, 每个 epoch 只同步一次
+            total_loss = torch.zeros((), device=device)
+            correct = torch.zeros((), dtype=torch.long, device=device)
+            total = 0
+            start = time.perf_counter()
+            for batch in tqdm(train_loader, desc=f"Teacher {ep+1}/{epochs}"):
+                images, labels = batch[0].to(device), batch[1].to(device)
                 images = self.rand_augment(images)
 
                 opt.zero_grad(set_to_none=True)
-                logits = teacher(images)
-                loss = criterion(logits, labels)
+                with self.autocast():
+                    logits = teacher_fwd(images)
+                    loss = criterion(logits, labels)
                 loss.backward()
                 opt.step()
 
-                total_loss += loss.item()
-                pred = logits.argmax(1)
-                correct += (pred==labels).sum().item()
+                total_loss += loss.detach().float()
+                correct += (logits.argmax(1)==labels).sum()
                 total   += labels.size(0)
+            train_ips = total / (time.perf_counter() - start)
             for g in opt.param_groups:
                 g['lr'] = 0.05 * lr_schedule(ep)
 
-            test_acc = self.evaluate(teacher, test_loader, device)
-            print(f"Teacher Epoch {ep+1}: train_loss={total_loss/len(train_loader):.4f} | test_acc={test_acc:.2f}%")
-            if test_acc > best:
-                best = test_acc
-                torch.save(teacher.state_dict(), 'best_teacher.pth')
-        return teacher, best
+            print(f"Teacher Epoch {ep+1}: train_loss={total_loss.item()/len(train_loader):.4f} "
+                  f"| train_acc={100.0*correct.item()/total:.2f}% | train {train_ips:.0f} img/s")
+            if self._should_evaluate(ep, epochs):
+                evaluator.evaluate(ep, teacher)
+            if checkpoint_path:
+                self.save_checkpoint(evaluator, checkpoint_path, teacher, opt, ep + 1)
+        return teacher, evaluator.close()
 
     # ----------------- 在线蒸馏（α/T 调度 + 置信度加权） -----------------
-    def train_student_kd(self, train_loader, test_loader, teacher, device, epochs=60, alpha_start=0.3, alpha_end=0.9, T_start=8.0, T_end=3.0):
-        student = LeNet5().to(device)
+    def train_student_kd(self, train_loader, test_loader, teacher, device, epochs=60, alpha_start=0.3, alpha_end=0.9, T_start=8.0, T_end=3.0,
+                         teacher_cache=None, save_path='best_student.pth', epoch_callback=None, verbose=True,
+                         checkpoint_path=None, resume=False, student=None):
+        """
+        student: 初始的学生模型 (例如剪枝后的 LeNet5), 默认新建一个 LeNet5
+        teacher_cache: build_teacher_cache 得到的缓存; 给出时不再运行教师前向 (teacher 可为 None),
+        train_loader 需要同时返回样本下标 (get_data_loaders(return_index=True)),
+        每个样本随机选一个缓存的增强变体, 按该变体的参数增强图像并读取对应的教师 logits;
+        否则教师以 fuse_for_inference 的形式 (BN 折叠 + channels_last) 在线前向
+        save_path: 最优学生权重的保存路径
+        epoch_callback: 每次评估后调用 epoch_callback(ep, test_acc), 返回 True 时提前停止训练
+            (异步评估时在后台线程中调用, 训练在下一个 epoch 开始前停止)
+        verbose: 是否显示进度条和每个 epoch 的日志
+        checkpoint_path / resume: 见 train_teacher, checkpoint 中额外记录当前的 α/T
+        """
+        fused_teacher = self.maybe_compile(fuse_for_inference(teacher)) if teacher_cache is None else None
+        student = (LeNet5() if student is None else student).to(device)
+        student_fwd = self.maybe_compile(student)
         opt = optim.AdamW(student.parameters(), lr=2e-3, weight_decay=1e-4)
         def lr_schedule(ep):
             if ep < 3:
@@ -103,8 +372,13 @@ class Trainer:
             return 0.5*(1+math.cos(math.pi*t))
         kd = DistillationLoss(temperature=T_start, alpha=alpha_start, label_smoothing=0.05)
 
-        best = 0.0
-        for ep in range(epochs):
+        evaluator = self._evaluator(test_loader, device, save_path, 'KD', epoch_callback, verbose)
+        start_ep = self._resume(checkpoint_path, resume, student, opt, evaluator)
+        # 分阶段计时; 分析时 (profile_dir) 每个阶段前后同步设备, 计时才准确
+        timer = PhaseTimer(device, sync=self.profile_dir is not None)
+        for ep in range(start_ep, epochs):
+            if evaluator.stopped:
+                break
             progress = ep/(epochs-1) if epochs > 1 else 1.0
             alpha = alpha_start + (alpha_end-alpha_start)*progress
             T     = T_start - (T_start - T_end)*progress
@@ -112,45 +386,80 @@ class Trainer:
             for g in opt.param_groups:
                 g['lr'] = 2e-3 * lr_schedule(ep)
 
-            student.train(); teacher.eval()
-            tot=hard=soft=0.0; correct=total=0
-            for images, labels in tqdm(train_loader, desc=f"KD {ep+1}/{epochs} (α={alpha:.2f},T={T:.1f})"):
-                images, labels = images.to(device), labels.to(device)
-                images = self.rand_augment(images)
-
-                with torch.no_grad():
-                    t_logits = teacher(images)
-                    t_probs = torch.softmax(t_logits / T, dim=1)
-                    t_conf, _ = t_probs.max(dim=1)
-
-                s_logits = student(images)
-                loss, hard_loss, soft_loss = kd(s_logits, labels, t_logits,
-                                                alpha=alpha, temperature=T)
-
-                opt.zero_grad(set_to_none=True)
-                loss.backward()
-                torch.nn.utils.clip_grad_norm_(student.parameters(), 1.0)
-                opt.step()
-
-                tot  += loss.item()
-                hard += hard_loss.item()
-                soft += soft_loss.item()
-
-                pred = s_logits.argmax(1)
-                correct += (pred==labels).sum().item()
-                total   += labels.size(0)
-
-            test_acc = self.evaluate(student, test_loader, device)
-            print(f"KD Epoch {ep+1}: total={tot/len(train_loader):.4f} | hard={hard/len(train_loader):.4f} "
-                  f"| soft={soft/len(train_loader):.4f} | test_acc={test_acc:.2f}%")
-
-            if test_acc > best:
-                best = test_acc
-                torch.save(student.state_dict(), 'best_student.pth')
-        return best
-
-    def train_student_normal(self, train_loader, test_loader, device, epochs=6):
+            student.train()
+            sums = torch.zeros(3, device=device)  # total / hard / soft, 累加在设备上
+            correct = torch.zeros((), dtype=torch.long, device=device)
+            total = 0
+            timer.reset()
+            trace = os.path.join(self.profile_dir, 'kd_trace.json') if self.profile_dir and ep == start_ep else None
+            with profile_window(trace) as prof:
+                for batch in tqdm(timer.iterate(train_loader), total=len(train_loader),
+                                  desc=f"KD {ep+1}/{epochs} (α={alpha:.2f},T={T:.1f})", disable=not verbose):
+                    with timer.phase('data'):
+                        images, labels = batch[0].to(device), batch[1].to(device)
+                    if teacher_cache is not None:
+                        with timer.phase('teacher'):
+                            variants = torch.randint(0, teacher_cache.num_variants, (images.size(0),))
+                            t_logits, params = teacher_cache.lookup(batch[2], variants)
+                            t_logits = t_logits.to(device)
+                        with timer.phase('augment'):
+                            images = self.apply_augment(images, params)
+                    else:
+                        with timer.phase('augment'):
+                            images = self.rand_augment(images)
+                        with timer.phase('teacher'):
+                            with torch.inference_mode(), self.autocast():
+                                t_logits = fused_teacher(images).float()
+                            t_logits = t_logits.clone()  # inference tensor 不能参与之后的 autograd, 拷贝一份普通张量
+
+                    with timer.phase('forward'):
+                        with torch.no_grad():
+                            t_probs = torch.softmax(t_logits / T, dim=1)
+                            t_conf, _ = t_probs.max(dim=1)
+
+                        with self.autocast():
+                            s_logits = student_fwd(images)
+                            loss, hard_loss, soft_loss = kd(s_logits, labels, t_logits,
+                                                            alpha=alpha, temperature=T)
+
+                    with timer.phase('backward'):
+                        opt.zero_grad(set_to_none=True)
+                        loss.backward()
+                    with timer.phase('clip_grad'):
+                        torch.nn.utils.clip_grad_norm_(student.parameters(), 1.0)
+                    with timer.phase('step'):
+                        opt.step()
+
+                    with timer.phase('metrics'):
+                        sums += torch.stack([loss.detach(), hard_loss.detach(), soft_loss.detach()]).float()
+                        correct += (s_logits.argmax(1)==labels).sum()
+                        total   += labels.size(0)
+                    prof.step()
+
+            tot, hard, soft = (sums / len(train_loader)).tolist()
+            # 异步评估在后台线程中, 与训练重叠, 这里记录最近一次完成的评估耗时
+            summary = timer.summary(total, epoch=ep + 1, alpha=alpha, T=T, last_eval_seconds=self.eval_seconds)
+            teacher_seconds = timer.seconds.get('teacher', 0.0)
+            teacher_ips = f" | teacher {total / teacher_seconds:.0f} img/s" \
+                if teacher_cache is None and teacher_seconds > 0 else ""
+            if verbose:
+                print(f"KD Epoch {ep+1}: total={tot:.4f} | hard={hard:.4f} "
+                      f"| soft={soft:.4f} | train_acc={100.0*correct.item()/total:.2f}% "
+                      f"| train {summary['images_per_sec']:.0f} img/s{teacher_ips}")
+            if self.profile_dir:
+                append_json_line(os.path.join(self.profile_dir, 'kd_profile.jsonl'), summary)
+                if verbose:
+                    print(f"  {format_phases(summary)}")
+            if self._should_evaluate(ep, epochs):
+                evaluator.evaluate(ep, student)
+            if checkpoint_path:
+                self.save_checkpoint(evaluator, checkpoint_path, student, opt, ep + 1, alpha=alpha, T=T)
+        return evaluator.close()
+
+    def train_student_normal(self, train_loader, test_loader, device, epochs=6, checkpoint_path=None, resume=False):
+        """checkpoint_path / resume: 见 train_teacher"""
         student = LeNet5().to(device)
+        student_fwd = self.maybe_compile(student)
         opt = optim.AdamW(student.parameters(), lr=1.5e-3, weight_decay=1e-4)
         def lr_schedule(ep):
             if ep < 3:
@@ -159,49 +468,77 @@ class Trainer:
             return 0.5*(1+math.cos(math.pi*t))
         criterion = nn.CrossEntropyLoss(label_smoothing=0.05)
 
-        best=0.0
-        for ep in range(epochs):
+        evaluator = self._evaluator(test_loader, device, 'best_student_normal.pth', 'Normal')
+        start_ep = self._resume(checkpoint_path, resume, student, opt, evaluator)
+        for ep in range(start_ep, epochs):
             for g in opt.param_groups:
                 g['lr'] = 1.5e-3 * lr_schedule(ep)
 
             student.train()
-            total_loss=correct=total=0
-            for images, labels in tqdm(train_loader, desc=f"Normal {ep+1}/{epochs}"):
-                images, labels = images.to(device), labels.to(device)
+            total_loss = torch.zeros((), device=device)
+            correct = torch.zeros((), dtype=torch.long, device=device)
+            total = 0
+            start = time.perf_counter()
+            for batch in tqdm(train_loader, desc=f"Normal {ep+1}/{epochs}"):
+                images, labels = batch[0].to(device), batch[1].to(device)
                 images = self.rand_augment(images)
 
-                logits = student(images)
-                loss = criterion(logits, labels)
+                with self.autocast():
+                    logits = student_fwd(images)
+                    loss = criterion(logits, labels)
 
                 opt.zero_grad(set_to_none=True)
                 loss.backward()
                 torch.nn.utils.clip_grad_norm_(student.parameters(), 1.0)
                 opt.step()
 
-                total_loss += loss.item()
-                pred = logits.argmax(1)
-                correct += (pred==labels).sum().item()
+                total_loss += loss.detach().float()
+                correct += (logits.argmax(1)==labels).sum()
                 total   += labels.size(0)
-            test_acc = self.evaluate(student, test_loader, device)
-            print(f"Normal Epoch {ep+1}: loss={total_loss/len(train_loader):.4f} | test_acc={test_acc:.2f}%")
-            if test_acc > best:
-                best = test_acc
-                torch.save(student.state_dict(), 'best_student_normal.pth')
-        return best
+            train_ips = total / (time.perf_counter() - start)
+            print(f"Normal Epoch {ep+1}: loss={total_loss.item()/len(train_loader):.4f} "
+                  f"| train_acc={100.0*correct.item()/total:.2f}% | train {train_ips:.0f} img/s")
+            if self._should_evaluate(ep, epochs):
+                evaluator.evaluate(ep, student)
+            if checkpoint_path:
+                self.save_checkpoint(evaluator, checkpoint_path, student, opt, ep + 1)
+        return evaluator.close()
 
 # ----------------- 主流程 -----------------
 def main():
+    parser = argparse.ArgumentParser(description="训练教师、蒸馏学生并与普通训练对比")
+    parser.add_argument("--cpu-fast", action="store_true", help="CPU 快速路径: bfloat16 autocast, 使用全部核")
+    parser.add_argument("--compile", action="store_true", help="用 torch.compile 编译学生和教师")
+    parser.add_argument("--threads", type=int, help="算子内线程数")
+    parser.add_argument("--interop-threads", type=int, help="算子间线程数")
+    parser.add_argument("--eval-interval", type=int, default=1, help="每隔多少个 epoch 评估一次")
+    parser.add_argument("--sync-eval", action="store_true", help="在训练线程中评估 (默认在后台线程中评估)")
+    parser.add_argument("--ckpt-dir", default="checkpoints", help="完整 checkpoint 的保存目录")
+    parser.add_argument("--resume", action="store_true", help="从 ckpt-dir 中的 checkpoint 继续, 已完成的阶段直接跳过")
+    parser.add_argument("--profile-dir", help="输出蒸馏训练各阶段的耗时 (JSON) 和 Chrome trace")
+    args = parser.parse_args()
+
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     print(f"Using device: {device}")
 
-    train_loader, test_loader = get_data_loaders(batch_size=128)
+    train_loader, test_loader = get_data_loaders(batch_size=128, preload=True, num_workers=0, return_index=True)
 
-    trainer = Trainer(device)  # ← 实例化
+    trainer = Trainer(device, cpu_fast=args.cpu_fast, compile=args.compile,
+                      num_threads=args.threads, interop_threads=args.interop_threads,
+                      async_eval=not args.sync_eval, eval_interval=args.eval_interval,
+                      profile_dir=args.profile_dir)  # ← 实例化
+    os.makedirs(args.ckpt_dir, exist_ok=True)
+    ckpt = lambda name: os.path.join(args.ckpt_dir, f"ckpt_{name}.pth")
 
     # 调用成员函数
-    teacher, teacher_acc = trainer.train_teacher(train_loader, test_loader, device, epochs=30)
-    kd_acc = trainer.train_student_kd(train_loader, test_loader, teacher, device,epochs=60, alpha_start=0.3, alpha_end=0.9, T_start=8.0, T_end=3.0)
-    normal_acc = trainer.train_student_normal(train_loader, test_loader, device, epochs=60)
+    teacher, teacher_acc = trainer.train_teacher(train_loader, test_loader, device, epochs=30,
+                                                 checkpoint_path=ckpt("teacher"), resume=args.resume)
+    # 教师 logits 只算一次, 每个样本缓存4个增强变体
+    teacher_cache = trainer.build_teacher_cache(teacher, train_loader.dataset, device, num_variants=4)
+    kd_acc = trainer.train_student_kd(train_loader, test_loader, teacher, device,epochs=60, alpha_start=0.3, alpha_end=0.9, T_start=8.0, T_end=3.0,
+                                      teacher_cache=teacher_cache, checkpoint_path=ckpt("student_kd"), resume=args.resume)
+    normal_acc = trainer.train_student_normal(train_loader, test_loader, device, epochs=60,
+                                              checkpoint_path=ckpt("student_normal"), resume=args.resume)
 
     print(f"Teacher Model (ResNet) Accuracy:          {teacher_acc:6.2f}%")
     print(f"Student with Optimized Distillation:      {kd_acc:6.2f}%")
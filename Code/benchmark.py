@@ -0,0 +1,439 @@
+"""
+性能基准测试
+覆盖仿真模型的各层算子 (float/rtl)、整网 predict 的延迟和吞吐、hex 编解码、权重加载、数据集读取、
+数据增强和一步训练 (KD 学生 / 教师); 输入均由固定种子生成, 结果写成 JSON,
+--compare 与保存的基线比较, 中位数变慢超过阈值的记为回归, 有回归时返回码为 1
+
+示例:
+  python benchmark.py --output baseline.json
+  python benchmark.py --output new.json --compare baseline.json --threshold 0.1
+  python benchmark.py --only sim. hex. --repeat 10
+"""
+import argparse
+import gzip
+import json
+import os
+import platform
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import simulate
+from hexCodec import bits_to_hex, float16_to_hex, hex_to_bits
+from rtlFloat import conv_mac16, linear_mac32
+
+CNN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CNN")
+SEED = 0
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    注册一个基准测试
+    被装饰的函数做准备工作, 返回 (fn, items, unit): fn 为被计时的无参函数, 每次调用处理 items 个 unit
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def time_it(fn, repeat=5, warmup=1, min_time=0.2):
+    """
+    先调用 warmup 次, 再确定每轮的调用次数使一轮至少 min_time 秒, 共计时 repeat 轮
+    返回每次调用的耗时 (秒) 列表, 每轮一个
+    """
+    for _ in range(warmup):
+        fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+def _rng():
+    return np.random.default_rng(SEED)
+
+
+def _images(n):
+    """固定种子的 (n, 1, 32, 32) FP16 图片, 像素范围 0-1"""
+    return _rng().random((n, 1, 32, 32)).astype(np.float16)
+
+
+# ---------------- 仿真模型 ----------------
+def _layer_inputs(sim, batch):
+    """用真实权重前向一次, 得到每层的输入"""
+    trace = {}
+    sim.forward(_images(batch).astype(np.float32), "float", trace)
+    return trace
+
+
+def _register_sim_kernels():
+    inputs = {"conv1": None, "conv2": "pool1", "conv3": "pool2", "fc1": "ann_in", "fc2": "relu_fc1",
+              "fc3": "relu_fc2", "fc4": "relu_fc3"}
+    for name, src in inputs.items():
+        def setup(name=name, src=src, batch=64):
+            sim = simulate.default_sim()
+            trace = _layer_inputs(sim, batch)
+            x = _images(batch).astype(np.float64) if src is None else trace[src]
+            w = sim.weights[name]
+            if name.startswith("conv"):
+                padding = dict(simulate.CONV_LAYERS)[name]
+                return (lambda: simulate.conv2d(x, w, padding=padding)), batch, "img"
+            return (lambda: simulate.linear(x, w)), batch, "img"
+        benchmark(f"sim.float.{name}")(setup)
+
+        def setup_rtl(name=name, src=src, batch=16):
+            sim = simulate.default_sim()
+            trace = _layer_inputs(sim, batch)
+            w = sim.bits[name]
+            if name.startswith("conv"):
+                x = (_images(batch) if src is None else trace[src].astype(np.float16)).view(np.uint16)
+                C_out, _, kH, kW = w.shape
+                cols = simulate.im2col(x, kH, kW, padding=dict(simulate.CONV_LAYERS)[name])
+                w2 = w.reshape(C_out, -1)
+                return (lambda: conv_mac16(cols, w2)), batch, "img"
+            x = trace[src].astype(np.float32).view(np.uint32)
+            return (lambda: linear_mac32(x, w)), batch, "img"
+        benchmark(f"sim.rtl.{name}")(setup_rtl)
+
+
+_register_sim_kernels()
+
+
+@benchmark("sim.float.maxpool")
+def _bench_maxpool(batch=64):
+    x = _rng().random((batch, 6, 32, 32))
+    return (lambda: simulate.maxpool2d(x)), batch, "img"
+
+
+@benchmark("sim.predict.latency")
+def _bench_predict_latency():
+    sim = simulate.default_sim()
+    x = _images(1)
+    return (lambda: sim.predict_batch(x)), 1, "img"
+
+
+@benchmark("sim.predict.float_batch")
+def _bench_predict_float(batch=512):
+    sim = simulate.default_sim()
+    x = _images(batch)
+    return (lambda: sim.predict_batch(x)), batch, "img"
+
+
+@benchmark("sim.predict.rtl_batch")
+def _bench_predict_rtl(batch=32):
+    sim = simulate.default_sim()
+    x = _images(batch)
+    return (lambda: sim.predict_batch(x, mode="rtl")), batch, "img"
+
+
+# ---------------- hex 编解码与权重加载 ----------------
+@benchmark("hex.encode16")
+def _bench_hex_encode(n=256):
+    x = _images(n).reshape(n, -1)
+    return (lambda: [float16_to_hex(row, " ") for row in x]), n * 1024, "value"
+
+
+@benchmark("hex.decode16")
+def _bench_hex_decode(n=256):
+    text = "".join(float16_to_hex(row, " ") + "\n" for row in _images(n).reshape(n, -1))
+    return (lambda: hex_to_bits(text, 16)), n * 1024, "value"
+
+
+@benchmark("hex.encode32")
+def _bench_hex_encode32(n=1 << 16):
+    bits = _rng().integers(0, 1 << 32, n, dtype=np.uint32)
+    return (lambda: bits_to_hex(bits, 32)), n, "value"
+
+
+@benchmark("weights.parse_hex")
+def _bench_parse_hex():
+    sim = simulate.LeNetSim()
+    texts = sim._read_texts()
+    shapes = sim._layer_shapes(texts)
+    n = sum(int(np.prod(s)) for s in shapes.values())
+    return (lambda: sim._parse_hex(texts, shapes)), n, "value"
+
+
+@benchmark("weights.load")
+def _bench_load_weights():
+    """LeNetSim.load 的完整过程 (读 hex、校验和、读 bundle)"""
+    simulate.LeNetSim().load()  # 确保 bundle 已生成
+    n = sum(b.size for b in simulate.LeNetSim().load().values())
+    return (lambda: simulate.LeNetSim().load()), n, "value"
+
+
+# ---------------- 数据集 ----------------
+def _write_idx(path, array):
+    """写 gzip 压缩的 IDX 文件 (uint8)"""
+    magic = 0x800 | array.ndim
+    with gzip.open(path, "wb") as f:
+        f.write(struct.pack(">I", magic) + b"".join(struct.pack(">I", d) for d in array.shape))
+        f.write(array.astype(np.uint8).tobytes())
+
+
+def _synthetic_dataset(n=10000):
+    """固定种子的 IDX 数据集 (与 SPOTS-10 的文件名和格式相同), 返回目录"""
+    root = os.path.join(tempfile.gettempdir(), f"spot10_bench_{n}")
+    images = os.path.join(root, "test-images-idx3-ubyte.gz")
+    if not os.path.exists(images):
+        os.makedirs(root, exist_ok=True)
+        rng = _rng()
+        _write_idx(images, rng.integers(0, 256, (n, 32, 32)))
+        _write_idx(os.path.join(root, "test-labels-idx1-ubyte.gz"), rng.integers(0, 10, n))
+    return root
+
+
+@benchmark("data.get_data.gz")
+def _bench_get_data_gz(n=10000):
+    from data_loader import SPOT10Loader
+    root = _synthetic_dataset(n)
+    return (lambda: SPOT10Loader.get_data(root, "test", use_cache=False)), n, "img"
+
+
+@benchmark("data.get_data.cached")
+def _bench_get_data_cached(n=10000):
+    from data_loader import SPOT10Loader
+    root = _synthetic_dataset(n)
+    SPOT10Loader.get_data(root, "test")  # 生成 .npy 缓存
+    return (lambda: SPOT10Loader.get_data(root, "test")), n, "img"
+
+
+# ---------------- 训练 ----------------
+def _batch(batch):
+    import torch
+    g = torch.Generator().manual_seed(SEED)
+    return torch.rand(batch, 1, 32, 32, generator=g), torch.randint(0, 10, (batch,), generator=g)
+
+
+@benchmark("train.rand_augment")
+def _bench_rand_augment(batch=128):
+    import torch
+    from train import Trainer
+    trainer = Trainer("cpu")
+    images, _ = _batch(batch)
+    g = torch.Generator().manual_seed(SEED)
+    return (lambda: trainer.rand_augment(images, generator=g)), batch, "img"
+
+
+@benchmark("train.rand_augment.shared")
+def _bench_rand_augment_shared(batch=128):
+    """对照: 改为逐样本增强之前, 整个批次共用一个裁剪偏移、一半概率共用一个旋转角的写法"""
+    import math
+    import random
+
+    import torch
+    import torch.nn.functional as F
+    rng = random.Random(SEED)
+    images, _ = _batch(batch)
+
+    def augment():
+        x = F.pad(images, (2, 2, 2, 2), mode="reflect")
+        top, left = rng.randint(0, 4), rng.randint(0, 4)
+        x = x[..., top:top + 32, left:left + 32]
+        if rng.random() < 0.5:
+            angle = (rng.random() * 20 - 10.0) * math.pi / 180.0
+            theta = torch.tensor([[math.cos(angle), -math.sin(angle), 0.0],
+                                  [math.sin(angle), math.cos(angle), 0.0]]).unsqueeze(0).repeat(x.size(0), 1, 1)
+            x = F.grid_sample(x, F.affine_grid(theta, x.size(), align_corners=False), mode="bilinear",
+                              padding_mode="border", align_corners=False)
+        return x
+    return augment, batch, "img"
+
+
+@benchmark("train.kd_step.student")
+def _bench_kd_step(batch=128):
+    """一步蒸馏 (教师 logits 取自缓存): 增强 + 学生前向 + KD 损失 + 反向 + 裁剪 + AdamW"""
+    import torch
+    from loss import DistillationLoss
+    from model import LeNet5
+    from train import Trainer
+
+    torch.manual_seed(SEED)
+    trainer = Trainer("cpu")
+    student = LeNet5()
+    opt = torch.optim.AdamW(student.parameters(), lr=2e-3, weight_decay=1e-4)
+    kd = DistillationLoss(temperature=8.0, alpha=0.3, label_smoothing=0.05)
+    images, labels = _batch(batch)
+    t_logits = torch.randn(batch, 10, generator=torch.Generator().manual_seed(SEED))
+    params = Trainer.sample_augment_params(batch, torch.Generator().manual_seed(SEED))
+
+    def step():
+        x = trainer.apply_augment(images, params)
+        loss, _, _ = kd(student(x), labels, t_logits, alpha=0.3, temperature=8.0)
+        opt.zero_grad(set_to_none=True)
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(student.parameters(), 1.0)
+        opt.step()
+    return step, batch, "img"
+
+
+@benchmark("train.kd_step.teacher_forward")
+def _bench_teacher_forward(batch=128):
+    """在线蒸馏时的教师前向 (BN 折叠 + channels_last)"""
+    import torch
+    from model import SimpleResNetTeacher, fuse_for_inference
+
+    torch.manual_seed(SEED)
+    teacher = fuse_for_inference(SimpleResNetTeacher())
+    images, _ = _batch(batch)
+
+    def forward():
+        with torch.inference_mode():
+            teacher(images)
+    return forward, batch, "img"
+
+
+@benchmark("train.teacher_step")
+def _bench_teacher_step(batch=128):
+    """一步教师训练: 前向 + 交叉熵 + 反向 + SGD"""
+    import torch
+    from model import SimpleResNetTeacher
+
+    torch.manual_seed(SEED)
+    teacher = SimpleResNetTeacher().train()
+    opt = torch.optim.SGD(teacher.parameters(), lr=0.05, momentum=0.9, weight_decay=5e-4, nesterov=True)
+    criterion = torch.nn.CrossEntropyLoss(label_smoothing=0.05)
+    images, labels = _batch(batch)
+
+    def step():
+        loss = criterion(teacher(images), labels)
+        opt.zero_grad(set_to_none=True)
+        loss.backward()
+        opt.step()
+    return step, batch, "img"
+
+
+# ---------------- 运行与比较 ----------------
+def environment():
+    """记录结果对应的环境, 比较不同机器上的结果时用于排查"""
+    env = {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+           "processor": platform.processor(), "cpu_count": os.cpu_count(), "seed": SEED}
+    try:
+        env["git_commit"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        pass
+    try:
+        import torch
+        env["torch"] = torch.__version__
+        env["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return env
+
+
+def run_benchmarks(names, repeat=5, warmup=1, min_time=0.2, verbose=True):
+    """返回 {名字: {median_s, min_s, stdev_s, rate, unit, items, repeat}}"""
+    results = {}
+    for name in names:
+        fn, items, unit = BENCHMARKS[name]()
+        times = time_it(fn, repeat, warmup, min_time)
+        median = statistics.median(times)
+        results[name] = {"median_s": median, "min_s": min(times),
+                         "stdev_s": statistics.stdev(times) if len(times) > 1 else 0.0,
+                         "rate": items / median if median > 0 else float("inf"), "unit": f"{unit}/s",
+                         "items": items, "repeat": len(times)}
+        if verbose:
+            print(format_result(name, results[name]), flush=True)
+    return results
+
+
+def format_result(name, r):
+    return f"{name:<32} {r['median_s'] * 1e3:>10.3f} ms  ±{r['stdev_s'] * 1e3:>8.3f}  {r['rate']:>14,.0f} {r['unit']}"
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    按中位数比较, 慢于基线 (1+threshold) 倍的记为 regression, 快于 1/(1+threshold) 倍的记为 faster
+    返回 [(名字, 基线中位数, 当前中位数, 比值, 状态)], 只包含两边都有的基准
+    """
+    rows = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]["median_s"]
+        ratio = r["median_s"] / base if base > 0 else float("inf")
+        status = "regression" if ratio > 1 + threshold else "faster" if ratio < 1 / (1 + threshold) else "ok"
+        rows.append((name, base, r["median_s"], ratio, status))
+    return rows
+
+
+def format_compare(rows):
+    lines = [f"{'benchmark':<32} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}  status"]
+    for name, base, cur, ratio, status in rows:
+        mark = "  <<<" if status == "regression" else ""
+        lines.append(f"{name:<32} {base * 1e3:>12.3f} {cur * 1e3:>12.3f} {ratio:>7.2f}  {status}{mark}")
+    return "\n".join(lines)
+
+
+def select(only=None, skip_torch=False):
+    names = [n for n in BENCHMARKS if not only or any(n.startswith(p) for p in only)]
+    if skip_torch:
+        names = [n for n in names if not n.startswith(("data.", "train."))]
+    return names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="仿真模型、编解码、数据读取和训练的性能基准")
+    parser.add_argument("--only", nargs="+", help="只运行名字以这些前缀开头的基准, 如 sim. hex.")
+    parser.add_argument("--skip-torch", action="store_true", help="跳过需要 torch 的数据集和训练基准")
+    parser.add_argument("--list", action="store_true", help="列出所有基准")
+    parser.add_argument("--repeat", type=int, default=5, help="计时轮数")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮的最短时间 (秒)")
+    parser.add_argument("--threads", type=int, default=1, help="torch 线程数, 固定以便结果可比")
+    parser.add_argument("--output", help="结果 JSON 文件")
+    parser.add_argument("--compare", help="基线 JSON 文件")
+    parser.add_argument("--threshold", type=float, default=0.1, help="中位数变慢超过该比例记为回归")
+    args = parser.parse_args()
+
+    names = select(args.only, args.skip_torch)
+    if args.list:
+        print("\n".join(names))
+        sys.exit(0)
+    if not args.skip_torch:
+        sys.path.insert(0, CNN_DIR)
+        try:
+            import torch
+            torch.set_num_threads(args.threads)
+            torch.manual_seed(SEED)
+        except ImportError:
+            print("torch not available, skipping data./train. benchmarks")
+            names = select(args.only, skip_torch=True)
+
+    report = {"environment": environment(), "settings": {"repeat": args.repeat, "warmup": args.warmup,
+                                                         "min_time": args.min_time, "threads": args.threads},
+              "results": run_benchmarks(names, args.repeat, args.warmup, args.min_time)}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        rows = compare(report["results"], baseline["results"], args.threshold)
+        print()
+        print(format_compare(rows))
+        regressions = [r[0] for r in rows if r[4] == "regression"]
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
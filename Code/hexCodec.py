@@ -0,0 +1,100 @@
+"""
+FP16 / FP32 (以及 8 位整数) 十六进制文本与 numpy 数组之间的批量编解码
+十六进制文本均为大端 ($readmemh 的格式), 每个 FP16 占4个字符, FP32 占8个字符, 8 位整数占2个字符,
+既可以用空白符(空格/换行)分隔, 也可以直接拼接在一起
+"""
+import numpy as np
+
+_BITS_DTYPE = {8: np.uint8, 16: np.uint16, 32: np.uint32}
+_FLOAT_DTYPE = {16: np.float16, 32: np.float32}
+
+
+def _check_width(width):
+    if width not in _BITS_DTYPE:
+        raise ValueError(f"width must be 8, 16 or 32, got {width}")
+
+
+def hex_to_bits(text, width=16):
+    """十六进制文本 -> uint8/uint16/uint32 位模式数组 (一维)"""
+    _check_width(width)
+    if isinstance(text, bytes):
+        text = text.decode("ascii")
+    digits = "".join(text.split())
+    if len(digits) % (width // 4):
+        raise ValueError(f"hex length {len(digits)} is not a multiple of {width // 4}")
+    raw = np.frombuffer(bytes.fromhex(digits), dtype=np.dtype(_BITS_DTYPE[width]).newbyteorder(">"))
+    return raw.astype(_BITS_DTYPE[width])
+
+
+def bits_to_hex(bits, width=16, sep=""):
+    """
+    uint8/uint16/uint32 位模式数组 -> 小写十六进制文本
+    sep 为每个数之间的分隔符, 为空时直接拼接
+    """
+    _check_width(width)
+    digits = np.asarray(bits, dtype=_BITS_DTYPE[width]).ravel().astype(
+        np.dtype(_BITS_DTYPE[width]).newbyteorder(">")).tobytes().hex()
+    if not sep or not digits:
+        return digits
+
+    # 用字符矩阵一次性插入分隔符
+    n = width // 4
+    chars = np.frombuffer(digits.encode("ascii"), dtype=np.uint8).reshape(-1, n)
+    sep_bytes = np.frombuffer(sep.encode("ascii"), dtype=np.uint8)
+    out = np.empty((chars.shape[0], n + len(sep_bytes)), dtype=np.uint8)
+    out[:, :n] = chars
+    out[:, n:] = sep_bytes
+    return out.tobytes()[:-len(sep_bytes)].decode("ascii")
+
+
+def hex_to_float16(text):
+    """十六进制文本 -> float16 数组"""
+    return hex_to_bits(text, 16).view(np.float16)
+
+
+def hex_to_float32(text):
+    """十六进制文本 -> float32 数组"""
+    return hex_to_bits(text, 32).view(np.float32)
+
+
+def float16_to_hex(values, sep=""):
+    """数值数组 -> FP16 十六进制文本 (就近舍入到 float16)"""
+    return bits_to_hex(np.asarray(values, dtype=np.float16).view(np.uint16), 16, sep)
+
+
+def float32_to_hex(values, sep=""):
+    """数值数组 -> FP32 十六进制文本"""
+    return bits_to_hex(np.asarray(values, dtype=np.float32).view(np.uint32), 32, sep)
+
+
+def load_hex(filename, width=16):
+    """读取整个十六进制文件, 返回位模式数组"""
+    with open(filename, "r") as f:
+        return hex_to_bits(f.read(), width)
+
+
+# ---------------- 单个数值的转换 ----------------
+def hex4_to_float16(hexStr) -> float:
+    """
+    将4个16进制字符串（每个1位，合起来16位）
+    转换为IEEE 754半精度浮点数，并返回float值。
+    例如: '3c00' -> 1.0
+    """
+    if len(hexStr) != 4:
+        raise ValueError("必须传入4个16进制字符串")
+    return float(hex_to_float16("".join(hexStr))[0])
+
+
+def float16_to_hex4(value: float) -> str:
+    """将一个浮点数转换为 IEEE 754 半精度浮点数 (float16)，并输出4位16进制字符串"""
+    return float16_to_hex(value)
+
+
+def hex_to_float(hex_str):
+    """将8位16进制字符串转为IEEE754单精度浮点数"""
+    return float(hex_to_float32(hex_str)[0])
+
+
+def float_to_hex(f):
+    """将IEEE754单精度浮点数转为8位16进制字符串"""
+    return float32_to_hex(f)
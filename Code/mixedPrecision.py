@@ -0,0 +1,298 @@
+"""
+逐层混合精度的探索
+每层的权重、激活 (该层的输入) 和累加器可以分别指定数值格式: fp32/fp16/bf16, 或任意的 eXmY
+(X 位指数, Y 位尾数), 后缀 :trunc 表示截断 (与 RTL 的 floatAdd/floatMult 一致), 默认就近舍入 (ties-to-even);
+指数下溢时清零, 后缀 :sub 保留非规格数
+累加器指定格式时按 convUnit / ANNfull 的顺序逐项乘累加, 每次乘法和加法后都舍入到该格式,
+不指定时用 float64 矩阵乘
+这里的舍入是对精确结果舍入, 与 rtlFloat 的按位模拟 (对阶时先截断加数、指数的上溢/回绕) 不完全相同,
+所以 HARDWARE 只是当前硬件的近似; 以它为基准时, 表中的 reference 行用按位精确的 rtl 模式,
+hardware 行给出近似本身的误差
+
+注意: 权重取自导出的 hex 文件 (卷积 FP16, 全连接 FP32), 比导出格式更宽的权重格式没有效果
+
+LeNetSim.forward / predict_batch / SimPool 的 mode 可以直接传入 parse_spec 的结果
+
+示例:
+  python mixedPrecision.py --formats fp16 bf16 e5m7 e4m3 --parts weights activations --workers 8
+  python mixedPrecision.py --configs configs.json --output mixed.json
+"""
+import argparse
+import collections
+import csv
+import json
+import os
+
+import numpy as np
+
+from simulate import (CONV_LAYERS, FC_LAYERS, WEIGHT_DIR, LeNetSim, SimPool, _record, im2col, iter_hex_images,
+                      maxpool2d, relu)
+
+NumFormat = collections.namedtuple("NumFormat", ["exp_bits", "man_bits", "rounding", "subnormals"])
+LayerFormat = collections.namedtuple("LayerFormat", ["weights", "activations", "accum"])
+
+NAMED_FORMATS = {"fp32": (8, 23), "fp16": (5, 10), "bf16": (8, 7), "tf32": (8, 10)}
+PARTS = LayerFormat._fields
+LAYERS = tuple(name for name, _ in CONV_LAYERS) + FC_LAYERS
+
+# 当前硬件的近似: 卷积为 FP16 的 processingElement16, 全连接为 FP32 的 floatAdd/floatMult, 均为截断
+HARDWARE = {"conv": {"weights": "fp16", "activations": "fp16", "accum": "fp16:trunc"},
+            "fc": {"weights": "fp32", "activations": "fp32", "accum": "fp32:trunc"}}
+
+
+# ---------------- 数值格式 ----------------
+def parse_format(text):
+    """
+    "fp16" / "bf16:trunc" / "e4m3:sub" ... -> NumFormat; "fp64" / "none" / None -> None (不舍入)
+    """
+    if text is None or isinstance(text, NumFormat):
+        return text
+    name, *options = text.lower().split(":")
+    if name in ("fp64", "none"):
+        return None
+    if name in NAMED_FORMATS:
+        exp_bits, man_bits = NAMED_FORMATS[name]
+    elif name.startswith("e") and "m" in name:
+        exp_bits, man_bits = (int(v) for v in name[1:].split("m"))
+    else:
+        raise ValueError(f"Unknown format {text!r}, expected fp32/fp16/bf16/tf32/eXmY")
+    unknown = set(options) - {"trunc", "rne", "sub"}
+    if unknown:
+        raise ValueError(f"Unknown format options {sorted(unknown)} in {text!r}")
+    if not 2 <= exp_bits <= 11 or not 0 <= man_bits <= 52:
+        raise ValueError(f"Unsupported format {text!r}")
+    return NumFormat(exp_bits, man_bits, "trunc" if "trunc" in options else "rne", "sub" in options)
+
+
+def format_name(fmt):
+    if fmt is None:
+        return "fp64"
+    named = {v: k for k, v in NAMED_FORMATS.items()}
+    name = named.get((fmt.exp_bits, fmt.man_bits), f"e{fmt.exp_bits}m{fmt.man_bits}")
+    return name + (":trunc" if fmt.rounding == "trunc" else "") + (":sub" if fmt.subnormals else "")
+
+
+def quantize(x, fmt):
+    """
+    把 float64 数组舍入到 fmt 表示的值 (结果仍为 float64)
+    上溢: 就近舍入时为 inf, 截断时为最大有限值; 下溢: 清零, 或按非规格数的步长舍入
+    """
+    if fmt is None:
+        return x
+    x = np.asarray(x, dtype=np.float64)
+    bias = (1 << (fmt.exp_bits - 1)) - 1
+    min_normal = 2.0 ** (1 - bias)
+    max_value = (2.0 - 2.0 ** -fmt.man_bits) * 2.0 ** bias
+    round_fn = np.trunc if fmt.rounding == "trunc" else np.rint
+
+    mantissa, exp = np.frexp(x)  # x = mantissa * 2^exp, 0.5 <= |mantissa| < 1
+    if fmt.subnormals:
+        # 非规格数的步长固定为 min_normal * 2^-man_bits
+        exp = np.maximum(exp, 2 - bias)
+        mantissa = np.ldexp(x, -exp)
+    y = np.ldexp(round_fn(np.ldexp(mantissa, fmt.man_bits + 1)), exp - fmt.man_bits - 1)
+    if not fmt.subnormals:
+        y = np.where(np.abs(y) < min_normal, 0.0, y)
+    overflow = np.copysign(np.inf if fmt.rounding == "rne" else max_value, y)
+    return np.where(np.abs(y) > max_value, overflow, y)
+
+
+# ---------------- 配置 ----------------
+def parse_spec(spec):
+    """
+    {层名或 "conv"/"fc": 格式} -> {层名: LayerFormat}
+    格式为字符串时权重/激活/累加器相同, 为 dict (或 LayerFormat) 时可分别给出 weights/activations/accum, 缺省为不舍入;
+    单独的层名覆盖 "conv"/"fc" 中的设置
+    """
+    unknown = set(spec) - set(LAYERS) - {"conv", "fc"}
+    if unknown:
+        raise ValueError(f"Unknown layers {sorted(unknown)}")
+    result = {}
+    for name in LAYERS:
+        merged = {}
+        for key in ("conv" if name.startswith("conv") else "fc", name):
+            value = spec.get(key)
+            if isinstance(value, LayerFormat):
+                value = value._asdict()
+            elif isinstance(value, (str, NumFormat)):
+                value = dict.fromkeys(PARTS, value)
+            merged.update(value or {})
+        unknown = set(merged) - set(PARTS)
+        if unknown:
+            raise ValueError(f"Unknown parts {sorted(unknown)} for {name}, expected {PARTS}")
+        result[name] = LayerFormat(*(parse_format(merged.get(part)) for part in PARTS))
+    return result
+
+
+def describe_spec(spec):
+    """{层名: "权重/激活/累加器"}"""
+    return {name: "/".join(format_name(f) for f in layer) for name, layer in spec.items()}
+
+
+# ---------------- 前向 ----------------
+def mac(cols, w, fmt):
+    """
+    用一个累加器按 k = 0, ..., K-1 的顺序乘累加, 每次乘法和加法后舍入到 fmt
+    cols: (..., K), w: (C_out, K); 调用方按 RTL 的顺序排列 K
+    (卷积为 (C, kH, kW) 的逆序, 同 conv_mac16; 全连接为地址顺序, 同 linear_mac32)
+    返回: (..., C_out)
+    """
+    acc = quantize(cols[..., 0, np.newaxis] * w[:, 0], fmt)
+    for k in range(1, cols.shape[-1]):
+        acc = quantize(quantize(cols[..., k, np.newaxis] * w[:, k], fmt) + acc, fmt)
+    return acc
+
+
+def forward_mixed(sim, x, spec, trace=None):
+    """
+    按 spec ({层名: LayerFormat}) 的格式前向
+    x: (N, 1, 32, 32) -> (N, 10) logits (float64)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    for i, (name, padding) in enumerate(CONV_LAYERS, 1):
+        fmt = spec[name]
+        w = quantize(sim.weights[name], fmt.weights)
+        x = quantize(x, fmt.activations)
+        C_out, _, kH, kW = w.shape
+        cols = im2col(x, kH, kW, padding=padding)
+        if fmt.accum is None:
+            y = cols @ w.reshape(C_out, -1).T
+        else:
+            y = mac(cols[..., ::-1], w.reshape(C_out, -1)[:, ::-1], fmt.accum)
+        x = _record(trace, name, y.transpose(0, 3, 1, 2))
+        x = _record(trace, f"relu{i}", relu(x))
+        x = _record(trace, f"pool{i}", maxpool2d(x))
+
+    x = _record(trace, "ann_in", x.reshape(x.shape[0], -1))
+    for i, name in enumerate(FC_LAYERS, 1):
+        fmt = spec[name]
+        w = quantize(sim.weights[name], fmt.weights)
+        x = quantize(x, fmt.activations)
+        y = x @ w if fmt.accum is None else mac(x, w.T, fmt.accum)
+        x = _record(trace, name, y)
+        if i < len(FC_LAYERS):
+            x = _record(trace, f"relu_{name}", relu(x))
+    return x
+
+
+# ---------------- 搜索 ----------------
+def make_configs(formats, parts=PARTS, layers=LAYERS, reference=None):
+    """
+    以 reference (默认为当前硬件的近似 HARDWARE) 为基准, 每次只把一层的一个部分换成 formats 中的一种,
+    另外加上所有层、所有 parts 统一为同一格式的配置
+    返回 [(名字, spec 或 mode)], 第一个为 reference; 未给出 reference 时它是按位精确的 "rtl" 模式,
+    紧接着是近似的 "hardware"
+    """
+    if reference:
+        reference = parse_spec(reference)
+        configs = [("reference", reference)]
+    else:
+        reference = parse_spec(HARDWARE)
+        configs = [("reference", "rtl"), ("hardware", reference)]
+    configs.append(("fp64", parse_spec({})))
+    for text in formats:
+        fmt = parse_format(text)
+        configs.append((f"all.{text}", {name: layer._replace(**dict.fromkeys(parts, fmt))
+                                        for name, layer in reference.items()}))
+        for name in layers:
+            for part in parts:
+                if getattr(reference[name], part) != fmt:
+                    configs.append((f"{name}.{part}={text}", dict(reference, **{name: reference[name]._replace(
+                        **{part: fmt})})))
+    return configs
+
+
+def run_sweep(configs, images, labels, weight_dir=WEIGHT_DIR, workers=1, verbose=True):
+    """
+    逐个配置在测试集上推理, 返回 [{name, accuracy, delta, agreement, formats}]
+    delta 为相对第一个配置的准确率变化 (百分点), agreement 为与其预测相同的比例
+    """
+    if workers > 1:
+        sim = SimPool(weight_dir, workers, chunk_size=max(1, min(256, len(images) // workers)))
+    else:
+        sim = LeNetSim(weight_dir)
+    results = []
+    ref_predictions = None
+    try:
+        for name, spec in configs:
+            predictions, _ = sim.predict_batch(images, mode=spec)
+            accuracy = float(np.mean(predictions == labels)) * 100
+            if ref_predictions is None:
+                ref_predictions, ref_accuracy = predictions, accuracy
+            formats = describe_spec(spec) if isinstance(spec, dict) else dict.fromkeys(LAYERS, spec)
+            results.append({"name": name, "accuracy": accuracy, "delta": accuracy - ref_accuracy,
+                            "agreement": float(np.mean(predictions == ref_predictions)) * 100, "formats": formats})
+            if verbose:
+                print(format_row(results[-1]), flush=True)
+    finally:
+        if workers > 1:
+            sim.close()
+    return results
+
+
+def format_row(r):
+    return f"{r['name']:<36} {r['accuracy']:>7.2f}% {r['delta']:>+7.2f} {r['agreement']:>8.2f}%"
+
+
+def save_results(results, path):
+    """写 JSON, 并在同名 .csv 中每个配置一行 (各层格式为 权重/激活/累加器)"""
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    with open(os.path.splitext(path)[0] + ".csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "accuracy", "delta", "agreement", *LAYERS])
+        for r in results:
+            writer.writerow([r["name"], f"{r['accuracy']:.2f}", f"{r['delta']:.2f}", f"{r['agreement']:.2f}",
+                             *(r["formats"][name] for name in LAYERS)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="逐层混合精度搜索")
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data")
+    parser.add_argument("--images", default=os.path.join(data_dir, "test_images_hex.txt"))
+    parser.add_argument("--labels", default=os.path.join(data_dir, "test_labels.txt"))
+    parser.add_argument("--weights", default=WEIGHT_DIR)
+    parser.add_argument("--formats", nargs="+", default=["fp16", "bf16", "e5m7", "e4m3", "e5m2"],
+                        help="候选格式, 如 fp16 bf16:trunc e4m3")
+    parser.add_argument("--parts", nargs="+", choices=PARTS, default=list(PARTS), help="逐层替换的部分")
+    parser.add_argument("--layers", nargs="+", choices=LAYERS, default=list(LAYERS))
+    parser.add_argument("--reference", help="基准配置的 JSON 文件, 默认为当前硬件的格式")
+    parser.add_argument("--exact-accum", action="store_true",
+                        help="基准的累加器不舍入 (float64 矩阵乘), 只搜索权重和激活; 逐项模拟累加器约慢 50 倍")
+    parser.add_argument("--configs", help="JSON 文件 {名字: spec}, 给出时只运行这些配置 (加上基准)")
+    parser.add_argument("--limit", type=int, help="只用前 N 张图 (默认整个测试集)")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", default="mixed_precision.json")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="准确率下降不超过该值 (百分点) 的配置单独列出")
+    args = parser.parse_args()
+
+    images = np.concatenate(list(iter_hex_images(args.images)))
+    with open(args.labels, "r") as f:
+        labels = np.array([int(line) for line in f if line.strip()], dtype=np.int64)
+    if len(labels) != len(images):
+        raise ValueError(f"{len(images)} images but {len(labels)} labels")
+    if args.limit:
+        images, labels = images[:args.limit], labels[:args.limit]
+
+    reference = None
+    if args.reference:
+        with open(args.reference, "r") as f:
+            reference = json.load(f)
+    if args.exact_accum:
+        reference = {name: layer._replace(accum=None) for name, layer in parse_spec(reference or HARDWARE).items()}
+        args.parts = [p for p in args.parts if p != "accum"]
+    if args.configs:
+        with open(args.configs, "r") as f:
+            configs = [("reference", parse_spec(reference) if reference else "rtl")]
+            configs += [(name, parse_spec(spec)) for name, spec in json.load(f).items()]
+    else:
+        configs = make_configs(args.formats, args.parts, args.layers, reference)
+
+    print(f"{len(configs)} configs on {len(images)} images")
+    print(f"{'config':<36} {'acc':>8} {'delta':>7} {'agree':>9}")
+    results = run_sweep(configs, images, labels, args.weights, args.workers)
+    save_results(results, args.output)
+    print(f"\nWithin {args.tolerance} points of reference:")
+    for r in results[1:]:
+        if r["delta"] >= -args.tolerance:
+            print(format_row(r))
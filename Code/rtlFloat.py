@@ -0,0 +1,340 @@
+"""
+按位精确地模拟 RTL 中的浮点加法器/乘法器
+(imports/floatAdd16.v, floatMult16.v, floatAdd.v, floatMult.v, IEEE162IEEE32.v)
+所有函数输入输出均为 IEEE754 位模式 (uint16/uint32) 的 numpy 数组, 支持广播
+
+与 IEEE754 的差异(与 RTL 保持一致):
+  - 对齐与规格化时直接截断, 不做就近舍入
+  - 只有位模式全为 0 才视为零, 非规格数按隐含位为 1 处理
+  - 半精度的 exponent 寄存器为6位有符号数, 结果指数 <0 或 >=32 (第5位为1) 时输出0, 不产生 inf;
+    指数为0时照常拼接 {sign, 5'b0, mantissa}
+  - 单精度的 exponent 寄存器为8位无符号数, 下溢/上溢都按8位回绕, 从不清零
+  - 加法中绝对值相等、符号相反时结果为 0
+"""
+import numpy as np
+
+FP16 = (5, 10)  # (指数位宽, 尾数位宽)
+FP32 = (8, 23)
+
+
+def _fields(bits, E, M):
+    # 半精度尾数乘积只有22位, 用int32即可, 单精度需要int64
+    bits = np.asarray(bits).astype(np.int32 if 2 * M + 2 < 31 else np.int64)
+    sign = (bits >> (E + M)) & 1
+    exp = (bits >> M) & ((1 << E) - 1)
+    frac = (bits & ((1 << M) - 1)) | (1 << M)  # 补上隐含的1
+    return bits, sign, exp, frac
+
+
+def _pack(sign, exp, mantissa, E, M):
+    return (sign << (E + M)) | ((exp & ((1 << E) - 1)) << M) | (mantissa & ((1 << M) - 1))
+
+
+def _exp_flush(exp, E):
+    # floatMult16/floatAdd16 的 exponent 寄存器比指数域多一位: 下溢 (<0) 或上溢 (>=2^E) 时最高位为1, RTL 输出0
+    return (exp < 0) | (exp >= 1 << E)
+
+
+def _float_mult(a, b, E, M, flush):
+    a, sa, ea, fa = _fields(a, E, M)
+    b, sb, eb, fb = _fields(b, E, M)
+    bias = (1 << (E - 1)) - 1
+
+    fraction = fa * fb  # 2M+2 位, 最高位在 2M+1 或 2M
+    top = (fraction >> (2 * M + 1)) & 1
+    # 最高位为1时左移1位, 否则左移2位, 再取高M位(截断)
+    mantissa = np.where(top == 1, fraction >> (M + 1), fraction >> M)
+    exp = ea + eb - bias + top
+
+    res = _pack(sa ^ sb, exp, mantissa, E, M)
+    if flush:
+        res = np.where(_exp_flush(exp, E), 0, res)
+    return np.where((a == 0) | (b == 0), 0, res)
+
+
+def _float_add(a, b, E, M, flush):
+    a, sa, ea, fa = _fields(a, E, M)
+    b, sb, eb, fb = _fields(b, E, M)
+    magnitude = (1 << (E + M)) - 1
+
+    # 对阶: 指数小的一方右移(截断), 移位超出尾数位宽时为0
+    fa = np.where(eb > ea, fa >> np.minimum(eb - ea, M + 1), fa)
+    fb = np.where(ea > eb, fb >> np.minimum(ea - eb, M + 1), fb)
+    exp = np.maximum(ea, eb)
+
+    # 同号: 相加, 有进位则右移一位
+    s = fa + fb
+    carry = s >> (M + 1)
+    same_frac = s >> carry
+    same_exp = exp + carry
+
+    # 异号: 正数减负数, 结果为负时取反
+    d = np.where(sa == 1, fb - fa, fa - fb)
+    diff_sign = (d < 0).astype(d.dtype)
+    d = np.abs(d)
+    # 左移直到第M位为1; d为0的情况已由下面的特殊情况覆盖
+    shift = M - (np.frexp(np.maximum(d, 1))[1] - 1)
+    diff_frac = d << shift
+    diff_exp = exp - shift
+
+    same = sa == sb
+    res = np.where(same,
+                   _pack(sa, same_exp, same_frac, E, M),
+                   _pack(diff_sign, diff_exp, diff_frac, E, M))
+
+    if flush:
+        res = np.where(_exp_flush(np.where(same, same_exp, diff_exp), E), 0, res)
+    res = np.where(((a & magnitude) == (b & magnitude)) & (sa != sb), 0, res)
+    res = np.where(b == 0, a, res)
+    res = np.where(a == 0, b, res)
+    return res
+
+
+def float_mult16(a, b):
+    """floatMult16: 半精度乘法, 截断尾数"""
+    return _float_mult(a, b, *FP16, flush=True).astype(np.uint16)
+
+
+def float_add16(a, b):
+    """floatAdd16: 半精度加法, 对阶和规格化时截断"""
+    return _float_add(a, b, *FP16, flush=True).astype(np.uint16)
+
+
+def float_mult32(a, b):
+    """floatMult: 单精度乘法, 截断尾数, 指数按8位回绕"""
+    return _float_mult(a, b, *FP32, flush=False).astype(np.uint32)
+
+
+def float_add32(a, b):
+    """floatAdd: 单精度加法, 对阶和规格化时截断, 指数按8位回绕"""
+    return _float_add(a, b, *FP32, flush=False).astype(np.uint32)
+
+
+def ieee16_to_ieee32(x):
+    """
+    IEEE162IEEE32: 半精度转单精度, 指数加 8'b01110000 重新偏置, 尾数低位补0
+    RTL 不区分零: 半精度的 ±0 转换后为 ±2^-15 (0x38000000)
+    """
+    x = np.asarray(x).astype(np.uint32)
+    sign = (x >> 15) << 31
+    return (sign | ((((x >> 10) & 0x1F) + (127 - 15)) << 23) | ((x & 0x3FF) << 13)).astype(np.uint32)
+
+
+def relu16(x):
+    """UsingTheRelu16: 符号位为1时输出0"""
+    return np.where(x & 0x8000, 0, x).astype(np.uint16)
+
+
+def relu32(x):
+    """UsingTheRelu: 符号位为1时输出0"""
+    return np.where(x & 0x80000000, 0, x).astype(np.uint32)
+
+
+def conv_mac16(cols, w):
+    """
+    按 convUnit / processingElement16 的顺序做乘累加
+    cols: (N, H_out, W_out, K) uint16, 由 im2col 得到, K 按 (C, kH, kW) 展开
+    w: (C_out, K) uint16
+    convUnit 用一个累加器依次送入 D*F*F 个抽头: 第 i 拍取 image[16*i+:16], 而 RFselector 按 (C, kH, kW)
+    从高位向低位拼接, 所以实际顺序是 k = K-1, ..., 0, 每拍 acc = add(mult(x, w), acc)
+    返回: (N, C_out, H_out, W_out) uint16
+    """
+    N, H_out, W_out, K = cols.shape
+    acc = np.zeros((N, H_out, W_out, w.shape[0]), dtype=np.uint16)
+    for k in reversed(range(K)):
+        acc = float_add16(float_mult16(cols[..., k, np.newaxis], w[:, k]), acc)
+    return acc.transpose(0, 3, 1, 2)
+
+
+def linear_mac32(x, w):
+    """
+    按 ANNfull 状态机的顺序做全连接乘累加
+    x: (N, in) uint32
+    w: (in, out) uint32, 与权重文件的地址顺序一致
+    每一步读取一个地址 i, 所有输出神经元并行执行 acc = add(mult(x_i, w_i), acc)
+    返回: (N, out) uint32
+    """
+    acc = np.zeros((x.shape[0], w.shape[1]), dtype=np.uint32)
+    for i in range(w.shape[0]):
+        acc = float_add32(float_mult32(x[:, i, np.newaxis], w[i]), acc)
+    return acc
+
+
+# ---------------- 自检: 逐行翻译 .v 的标量参考实现 ----------------
+def _ref_float_mult16(floatA, floatB):
+    """floatMult16.v 的逐行翻译, exponent 为6位寄存器"""
+    if floatA == 0 or floatB == 0:
+        return 0
+    sign = (floatA >> 15) ^ (floatB >> 15)
+    exponent = (((floatA >> 10) & 0x1F) + ((floatB >> 10) & 0x1F) - 15 + 2) & 0x3F
+    fractionA = 0x400 | (floatA & 0x3FF)
+    fractionB = 0x400 | (floatB & 0x3FF)
+    fraction = fractionA * fractionB
+    # if (fraction[21]) <<1 ... else if (fraction[13]) <<9; 两个操作数都有隐含的1, 乘积最高位只会在第21或20位
+    for n in range(1, 10):
+        if (fraction >> (22 - n)) & 1:
+            fraction = (fraction << n) & 0x3FFFFF
+            exponent = (exponent - n) & 0x3F
+            break
+    mantissa = (fraction >> 12) & 0x3FF
+    if (exponent >> 5) & 1:
+        return 0
+    return (sign << 15) | ((exponent & 0x1F) << 10) | mantissa
+
+
+def _ref_float_add16(floatA, floatB):
+    """floatAdd16.v 的逐行翻译, exponent 为6位寄存器"""
+    exponentA = (floatA >> 10) & 0x1F
+    exponentB = (floatB >> 10) & 0x1F
+    fractionA = 0x400 | (floatA & 0x3FF)
+    fractionB = 0x400 | (floatB & 0x3FF)
+    exponent = exponentA
+    if floatA == 0:
+        return floatB
+    if floatB == 0:
+        return floatA
+    if (floatA & 0x7FFF) == (floatB & 0x7FFF) and (floatA >> 15) != (floatB >> 15):
+        return 0
+    if exponentB > exponentA:
+        fractionA >>= exponentB - exponentA
+        exponent = exponentB
+    elif exponentA > exponentB:
+        fractionB >>= exponentA - exponentB
+        exponent = exponentA
+    if (floatA >> 15) == (floatB >> 15):
+        s = fractionA + fractionB  # {cout, fraction}
+        if s >> 11:
+            s >>= 1
+            exponent = (exponent + 1) & 0x3F
+        fraction = s & 0x7FF
+        sign = floatA >> 15
+    else:
+        s = (fractionB - fractionA if floatA >> 15 else fractionA - fractionB) & 0xFFF
+        sign = s >> 11
+        fraction = s & 0x7FF
+        if sign:
+            fraction = -fraction & 0x7FF
+        if (fraction >> 10) & 1 == 0:
+            for n in range(1, 11):
+                if (fraction >> (10 - n)) & 1:
+                    fraction = (fraction << n) & 0x7FF
+                    exponent = (exponent - n) & 0x3F
+                    break
+    mantissa = fraction & 0x3FF
+    if (exponent >> 5) & 1:
+        return 0
+    return (sign << 15) | ((exponent & 0x1F) << 10) | mantissa
+
+
+def _ref_float_mult32(floatA, floatB):
+    """floatMult.v 的逐行翻译, exponent 为8位无符号寄存器"""
+    if floatA == 0 or floatB == 0:
+        return 0
+    sign = (floatA >> 31) ^ (floatB >> 31)
+    exponent = (((floatA >> 23) & 0xFF) + ((floatB >> 23) & 0xFF) - 127 + 2) & 0xFF
+    fractionA = 0x800000 | (floatA & 0x7FFFFF)
+    fractionB = 0x800000 | (floatB & 0x7FFFFF)
+    fraction = fractionA * fractionB
+    # 乘积最高位只会在第47或46位, 后面 (含写错下标的) 分支不会执行
+    if (fraction >> 47) & 1:
+        fraction = (fraction << 1) & ((1 << 48) - 1)
+        exponent = (exponent - 1) & 0xFF
+    elif (fraction >> 46) & 1:
+        fraction = (fraction << 2) & ((1 << 48) - 1)
+        exponent = (exponent - 2) & 0xFF
+    mantissa = (fraction >> 25) & 0x7FFFFF
+    return (sign << 31) | (exponent << 23) | mantissa
+
+
+def _ref_float_add32(floatA, floatB):
+    """floatAdd.v 的逐行翻译, exponent 为8位无符号寄存器"""
+    exponentA = (floatA >> 23) & 0xFF
+    exponentB = (floatB >> 23) & 0xFF
+    fractionA = 0x800000 | (floatA & 0x7FFFFF)
+    fractionB = 0x800000 | (floatB & 0x7FFFFF)
+    exponent = exponentA
+    if floatA == 0:
+        return floatB
+    if floatB == 0:
+        return floatA
+    if (floatA & 0x7FFFFFFF) == (floatB & 0x7FFFFFFF) and (floatA >> 31) != (floatB >> 31):
+        return 0
+    if exponentB > exponentA:
+        fractionA >>= exponentB - exponentA
+        exponent = exponentB
+    elif exponentA > exponentB:
+        fractionB >>= exponentA - exponentB
+        exponent = exponentA
+    if (floatA >> 31) == (floatB >> 31):
+        s = fractionA + fractionB  # {cout, fraction}
+        if s >> 24:
+            s >>= 1
+            exponent = (exponent + 1) & 0xFF
+        fraction = s & 0xFFFFFF
+        sign = floatA >> 31
+    else:
+        s = (fractionB - fractionA if floatA >> 31 else fractionA - fractionB) & 0x1FFFFFF
+        sign = s >> 24
+        fraction = s & 0xFFFFFF
+        if sign:
+            fraction = -fraction & 0xFFFFFF
+        if (fraction >> 23) & 1 == 0:
+            for n in range(1, 24):
+                if (fraction >> (23 - n)) & 1:
+                    fraction = (fraction << n) & 0xFFFFFF
+                    exponent = (exponent - n) & 0xFF
+                    break
+    mantissa = fraction & 0x7FFFFF
+    return (sign << 31) | (exponent << 23) | mantissa
+
+
+def _ref_ieee16_to_ieee32(input_fc):
+    """IEEE162IEEE32.v 中一个节点的逐行翻译"""
+    output_fc = (input_fc >> 15) << 31
+    temp = (input_fc >> 10) & 0x1F
+    output_fc |= ((temp + 0b01110000) & 0xFF) << 23
+    output_fc |= (input_fc & 0x3FF) << 13
+    return output_fc  # 低13位为0
+
+
+def _check_operands(rng, n, E, M, dtype):
+    W = 1 + E + M
+    a = rng.integers(0, 1 << W, n, dtype=np.uint64).astype(dtype)
+    b = rng.integers(0, 1 << W, n, dtype=np.uint64).astype(dtype)
+    # 补充零、正负相消、指数接近0/上溢边界的操作数
+    low, high = (1 << (W - 1)) | ((1 << (M + 1)) - 1), ((1 << (E - 1)) - 1) << (M + 1)
+    a[:1000], b[1000:2000] = 0, 0
+    b[2000:3000] = a[2000:3000] ^ dtype(1 << (W - 1))
+    a[3000:6000] &= dtype(low)
+    b[6000:9000] |= dtype(high)
+    return a, b
+
+
+def _self_check(n=200000, seed=0):
+    rng = np.random.default_rng(seed)
+    operands = {np.uint16: _check_operands(rng, n, *FP16, np.uint16),
+                np.uint32: _check_operands(rng, n, *FP32, np.uint32)}
+    for name, vec, ref, dtype in (("float_mult16", float_mult16, _ref_float_mult16, np.uint16),
+                                  ("float_add16", float_add16, _ref_float_add16, np.uint16),
+                                  ("float_mult32", float_mult32, _ref_float_mult32, np.uint32),
+                                  ("float_add32", float_add32, _ref_float_add32, np.uint32)):
+        a, b = operands[dtype]
+        got = vec(a, b)
+        want = np.array([ref(int(x), int(y)) for x, y in zip(a, b)], dtype=dtype)
+        bad = np.flatnonzero(got != want)
+        status = "ok" if bad.size == 0 else \
+            f"{bad.size} mismatches, e.g. {a[bad[0]]:x} {b[bad[0]]:x} -> {got[bad[0]]:x} != {want[bad[0]]:x}"
+        print(f"{name}: {n} cases {status}")
+        assert bad.size == 0
+
+    # 半精度转单精度: 穷举全部 65536 个位模式, 包括 +0 (0x0000) 和 -0 (0x8000)
+    x = np.arange(1 << 16, dtype=np.uint16)
+    got = ieee16_to_ieee32(x)
+    want = np.array([_ref_ieee16_to_ieee32(int(v)) for v in x], dtype=np.uint32)
+    bad = np.flatnonzero(got != want)
+    print(f"ieee16_to_ieee32: {len(x)} cases " + ("ok" if bad.size == 0 else f"{bad.size} mismatches"))
+    assert bad.size == 0 and got[0] == 0x38000000 and got[0x8000] == 0xB8000000
+
+
+if __name__ == "__main__":
+    _self_check()
@@ -0,0 +1,74 @@
+"""
+INT8 整数数据通路的精确模型 (训练后量化, 见 CNN/ptq.py)
+  - 权重: int8, 对称量化 (没有零点); 卷积按输出通道、全连接按整层各一个缩放因子
+  - 激活: uint8, 每层的输入都在 ReLU/池化之后, 非负, 零点为 0
+  - 乘累加: uint8 × int8 累加到 32 位有符号累加器, 溢出时按 32 位回绕;
+    整数加法满足结合律, 累加顺序不影响结果, 因此可以用矩阵乘一次算出
+  - 再量化: q = (acc * mult + 2^(shift-1)) >>> shift, 即乘 mult·2^-shift 后四舍五入 (.5 向正无穷),
+    再截到 [0, 255] (同时完成 ReLU); mult 为 16 位无符号数, shift 存为 8 位无符号数, 取值为 1..MAX_SHIFT
+    (int64 的移位超过 62 位没有定义); 缩放因子小到 shift 会超过 MAX_SHIFT 时输出恒为 0, 编码为 mult = 0
+所有函数的输入输出均为整数 numpy 数组, 支持广播
+"""
+import numpy as np
+
+ACT_MAX = 255  # uint8 激活
+WEIGHT_MAX = 127  # int8 权重, 对称量化不使用 -128
+MULT_BITS = 16
+ACC_BITS = 32
+MAX_SHIFT = 62  # requantize 在 int64 中计算 1 << (shift-1) 和 >> shift
+
+
+def quantize_multiplier(real, bits=MULT_BITS):
+    """
+    正实数 real -> (mult, shift), real ≈ mult · 2^-shift, mult ∈ [2^(bits-1), 2^bits)
+    real 可以是数组 (逐通道), 返回同形状的 int64 数组
+    shift 超过 MAX_SHIFT 的通道 (如剪枝后几乎不起作用的通道) 返回 mult = 0, shift = MAX_SHIFT:
+    此时 |acc · real| < 2^(ACC_BITS-1) · 2^(bits-1-MAX_SHIFT) 远小于 0.5, 正确的输出本来就是 0
+    """
+    real = np.asarray(real, dtype=np.float64)
+    if np.any(real <= 0):
+        raise ValueError("requantization scale must be positive")
+    shift = (bits - 1) - np.floor(np.log2(real)).astype(np.int64)
+    mult = np.rint(np.ldexp(real, shift)).astype(np.int64)
+    # 舍入进位到 2^bits 时少移一位
+    carry = mult >= (1 << bits)
+    mult = np.where(carry, mult >> 1, mult)
+    shift = np.where(carry, shift - 1, shift)
+    if np.any(shift < 1):
+        raise ValueError(f"requantization scale {real} out of range for {bits}-bit multiplier")
+    tiny = shift > MAX_SHIFT
+    mult = np.where(tiny, 0, mult)
+    shift = np.where(tiny, MAX_SHIFT, shift)
+    return mult, shift
+
+
+def wrap(acc, bits=ACC_BITS):
+    """按 bits 位有符号数回绕"""
+    half = 1 << (bits - 1)
+    return (np.asarray(acc, dtype=np.int64) + half) % (1 << bits) - half
+
+
+def int_mac(x, w):
+    """
+    整数乘累加
+    x: (..., K) 激活, w: (K, C_out) 权重
+    返回: (..., C_out) int64, 数值为 32 位累加器的结果
+    """
+    return wrap(np.asarray(x, dtype=np.int64) @ np.asarray(w, dtype=np.int64))
+
+
+def requantize(acc, mult, shift, relu=True):
+    """
+    32 位累加器 -> 下一层的 uint8 激活
+    acc: int64 数组; mult, shift: 可广播到 acc 的整数数组 (逐通道) 或标量
+    relu 为 False 时截到 [-ACT_MAX-1, ACT_MAX]
+    """
+    acc = np.asarray(acc, dtype=np.int64)
+    shift = np.asarray(shift, dtype=np.int64)
+    q = (acc * mult + (np.int64(1) << (shift - 1))) >> shift  # numpy 对负数右移为算术右移
+    return np.clip(q, 0 if relu else -ACT_MAX - 1, ACT_MAX)
+
+
+def quantize_activation(x, scale):
+    """浮点激活 (如 0-1 的输入图片) -> uint8 激活, round-half-even"""
+    return np.clip(np.rint(np.asarray(x, dtype=np.float64) / scale), 0, ACT_MAX).astype(np.int64)
@@ -0,0 +1,251 @@
+"""
+并行分片的 RTL 回归测试
+把测试集拆成若干份, 每份在独立的工作目录中替换 Verilog 源码里的路径和参数,
+用进程池并行运行仿真命令 (iverilog/Verilator 等, 或者用 python golden 模型代替),
+最后合并各份 FindMax 的输出, 给出准确率和混淆矩阵
+
+示例:
+  python rtlRegression.py --images ../Data/test_images_hex.txt --labels ../Data/test_labels.txt \
+      --sources ../CNN_FPGA/CNN_FPGA.sim/sources_1 --shards 8 \
+      --cmd "iverilog -o sim {sources} && vvp sim"
+  python rtlRegression.py --images ../Data/test_images_hex.txt --labels ../Data/test_labels.txt --golden rtl
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+ORIGINAL_DATA_DIR = "D:/Material/CSDP/Data"
+TB_IMAGE_LOOP = "for (i = 0; i < 10000; i = i + 1)"  # Lenet_TB.v 逐张读入图像的循环, 上限写死为 10000
+NUM_CLASSES = 10
+
+
+# ---------------- FindMax 输出格式 ----------------
+def write_findmax_output(filename, predictions):
+    """与 FindMax.v 写 test_output.txt 的格式一致: 每行一个十进制的类别, 按 %d 右对齐到 2 个字符"""
+    with open(filename, "w") as f:
+        f.write("".join(f"{int(p):>2d}\n" for p in predictions))
+
+
+def read_findmax_output(filename):
+    """读取 FindMax 的输出, 每个非空行取第一个整数作为预测类别"""
+    predictions = []
+    with open(filename, "r") as f:
+        for line in f:
+            match = re.search(r"-?\d+", line)
+            if match:
+                predictions.append(int(match.group()))
+    return np.array(predictions, dtype=np.int64)
+
+
+def read_lines(filename):
+    with open(filename, "r") as f:
+        return [line for line in f.read().splitlines() if line.strip()]
+
+
+# ---------------- 分片 ----------------
+def substitute_sources(sources_dir, work_dir, replacements, parameters):
+    """
+    把 sources_dir 下的 .v 文件拷贝到 work_dir, 并
+      - 按 replacements {原字符串: 新字符串} 替换路径
+      - 按 parameters {参数名: 值} 改写 `parameter 名 = 值`
+    返回拷贝后的文件列表
+    """
+    out_files = []
+    for src in sorted(glob.glob(os.path.join(sources_dir, "**", "*.v"), recursive=True)):
+        # 部分源码的注释是 GBK 编码, 按 latin-1 读写以原样保留字节
+        with open(src, "r", encoding="latin-1", newline="") as f:
+            text = f.read()
+        for old, new in replacements.items():
+            text = text.replace(old, new)
+        for name, value in parameters.items():
+            text = re.sub(rf"(parameter\s+(?:\[[^\]]*\]\s*)?{re.escape(name)}\s*=\s*)[^,;)\s]+",
+                          rf"\g<1>{value}", text)
+        dst = os.path.join(work_dir, os.path.relpath(src, sources_dir))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(dst, "w", encoding="latin-1", newline="") as f:
+            f.write(text)
+        out_files.append(dst)
+    return out_files
+
+
+def prepare_shards(image_lines, label_lines, work_root, num_shards):
+    """
+    把测试集按行拆成 num_shards 份连续的图像/标签文件, 返回每份的描述
+    Lenet_TB.v 用一次 $fscanf(fd, "%h", input_ANN) 读入整张图, 所以每行的像素去掉分隔符拼成一个宽字
+    (testSetQuantify.py 默认导出的是空格分隔的行)
+    """
+    if len(image_lines) != len(label_lines):
+        raise ValueError(f"{len(image_lines)} images but {len(label_lines)} labels")
+    bounds = np.linspace(0, len(image_lines), num_shards + 1).astype(int)
+    shards = []
+    for k in range(num_shards):
+        work = os.path.abspath(os.path.join(work_root, f"shard_{k:03d}"))
+        os.makedirs(work, exist_ok=True)
+        start, end = int(bounds[k]), int(bounds[k + 1])
+        shard = {"index": k, "work": work, "start": start, "count": end - start,
+                 "images": os.path.join(work, "test_images_hex.txt"),
+                 "labels": os.path.join(work, "test_labels.txt"),
+                 "output": os.path.join(work, "test_output.txt")}
+        with open(shard["images"], "w") as f:
+            f.write("".join("".join(line.split()) + "\n" for line in image_lines[start:end]))
+        with open(shard["labels"], "w") as f:
+            f.write("".join(line + "\n" for line in label_lines[start:end]))
+        shards.append(shard)
+    return shards
+
+
+# ---------------- 运行 ----------------
+def run_command_shard(shard, cmd, sources_dir, weight_dir, parameters, timeout=None):
+    """
+    替换源码中的路径和参数后在分片的工作目录中运行仿真命令
+    Lenet_TB.v 从 small_test_image.txt 读图, 同时把它的循环上限改为分片的图片数
+    """
+    images = shard["images"].replace("\\", "/")
+    replacements = {
+        f"{ORIGINAL_DATA_DIR}/Weight/distilled": weight_dir.replace("\\", "/"),
+        f"{ORIGINAL_DATA_DIR}/small_test_image.txt": images,
+        f"{ORIGINAL_DATA_DIR}/test_images_hex.txt": images,
+        f"{ORIGINAL_DATA_DIR}/test_labels.txt": shard["labels"].replace("\\", "/"),
+        f"{ORIGINAL_DATA_DIR}/test_output.txt": shard["output"].replace("\\", "/"),
+        TB_IMAGE_LOOP: TB_IMAGE_LOOP.replace("10000", str(shard["count"])),
+    }
+    params = {name: str(value).format(count=shard["count"]) for name, value in parameters.items()}
+    sources = substitute_sources(sources_dir, shard["work"], replacements, params) if sources_dir else []
+
+    command = cmd.format(work=shard["work"], sources=" ".join(f'"{s}"' for s in sources),
+                         images=shard["images"], labels=shard["labels"], output=shard["output"],
+                         count=shard["count"])
+    start = time.time()
+    try:
+        proc = subprocess.run(command, shell=True, cwd=shard["work"], capture_output=True, text=True,
+                              timeout=timeout)
+        returncode, log = proc.returncode, proc.stdout + proc.stderr
+    except subprocess.TimeoutExpired:
+        returncode, log = -1, f"Timeout after {timeout}s\n"
+    with open(os.path.join(shard["work"], "sim.log"), "w") as f:
+        f.write(log)
+    return {"index": shard["index"], "returncode": returncode, "seconds": time.time() - start}
+
+
+def run_golden_shard(shard, mode, weight_dir):
+    """用 python golden 模型代替仿真器, 输出格式与 FindMax 一致"""
+    from hexCodec import hex_to_bits
+    from simulate import LeNetSim
+
+    start = time.time()
+    with open(shard["images"], "r") as f:
+        images = hex_to_bits(f.read(), 16).view(np.float16).reshape(-1, 1, 32, 32)
+    predictions, _ = LeNetSim(weight_dir).predict_batch(images, mode=mode)
+    write_findmax_output(shard["output"], predictions)
+    return {"index": shard["index"], "returncode": 0, "seconds": time.time() - start}
+
+
+# ---------------- 汇总 ----------------
+def confusion_matrix(labels, predictions, num_classes=NUM_CLASSES):
+    """行为真实类别, 列为预测类别; 越界的预测不计入矩阵"""
+    cm = np.zeros((num_classes, num_classes), dtype=np.int64)
+    valid = (predictions >= 0) & (predictions < num_classes)
+    np.add.at(cm, (labels[valid], predictions[valid]), 1)
+    return cm
+
+
+def merge_results(shards, results):
+    labels, predictions, shard_reports = [], [], []
+    for shard, result in zip(shards, results):
+        shard_labels = np.array([int(x) for x in read_lines(shard["labels"])], dtype=np.int64)
+        shard_preds = read_findmax_output(shard["output"]) if os.path.exists(shard["output"]) else \
+            np.zeros(0, dtype=np.int64)
+        # 输出不完整(仿真失败或超时)时, 缺失的部分记为预测错误
+        missing = len(shard_labels) - len(shard_preds)
+        if missing > 0:
+            shard_preds = np.concatenate([shard_preds, np.full(missing, -1)])
+        shard_preds = shard_preds[:len(shard_labels)]
+        labels.append(shard_labels)
+        predictions.append(shard_preds)
+        shard_reports.append(dict(result, start=shard["start"], count=shard["count"], missing=max(0, missing),
+                                  accuracy=float(np.mean(shard_preds == shard_labels)) if len(shard_labels) else 0.0))
+
+    labels = np.concatenate(labels) if labels else np.zeros(0, dtype=np.int64)
+    predictions = np.concatenate(predictions) if predictions else np.zeros(0, dtype=np.int64)
+    cm = confusion_matrix(labels, predictions)
+    return {
+        "total": len(labels),
+        "correct": int(np.sum(predictions == labels)),
+        "accuracy": float(np.mean(predictions == labels)) if len(labels) else 0.0,
+        "per_class_accuracy": (np.diag(cm) / np.maximum(cm.sum(axis=1), 1)).tolist(),
+        "confusion_matrix": cm.tolist(),
+        "shards": shard_reports,
+    }
+
+
+def format_confusion(cm):
+    cm = np.asarray(cm)
+    lines = ["true\\pred " + " ".join(f"{j:>5d}" for j in range(cm.shape[1]))]
+    for i, row in enumerate(cm):
+        lines.append(f"{i:>9d} " + " ".join(f"{v:>5d}" for v in row))
+    return "\n".join(lines)
+
+
+def run_regression(images, labels, work_root="regression", num_shards=4, workers=None, cmd=None,
+                   golden=None, sources_dir=None, weight_dir=None, parameters=None, timeout=None):
+    """
+    拆分测试集并行运行, 返回合并后的报告
+    cmd 和 golden 二选一: cmd 为仿真命令模板, 可用 {work} {sources} {images} {labels} {output} {count};
+    golden 为 "float"、"rtl" 或 "int8", 使用 python golden 模型
+    """
+    if (cmd is None) == (golden is None):
+        raise ValueError("Exactly one of cmd and golden must be given")
+    from simulate import WEIGHT_DIR
+    weight_dir = os.path.abspath(weight_dir or WEIGHT_DIR)
+
+    if os.path.exists(work_root):
+        shutil.rmtree(work_root)
+    shards = prepare_shards(read_lines(images), read_lines(labels), work_root, num_shards)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if golden is not None:
+            futures = [pool.submit(run_golden_shard, s, golden, weight_dir) for s in shards]
+        else:
+            futures = [pool.submit(run_command_shard, s, cmd, sources_dir, weight_dir, parameters or {}, timeout)
+                       for s in shards]
+        results = [f.result() for f in futures]
+
+    report = merge_results(shards, results)
+    with open(os.path.join(work_root, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并行分片的 RTL 回归测试")
+    parser.add_argument("--images", required=True, help="hex 测试集, 每行一张图")
+    parser.add_argument("--labels", required=True, help="标签文件, 每行一个")
+    parser.add_argument("--work", default="regression", help="工作目录, 每份一个子目录")
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--workers", type=int, default=None, help="进程数, 默认为CPU核数")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--cmd", help="仿真命令模板, 在分片的工作目录中运行")
+    group.add_argument("--golden", choices=["float", "rtl", "int8"], help="用 python golden 模型代替仿真器")
+    parser.add_argument("--sources", help="Verilog 源码目录, 拷贝到每个分片并替换路径")
+    parser.add_argument("--weights", help="权重目录, 默认为 Data/Weight/distilled")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="改写 Verilog 参数, VALUE 中可用 {count} 表示分片的图片数")
+    parser.add_argument("--timeout", type=float, help="每个分片的超时时间(秒)")
+    args = parser.parse_args()
+
+    report = run_regression(args.images, args.labels, args.work, args.shards, args.workers, args.cmd,
+                            args.golden, args.sources, args.weights,
+                            dict(p.split("=", 1) for p in args.param), args.timeout)
+    for s in report["shards"]:
+        print(f"shard {s['index']:03d}: {s['count']} images | acc {s['accuracy'] * 100:.2f}% "
+              f"| rc {s['returncode']} | {s['seconds']:.1f}s" + (f" | missing {s['missing']}" if s["missing"] else ""))
+    print(format_confusion(report["confusion_matrix"]))
+    print(f"Accuracy: {report['correct']}/{report['total']} = {report['accuracy'] * 100:.2f}%")
@@ -1,74 +1,34 @@
+import argparse
+import collections
+import contextlib
+import hashlib
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
 import numpy as np
-import struct
+from numpy.lib.stride_tricks import sliding_window_view
 
 from tqdm import tqdm
 
-
-def float16_to_hex4(value: float) -> str:
-    """
-    将一个浮点数转换为 IEEE 754 半精度浮点数 (float16)，
-    并输出 4 个 16 进制字符串（每个2位）。
-    """
-    # 转换为float16
-    f16 = np.float16(value)
-
-    # 获取16位无符号整数表示
-    bits = f16.view(np.uint16)
-
-    # 拆分成4个十六进制字符串（每个代表4位）
-    hex_list = [f"{(bits >> shift) & 0xF:X}".lower() for shift in (12, 8, 4, 0)]
-
-    hex_str = "".join(hex_list)
-    return hex_str
-
-
-def hex4_to_float16(hexStr) -> float:
-    """
-    将4个16进制字符串（每个1位，合起来16位）
-    转换为IEEE 754半精度浮点数，并返回float值。
-    例如: ['3','c','0','0'] -> 1.0
-    """
-    if len(hexStr) != 4:
-        raise ValueError("必须传入4个16进制字符串")
-
-    # 拼接成完整的16位十六进制
-    bits = int(hexStr, 16)  # 转换为整数
-
-    # 转换为float16，再转为Python float
-    f16 = np.uint16(bits).view(np.float16)
-    return float(f16)
-
-
-def hex_to_float(hex_str):
-    """将8位16进制字符串转为IEEE754单精度浮点数"""
-    # 转成 int，再转成4字节
-    i = int(hex_str, 16)
-    b = i.to_bytes(4, byteorder='big')  # 假设大端（常见存储方式）
-    return struct.unpack('!f', b)[0]  # ! 表示network(big-endian)
-
-def float_to_hex(f):
-    """将IEEE754单精度浮点数转为8位16进制字符串"""
-    b = struct.pack('!f', f)            # ! 表示 big-endian，4字节
-    return b.hex()
+from hexCodec import bits_to_hex, hex_to_bits, load_hex
+from rtlFloat import conv_mac16, ieee16_to_ieee32, linear_mac32, relu16, relu32
+from rtlInt import int_mac, quantize_activation, requantize
 
 
 # ---------------- 工具函数 ----------------
 def load_weights(filename, shape):
-    """从txt文件加载权重并reshape"""
-    with open(filename, "r") as f:
-        data = f.read().split()
-    data = [hex4_to_float16(x[i:i + 4]) for x in data for i in range(0, len(x), 4)]
-    weights = np.array([float(x) for x in data])
-    return weights.reshape(shape)
+    """从FP16的txt文件加载权重并reshape"""
+    return load_hex(filename, 16).view(np.float16).astype(np.float64).reshape(shape)
 
 
 def load_weights32(filename, shape):
-    """从txt文件加载权重并reshape"""
-    with open(filename, "r") as f:
-        data = f.read().split()
-    data = [hex_to_float(x) for x in data]
-    weights = np.array([float(x) for x in data])
-    return weights.reshape(shape)
+    """从FP32的txt文件加载权重并reshape"""
+    return load_hex(filename, 32).view(np.float32).astype(np.float64).reshape(shape)
 
 
 def hex_to_image(hex_list):
@@ -82,8 +42,55 @@ def relu(x):
     return np.maximum(0, x)
 
 
+def im2col(x, kH, kW, stride=1, padding=0):
+    """
+    x: (N, C, H, W)
+    返回: (N, H_out, W_out, C*kH*kW), 最后一维按 (C, kH, kW) 顺序展开,与权重reshape后一致
+    """
+    if padding:
+        x = np.pad(x, ((0, 0), (0, 0), (padding, padding), (padding, padding)), mode="constant")
+    # 只读窗口视图,不拷贝数据: (N, C, H', W', kH, kW)
+    win = sliding_window_view(x, (kH, kW), axis=(2, 3))[:, :, ::stride, ::stride]
+    N, C, H_out, W_out = win.shape[:4]
+    return win.transpose(0, 2, 3, 1, 4, 5).reshape(N, H_out, W_out, C * kH * kW)
+
+
 def conv2d(x, w, stride=1, padding=0):
     """
+    向量化卷积: im2col + 每层一次矩阵乘
+    x: (N, C_in, H, W) 或单张 (C_in, H, W)
+    w: (C_out, C_in, kH, kW)
+    与 conv2d_loop 仅有求和顺序差异, float64 下最大绝对误差 < 1e-9
+    """
+    single = x.ndim == 3
+    if single:
+        x = x[np.newaxis]
+    C_out, _, kH, kW = w.shape
+
+    cols = im2col(x, kH, kW, stride, padding)
+    out = cols @ w.reshape(C_out, -1).T  # (N, H_out, W_out, C_out)
+    out = out.transpose(0, 3, 1, 2)
+    return out[0] if single else out
+
+
+def maxpool2d(x, size=2, stride=2):
+    """
+    向量化最大池化
+    x: (N, C, H, W) 或单张 (C, H, W)
+    """
+    single = x.ndim == 3
+    if single:
+        x = x[np.newaxis]
+    H_out, W_out = x.shape[2] // stride, x.shape[3] // stride
+
+    win = sliding_window_view(x, (size, size), axis=(2, 3))[:, :, ::stride, ::stride]
+    out = win[:, :, :H_out, :W_out].max(axis=(4, 5))
+    return out[0] if single else out
+
+
+def conv2d_loop(x, w, stride=1, padding=0):
+    """
+    逐元素循环的参考实现,用于校验向量化的 conv2d
     x: (C_in, H, W)
     w: (C_out, C_in, kH, kW)
     """
@@ -106,7 +113,8 @@ def conv2d(x, w, stride=1, padding=0):
     return out
 
 
-def maxpool2d(x, size=2, stride=2):
+def maxpool2d_loop(x, size=2, stride=2):
+    """逐元素循环的参考实现,用于校验向量化的 maxpool2d"""
     C, H, W = x.shape
     H_out, W_out = H // stride, W // stride
     out = np.zeros((C, H_out, W_out))
@@ -119,92 +127,590 @@ def maxpool2d(x, size=2, stride=2):
 
 
 def linear(x, W):
-    return np.dot(x.T, W)
-
-
-# ---------------- 加载权重 ----------------
-conv1_w = load_weights("./distilled/conv1_hex.txt", (6, 1, 5, 5))  # 6个5x5卷积核
-# conv1_b = load_bias("conv1.txt", 6)
-
-conv2_w = load_weights("./distilled/conv2_hex.txt", (16, 6, 5, 5))
-# conv2_b = load_bias("conv2.txt", 16)
+    """x: (in,) 或 (N, in)"""
+    return x @ W
 
-conv3_w = load_weights("./distilled/conv3_hex.txt", (32, 16, 3, 3))
-# conv3_b = load_bias("conv3.txt", 32)
 
-fc1_w = load_weights32("./distilled/fc1_hex.txt", (288, 120))
-# fc1_b = load_bias("fc1.txt", 120)
+# ---------------- 权重 ----------------
+WEIGHT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data", "Weight", "distilled")
+BUNDLE_NAME = "weights_bundle.npz"
+BUNDLE_VERSION = 2
+QUANT_FILE = "quant.json"  # ptq.py 导出的 INT8 缩放因子, 与 *_int8/_mult/_shift_hex.txt 一起用于 int8 模式
+LAYERS_FILE = "layers.json"  # quantification.py 导出的各层形状, 剪枝后的模型与默认形状不同
 
-fc2_w = load_weights32("./distilled/fc2_hex.txt", (120, 120))
-# fc2_b = load_bias("fc2.txt", 120)
+# 层名 -> 位宽, 卷积层为FP16, 全连接层为FP32
+# 默认 (未剪枝) 形状: conv1 (6,1,5,5), conv2 (16,6,5,5), conv3 (32,16,3,3),
+# fc1 (288,120), fc2 (120,120), fc3 (120,84), fc4 (84,10); 实际形状从权重目录中读取
+LAYER_WIDTHS = {"conv1": 16, "conv2": 16, "conv3": 16, "fc1": 32, "fc2": 32, "fc3": 32, "fc4": 32}
 
-fc3_w = load_weights32("./distilled/fc3_hex.txt", (120, 84))
-# fc3_b = load_bias("fc3.txt", 84)
+CONV_LAYERS = (("conv1", 2), ("conv2", 0), ("conv3", 1))  # (层名, padding)
+FC_LAYERS = ("fc1", "fc2", "fc3", "fc4")
+INPUT_SHAPE = (1, 32, 32)
+TRACE_LAYERS = ("conv1", "relu1", "pool1", "conv2", "relu2", "pool2", "conv3", "relu3", "pool3",
+                "ann_in", "fc1", "relu_fc1", "fc2", "relu_fc2", "fc3", "relu_fc3", "fc4")
 
-fc4_w = load_weights32("./distilled/fc4_hex.txt", (84, 10))
-
-
-# fc4_b = load_bias("fc4.txt", 10)
 
+def infer_layer_shapes(texts, input_shape=INPUT_SHAPE):
+    """
+    由各层的 hex 文本推断形状, 剪枝后的权重同样适用
+    卷积层每行一个输出通道, 行长 = C_in*kH*kW*4 (方形卷积核); 全连接层按 (in, out) 存放,
+    in 由上一层的输出决定, 卷积部分每层之后接 2×2 池化
+    """
+    C, H, W = input_shape
+    shapes = {}
+    for name, padding in CONV_LAYERS:
+        rows = texts[name].split()
+        k = math.isqrt(len(rows[0]) // 4 // C)
+        if C * k * k * 4 != len(rows[0]):
+            raise ValueError(f"{name}: row of {len(rows[0])} hex digits does not match {C} input channels")
+        shapes[name] = (len(rows), C, k, k)
+        C, H, W = len(rows), (H + 2 * padding - k + 1) // 2, (W + 2 * padding - k + 1) // 2
+    n_in = C * H * W
+    for name in FC_LAYERS:
+        count = len("".join(texts[name].split())) // (LAYER_WIDTHS[name] // 4)
+        if count % n_in:
+            raise ValueError(f"{name}: {count} weights is not a multiple of {n_in} inputs")
+        shapes[name] = (n_in, count // n_in)
+        n_in = count // n_in
+    return shapes
+
+
+def _record(trace, name, x):
+    if trace is not None:
+        trace[name] = x
+    return x
+
+
+def _bus_bits(name, x):
+    """中间结果 -> 总线上的位模式, 卷积部分为FP16, 全连接部分为FP32; rtl 模式下已经是位模式"""
+    width = 32 if name == "ann_in" or name.startswith(("fc", "relu_fc")) else 16
+    if x.dtype.kind == "f":
+        x = x.astype(np.float16 if width == 16 else np.float32).view(np.uint16 if width == 16 else np.uint32)
+    return x.reshape(x.shape[0], -1)
+
+
+class LeNetSim:
+    """
+    LeNet5 的 python 仿真模型
+    权重在第一次使用时才加载: 先把 weight_dir 下的 *_hex.txt 转成二进制 bundle,
+    之后只要 hex 文件的校验和不变就直接读取 bundle
+    各层形状取自 weight_dir/layers.json, 没有时由 hex 文件推断 (见 infer_layer_shapes),
+    推理时只使用 bundle 中数组的形状, 因此剪枝后的模型无需修改代码
+    bits 给出时直接使用这些位模式 (如 SimPool 放在共享内存中的数组), 不读取任何文件
+    """
+
+    def __init__(self, weight_dir=WEIGHT_DIR, bundle_path=None, bits=None):
+        self.weight_dir = weight_dir
+        self.bundle_path = bundle_path or os.path.join(weight_dir, BUNDLE_NAME)
+        self._bits = bits
+        self._weights = None
+        self._int = None
+
+    # ---------------- 权重加载 ----------------
+    def _hex_path(self, name):
+        return os.path.join(self.weight_dir, f"{name}_hex.txt")
+
+    def _read_texts(self):
+        texts = {}
+        for name in LAYER_WIDTHS:
+            with open(self._hex_path(name), "r") as f:
+                texts[name] = f.read()
+        return texts
+
+    def _layer_shapes(self, texts):
+        path = os.path.join(self.weight_dir, LAYERS_FILE)
+        if not os.path.exists(path):
+            return infer_layer_shapes(texts)
+        with open(path, "r") as f:
+            layers = json.load(f)
+        return {name: tuple(layers[name]["shape"]) for name in LAYER_WIDTHS}
+
+    def _manifest(self, texts, shapes):
+        """各 hex 文件的 sha256 和各层形状, 用于判断 bundle 是否过期"""
+        manifest = {"version": BUNDLE_VERSION, "shapes": {name: list(s) for name, s in shapes.items()}}
+        for name, text in texts.items():
+            manifest[name] = hashlib.sha256(text.encode("ascii")).hexdigest()
+        return json.dumps(manifest, sort_keys=True)
+
+    def _parse_hex(self, texts, shapes):
+        return {name: hex_to_bits(texts[name], LAYER_WIDTHS[name]).reshape(shapes[name]) for name in LAYER_WIDTHS}
+
+    def _read_bundle(self, manifest):
+        if not os.path.exists(self.bundle_path):
+            return None
+        with np.load(self.bundle_path) as bundle:
+            if "manifest" not in bundle.files or str(bundle["manifest"]) != manifest:
+                return None
+            return {name: bundle[name] for name in LAYER_WIDTHS}
+
+    def _write_bundle(self, bits, manifest):
+        # 带上进程号, 多个进程同时生成 bundle 时互不覆盖
+        tmp_path = f"{self.bundle_path}.{os.getpid()}.tmp.npz"
+        try:
+            np.savez(tmp_path, manifest=np.array(manifest), **bits)
+            os.replace(tmp_path, self.bundle_path)
+        except OSError:
+            # 权重目录只读时不缓存, 下次重新解析
+            pass
+
+    def load(self):
+        """加载权重位模式 {层名: uint16/uint32 数组}"""
+        if self._bits is None:
+            texts = self._read_texts()
+            shapes = self._layer_shapes(texts)
+            manifest = self._manifest(texts, shapes)
+            bits = self._read_bundle(manifest)
+            if bits is None:
+                bits = self._parse_hex(texts, shapes)
+                self._write_bundle(bits, manifest)
+            self._bits = bits
+        return self._bits
+
+    @property
+    def shapes(self):
+        """各层权重的形状 {层名: 形状}"""
+        return {name: b.shape for name, b in self.bits.items()}
+
+    @property
+    def bits(self):
+        """权重的 IEEE754 位模式, 用于 rtl 模式"""
+        return self.load()
+
+    @property
+    def weights(self):
+        """权重的 float64 数值, 用于 float 模式"""
+        if self._weights is None:
+            self._weights = {name: b.view(np.float16 if b.dtype == np.uint16 else np.float32).astype(np.float64)
+                             for name, b in self.bits.items()}
+        return self._weights
+
+    def _load_int(self):
+        with open(os.path.join(self.weight_dir, QUANT_FILE), "r") as f:
+            meta = json.load(f)
+        layers = {}
+        for name in LAYER_WIDTHS:
+            path = os.path.join(self.weight_dir, name)
+            shape = meta["layers"][name]["shape"]
+            layers[name] = {"weight": load_hex(f"{path}_int8_hex.txt", 8).view(np.int8).reshape(shape)}
+            if name != FC_LAYERS[-1]:  # 最后一层直接输出累加器, 不再量化
+                layers[name].update(mult=load_hex(f"{path}_mult_hex.txt", 16).astype(np.int64),
+                                    shift=load_hex(f"{path}_shift_hex.txt", 8).astype(np.int64))
+        return {"input_scale": meta["input_scale"], "output_scale": meta["output_scale"], "layers": layers}
+
+    @property
+    def int_params(self):
+        """
+        ptq.py 导出的 INT8 参数, 用于 int8 模式:
+        {"input_scale", "output_scale", "layers": {层名: {"weight" int8, "mult", "shift" (fc4 没有)}}}
+        """
+        if self._int is None:
+            self._int = self._load_int()
+        return self._int
+
+    # ---------------- 推理函数 ----------------
+    def conv_layers(self, x, trace=None):
+        """卷积部分, 浮点计算. x: (N, 1, 32, 32) -> (N, C3, 3, 3), C3 为 conv3 的输出通道数 (默认32)"""
+        for i, (name, padding) in enumerate(CONV_LAYERS, 1):
+            # Conv -> ReLU -> Pool
+            x = _record(trace, name, conv2d(x, self.weights[name], padding=padding))
+            x = _record(trace, f"relu{i}", relu(x))
+            x = _record(trace, f"pool{i}", maxpool2d(x))
+        return x
+
+    def conv_layers_rtl(self, x, trace=None):
+        """
+        卷积部分, 按位模拟 floatAdd16/floatMult16 的截断运算
+        x: (N, 1, 32, 32) -> (N, C3, 3, 3), 返回 float16 结果
+        """
+        x = x.astype(np.float16).view(np.uint16)
+        for i, (name, padding) in enumerate(CONV_LAYERS, 1):
+            w = self.bits[name]
+            C_out, _, kH, kW = w.shape
+            x = _record(trace, name, conv_mac16(im2col(x, kH, kW, padding=padding), w.reshape(C_out, -1)))
+            x = _record(trace, f"relu{i}", relu16(x))
+            # ReLU 之后均为非负数, 位模式的大小关系与数值一致, 可直接对位模式取最大值
+            x = _record(trace, f"pool{i}", maxpool2d(x))
+        return x.view(np.float16)
+
+    def fc_layers(self, x, trace=None):
+        """全连接部分, 浮点计算. x: (N, C3*3*3) -> (N, 10)"""
+        x = _record(trace, "ann_in", x)
+        for i, name in enumerate(FC_LAYERS, 1):
+            x = _record(trace, name, linear(x, self.weights[name]))
+            # 最后一层不接 ReLU
+            if i < len(FC_LAYERS):
+                x = _record(trace, f"relu_{name}", relu(x))
+        return x
+
+    def fc_layers_rtl(self, x, trace=None):
+        """
+        全连接部分, 按位模拟 IEEE162IEEE32 和 floatAdd/floatMult 的截断运算
+        x: (N, C3*3*3) float16 -> (N, 10) float32
+        """
+        x = _record(trace, "ann_in", ieee16_to_ieee32(x.view(np.uint16)))
+        for i, name in enumerate(FC_LAYERS, 1):
+            x = _record(trace, name, linear_mac32(x, self.bits[name]))
+            if i < len(FC_LAYERS):
+                x = _record(trace, f"relu_{name}", relu32(x))
+        return x.view(np.float32)
+
+    def conv_layers_int(self, x, trace=None):
+        """
+        卷积部分, INT8 整数运算 (见 rtlInt)
+        x: (N, 1, 32, 32) 0-1 的像素值 -> (N, C3, 3, 3) uint8 激活 (int64 数组)
+        """
+        params = self.int_params
+        x = quantize_activation(x, params["input_scale"])
+        for i, (name, padding) in enumerate(CONV_LAYERS, 1):
+            layer = params["layers"][name]
+            w = layer["weight"]
+            C_out, _, kH, kW = w.shape
+            acc = int_mac(im2col(x, kH, kW, padding=padding), w.reshape(C_out, -1).T).transpose(0, 3, 1, 2)
+            _record(trace, name, acc)
+            # 再量化同时完成 ReLU; 再量化单调不减, 可以先于池化
+            x = _record(trace, f"relu{i}", requantize(acc, layer["mult"][:, None, None],
+                                                     layer["shift"][:, None, None]))
+            x = _record(trace, f"pool{i}", maxpool2d(x))
+        return x
+
+    def fc_layers_int(self, x, trace=None):
+        """全连接部分, INT8 整数运算. x: (N, C3*3*3) uint8 激活 -> (N, 10) fc4 的 32 位累加器"""
+        x = _record(trace, "ann_in", x)
+        for i, name in enumerate(FC_LAYERS, 1):
+            layer = self.int_params["layers"][name]
+            x = _record(trace, name, int_mac(x, layer["weight"]))
+            if i < len(FC_LAYERS):
+                x = _record(trace, f"relu_{name}", requantize(x, layer["mult"], layer["shift"]))
+        return x
+
+    def forward(self, x, mode="float", trace=None):
+        """
+        批量前向推理
+        x: (N, 1, 32, 32)
+        mode: "float" 为浮点计算; "rtl" 为按位模拟硬件的截断运算; "int8" 为 ptq.py 导出的整数模型
+            (logits 为 fc4 的累加器乘以 output_scale);
+            或 mixedPrecision.parse_spec 得到的逐层数值格式 {层名: LayerFormat}
+        trace: 传入 dict 时记录每一层的中间结果 {层名: 数组}
+        返回: (N, 10) logits
+        """
+        if isinstance(mode, dict):
+            from mixedPrecision import forward_mixed
+            return forward_mixed(self, x, mode, trace)
+        if mode not in ("float", "rtl", "int8"):
+            raise ValueError(f"Unknown mode {mode!r}, expected 'float', 'rtl' or 'int8'")
+
+        if mode == "int8":
+            x = self.conv_layers_int(x, trace)
+            return self.fc_layers_int(x.reshape(x.shape[0], -1), trace) * self.int_params["output_scale"]
+
+        if mode == "rtl":
+            x = self.conv_layers_rtl(x, trace)
+            # Flatten, 每张图按 (C, H, W) 展开
+            return self.fc_layers_rtl(x.reshape(x.shape[0], -1), trace).astype(np.float64)
+
+        x = self.conv_layers(x, trace)
+        return self.fc_layers(x.reshape(x.shape[0], -1), trace)
+
+    def trace_batch(self, images, batch_size=512, mode="float", msb_first=True):
+        """
+        批量推理并记录每一层的中间结果, 按 Verilog 总线的打包顺序排列
+        卷积部分 (conv/relu/pool, pool3 即 CNNout) 为 FP16, 全连接部分 (ann_in 即 ANNin, fc*) 为 FP32
+        每张图的结果按 (C, H, W) 展开成一行; msb_first 为 True 时第0个元素位于总线最高位,
+        与 $readmemh 读入权重/图片文件的顺序一致, 为 False 时反转
+        返回: {层名: (N, L) uint16/uint32 位模式}
+        """
+        images = np.asarray(images, dtype=np.float32).reshape(-1, 1, 32, 32)
+        chunks = []
+        for i in range(0, len(images), batch_size):
+            trace = {}
+            self.forward(images[i:i + batch_size], mode, trace)
+            chunks.append(trace)
+
+        if not chunks:
+            return {}
+
+        result = {}
+        for name in TRACE_LAYERS:
+            bits = np.concatenate([_bus_bits(name, c[name]) for c in chunks])
+            result[name] = bits if msb_first else bits[:, ::-1]
+        return result
+
+    def predict_batch(self, images, batch_size=512, mode="float"):
+        """
+        批量推理
+        images: (N, 1, 32, 32) 或 (N, 1024) 的像素值
+        batch_size: 每次前向的图片数, 限制 im2col 的内存占用
+        mode: 见 forward
+        返回: (labels (N,), logits (N, 10))
+        """
+        images = np.asarray(images, dtype=np.float32).reshape(-1, 1, 32, 32)
+        logits = [self.forward(images[i:i + batch_size], mode) for i in range(0, len(images), batch_size)]
+        logits = np.concatenate(logits) if logits else np.zeros((0, 10))
+        return np.argmax(logits, axis=1), logits
+
+    def predict(self, hex_list, mode="float"):
+        """单张图片推理, hex_list 为1024个像素值"""
+        labels, logits = self.predict_batch(hex_to_image(hex_list)[np.newaxis], mode=mode)
+        return labels[0], logits[0]
+
+
+def save_trace(trace, filename):
+    """把 trace_batch 的结果保存为一个二进制 .npz 文件"""
+    np.savez(filename, **trace)
+
+
+def load_trace(filename):
+    with np.load(filename) as data:
+        return {name: data[name] for name in data.files}
+
+
+def export_trace_hex(trace, output_dir, prefix=""):
+    """每一层导出一个 hex 文件, 每行是一张图对应的整条总线"""
+    os.makedirs(output_dir, exist_ok=True)
+    for name, bits in trace.items():
+        width = bits.dtype.itemsize * 8
+        with open(os.path.join(output_dir, f"{prefix}{name}_hex.txt"), "w") as f:
+            for row in bits:
+                f.write(bits_to_hex(row, width) + "\n")
+
+
+_default_sim = None
+
+
+def default_sim():
+    """使用默认权重目录的共享模型, 第一次调用时创建"""
+    global _default_sim
+    if _default_sim is None:
+        _default_sim = LeNetSim()
+    return _default_sim
+
+
+def predict_batch(images, batch_size=512, mode="float"):
+    """见 LeNetSim.predict_batch"""
+    return default_sim().predict_batch(images, batch_size, mode)
+
+
+def predict(hex_list, mode="float"):
+    """见 LeNetSim.predict"""
+    return default_sim().predict(hex_list, mode)
 
-# ---------------- 推理函数 ----------------
-def predict(hex_list):
-    x = hex_to_image(hex_list)
 
-    # Conv1 -> ReLU -> Pool
-    x = relu(conv2d(x, conv1_w, padding=2))
-    x = maxpool2d(x)
+# ---------------- 多进程推理 ----------------
+_worker_sim = None
+_worker_shm = []
 
-    # Conv2 -> ReLU -> Pool
-    x = relu(conv2d(x, conv2_w))
-    x = maxpool2d(x)
 
-    # Conv3 -> ReLU
-    x = relu(conv2d(x, conv3_w,padding=1))
-    x = maxpool2d(x)
+def _init_sim_worker(specs, weight_dir):
+    """子进程: 按名字映射共享内存中的权重位模式, 不拷贝也不重新解析 hex"""
+    global _worker_sim
+    bits = {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = SharedMemory(name=shm_name)
+        _worker_shm.append(shm)  # 保持映射, 数组引用其缓冲区
+        bits[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        bits[name].flags.writeable = False
+    _worker_sim = LeNetSim(weight_dir, bits=bits)  # int8 模式的参数仍从 weight_dir 读取
 
-    # Flatten
-    x = x.flatten()
 
-    # x = hex_list
+def _worker_predict(images, mode):
+    return _worker_sim.predict_batch(images, mode=mode)
 
-    # FC1 -> ReLU
-    x = relu(linear(x, fc1_w))
 
-    # FC2 -> ReLU
-    x = relu(linear(x, fc2_w))
+def _as_images(items):
+    """
+    一组图片 -> (n, 1, 32, 32) float16
+    每张图可以是 hex 字符串 (一行, 可带空格)、2048 字节的小端 FP16 二进制或 1024 个像素值的数组
+    """
+    images = []
+    for item in items:
+        if isinstance(item, str):
+            item = hex_to_bits(item, 16).view(np.float16)
+        elif isinstance(item, (bytes, bytearray, memoryview)):
+            item = np.frombuffer(item, dtype="<f2")
+        images.append(np.asarray(item, dtype=np.float16).reshape(INPUT_SHAPE))
+    return np.stack(images) if images else np.zeros((0, *INPUT_SHAPE), dtype=np.float16)
 
-    # FC3 -> ReLU
-    x = relu(linear(x, fc3_w))
 
-    # FC4 -> Softmax
-    x = linear(x, fc4_w)
-    # probs = softmax(x)
+class SimPool:
+    """
+    多进程批量推理
+    权重只加载一次并放入共享内存, 各进程只读映射; 输入按 chunk_size 分块分发, 结果按输入顺序返回
+    用法:
+        with SimPool(weight_dir, workers=8) as pool:
+            labels, logits = pool.predict_batch(images, mode="rtl")
+    """
 
-    return np.argmax(x), x
+    def __init__(self, weight_dir=WEIGHT_DIR, workers=None, chunk_size=256):
+        self.chunk_size = chunk_size
+        self.workers = workers or os.cpu_count()
+        self._shm = []
+        specs = {}
+        try:
+            for name, b in LeNetSim(weight_dir).load().items():
+                shm = SharedMemory(create=True, size=b.nbytes)
+                self._shm.append(shm)
+                np.ndarray(b.shape, dtype=b.dtype, buffer=shm.buf)[...] = b
+                specs[name] = (shm.name, b.shape, b.dtype.str)
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_sim_worker, initargs=(specs, weight_dir))
+        except BaseException:
+            self._release()
+            raise
+
+    def _chunks(self, images):
+        if isinstance(images, np.ndarray):
+            images = images.reshape(-1, *INPUT_SHAPE)
+            for i in range(0, len(images), self.chunk_size):
+                yield images[i:i + self.chunk_size]
+            return
+        it = iter(images)
+        while True:
+            chunk = list(itertools.islice(it, self.chunk_size))
+            if not chunk:
+                return
+            yield _as_images(chunk)
+
+    def imap(self, images, mode="float"):
+        """
+        逐块推理, 按输入顺序产出每块的 (labels, logits)
+        images: (N, 1, 32, 32)/(N, 1024) 数组, 或任意可迭代的单张图片 (见 _as_images), 可以是文件对象
+        同时在途的块数不超过 2 × 进程数, 输入为流时内存占用有界
+        """
+        pending = collections.deque()
+        for chunk in self._chunks(images):
+            pending.append(self._pool.submit(_worker_predict, chunk, mode))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def predict_batch(self, images, mode="float"):
+        """与 LeNetSim.predict_batch 相同的返回值: (labels (N,), logits (N, 10))"""
+        results = list(self.imap(images, mode))
+        if not results:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 10))
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+    def _release(self):
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+
+    def close(self):
+        self._pool.shutdown()
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def parallel_predict(images, weight_dir=WEIGHT_DIR, mode="float", workers=None, chunk_size=256):
+    """见 SimPool.predict_batch, 用完即关闭进程池"""
+    with SimPool(weight_dir, workers, chunk_size) as pool:
+        return pool.predict_batch(images, mode)
+
+
+# ---------------- 测试集评估 ----------------
+def iter_hex_images(filename, chunk_size=1024):
+    """按块读取 hex 测试集 (每行一张图), 每次产出 (n, 1, 32, 32) float16, 内存占用与测试集大小无关"""
+    with open(filename, "r") as f:
+        while True:
+            lines = [line for line in itertools.islice(f, chunk_size) if line.strip()]
+            if not lines:
+                return
+            yield hex_to_bits("".join(lines), 16).view(np.float16).reshape(len(lines), *INPUT_SHAPE)
+
+
+def _prefetch(iterable):
+    """在后台线程中取下一个元素, 读文件和解码与当前块的计算重叠"""
+    it = iter(iterable)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(next, it, None)
+        while True:
+            item = future.result()
+            if item is None:
+                return
+            future = pool.submit(next, it, None)
+            yield item
+
+
+def evaluate_hex(sim, images_path, labels_path=None, output_path=None, logits_path=None, mode="float",
+                 chunk_size=1024, num_classes=10):
+    """
+    流式评估整个 hex 测试集
+    sim: LeNetSim 或 SimPool (每块再分给多个进程)
+    output_path: 预测结果, 与 FindMax.v 写 test_output.txt 的格式一致:
+        每行一个十进制的类别, 4 位的 max 经 %d 右对齐到 2 个字符 (如 " 9")
+    logits_path: 每行一张图的 logits, 空格分隔
+    返回: {"total", "correct", "accuracy", "confusion_matrix"}; 没有标签时只有 total
+    """
+    labels = None
+    if labels_path is not None:
+        with open(labels_path, "r") as f:
+            labels = np.array([int(line) for line in f if line.strip()], dtype=np.int64)
+    cm = np.zeros((num_classes, num_classes), dtype=np.int64)
+    total = 0
+    with contextlib.ExitStack() as stack:
+        out = stack.enter_context(open(output_path, "w")) if output_path else None
+        logit_out = stack.enter_context(open(logits_path, "w")) if logits_path else None
+        progress = stack.enter_context(tqdm(unit="img", desc=f"simulate ({mode})"))
+        for images in _prefetch(iter_hex_images(images_path, chunk_size)):
+            predictions, logits = sim.predict_batch(images, mode=mode)
+            if out:
+                out.write("".join(f"{int(p):>2d}\n" for p in predictions))
+            if logit_out:
+                np.savetxt(logit_out, logits, fmt="%.9g")
+            if labels is not None:
+                chunk_labels = labels[total:total + len(predictions)]
+                if len(chunk_labels) < len(predictions):
+                    raise ValueError(f"{labels_path} has only {len(labels)} labels")
+                np.add.at(cm, (chunk_labels, predictions), 1)
+            total += len(predictions)
+            progress.update(len(predictions))
+
+    if labels is None:
+        return {"total": total}
+    if total != len(labels):
+        raise ValueError(f"{total} images but {len(labels)} labels")
+    correct = int(np.trace(cm))
+    return {"total": total, "correct": correct, "accuracy": correct / total if total else 0.0,
+            "confusion_matrix": cm.tolist()}
 
 
-# ---------------- 示例 ----------------
 if __name__ == "__main__":
-    # correct = 0
-    # with open('./test_images_hex.txt', 'r') as f:
-    #     images = f.readlines()
-    # images = [x.replace('\n', '') for x in images]
-    # with open('./test_labels.txt', 'r') as f:
-    #     labels = f.readlines()
-    # labels = [int(x.replace('\n', '')) for x in labels]
-    # for ima, glab in tqdm(zip(images, labels)):
-    #     hex_list = [hex4_to_float16(ima[i:i + 4]) for i in range(0, len(ima), 4)]
-    #     label, probs = predict(hex_list)
-    #     if label == glab:
-    #         correct += 1
-    # print(correct / len(images))
-    example = '33883525368736f735e633272f472c04298628042a872c852d862e87300431a633a834e53586358634d534743404324630642ec72ec730e534143606377737673676370737a837d83727351531652c4425052004200424042505260629052c442f47314533273454341434443505359634e5332730e52f472f88310532a73414377737983777379837e83788359631862a87240422062606270724042004240428852c442fc8326634443575367636c7368736c736d7362634c531a62f072e4636d73656366636f737c8385c3854369733882ec72a062707240420041c041c04200427072cc530c5342435e6363634e53307342435653666371736b735d634f536c736763717381c386c387438b5388d3788355532e72fc82b88288525052206240428852d053186350536b73697347430642e062f073165348536c7380c380437c8385c387c38b538fd38d538a538ad38b53864379835a633e831e630c52fc83004302430e533e8365637a837a836a73505338831e6318632c73535372737f8388d390538d53874383c37c83798384438d538fd38dd3854379836d7363635b635e63616363636d737f8384c383437c837073505324630a531e634a536873767390d391d388536d73485324632e735653788386438d538bd388d3874386c3834385c388d388d388538a538a5386c380c371734442f472a062c043044347435f6395d3925383c354530442b882c042f8832e735a6381438b538cd38c538d538ad389538ad38dd38c538dd387c381c37e8371734c531c62f472c042986306434443975396538c5363630852a0629052b072dc631e63616384c38c538cd38ed38d53895389538a5383437983656353534d5354535453555351533e8310531e63474399e39ce392d37c834c530042c442cc52e873125352537c8389538dd392d391538d538dd387435d6334731252fc82e873044320634743616371736c7369736b7399e39ae3965390d38543565338833a8347434d53626380c38b538ed38ed38ed38f538cd37a833a82ec72c042986280429862cc5304433883646381c3854380c397d394d394d3986396538a53824380c3814380c3834387438ad388d3814382438a53874363631a62cc5290526062206240428042a062dc6328735c6377737b8392d38c538d5390538ed38a5384c3834382c382c38743885386c380c37073737385c388536c732462c442707240420042004240427072b072fc8345436b7377738d53834376736a735f635a63525355535863575364636c73747375736e73757388538fd380c33a82d05260622062004200425052b8830243367359637173757382c3606342431e630e53105316531a631653165328733e834c5352535553676385c38f5383434c52f472804200422062b073024338835a6370737d837f83727368733072f472d452c442c042d052d452d052e062f8830c531a6322632e734b53737385c382c36a7343430a52e0630243434362637773844389538a53864377735e631a62c442804260624042707270728042a062c442d452f07306430e533a83687384c389d3885380c371736c73757381c3864388538743854389d388d382c37b834c52ec724041c0420042004200420042404260628852c442e8730c534853757388d38cd390d39253935393d393538fd38e538ed38a53814385c3895388d37c83747354531e62cc5220600000000000000002004200427072e4633473656384438853844387438f5392d3935393d39553965394538e5388d387438a538bd35b636c7380437e835f633272fc82c4429052707250527072b073044349537883895387437f8382438bd390d390538e538d538bd3895386c384c381c388d38e5363635d63707381c382c380436f7364635453367326633e8344434c536c7385c38cd38bd3885387c385c3824376736163515349534a534e5351535753717384436c73505340434043485359637573864387c380c37c838143824383c38b538b538ad38b5388d37b8359633e831862f882e062cc52cc52d862e8730443206343436f734c530a52b882a872d053186343435d637883844387c389d38bd38e538b538b5388d3798349530a52d052b0729862707250524042606280429862a872d0537f836873454304429052404250528852cc531c635a6376737f838143854386c38b5386435f630a52a062a062a87288524042206220622062505240426062c0437273788373735d633672f882c852905260629862f47328734c53626372737b83874386c36a733072d862a87298627072004200420042206250528852d8631e63495367637983804378835a63464332731c630442b882a8730243424365637b8386438bd38b537d8346430a52d862a0628852a062e0630243004322634d53697310534b536f738343854382437f837b83747364634b53404332733a835863788382c38543895387c37a836c7358634143434346435963697365636b737273747322634c536b7381c3874388538a5389d388d38a538d538b5382c37173687373737a837b837983767372737473717365635d63565354535653586356534e53485359636d737b8382c3874388d385c378836c7372737f8385c389d387c380c37c83788377737373636346432c731a630642ec72e062d452d052e062f472f072e8737e83824385438643874386c373734a53165300430a53206340434853434343434743535361635f6343430c52c8526062505250522062004240428042885280438bd3895386c385c3854383c36f734342f472b882a87298628852804280428852a872e46322634b53505344431a62d45288524041c041c041c04200422062206'
-    hex_list = [hex4_to_float16(example[i:i + 4]) for i in range(0, len(example), 4)]
-    label, probs = predict(hex_list)
-    pass
-    # ft = '3800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003d66e000380000003800000038000000380000003e37e0003d212000380000003c6d00003800000038000000380000003800000038000000380000003db7a00038000000380000003800000038000000380000003e58c00038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003c8580003ea1a000380000003e4b4000380000003da1200038000000380000003db7400038000000380000003d1a800038000000380000003e89e0003ec620003de7a0003ee2a0003e6dc0003d87c0003df8e0003d2000003e4720003e3be00038000000380000003d6420003d8620003800000038000000380000003e1420003d80200038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003e0480003d12e0003e87c0003e45a0003e9d40003e5fe0003e7080003e1bc0003e2700003e8dc0003e1460003d4400003800000038000000380000003d83c0003eaaa0003d4f40003d69c00038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003d64800038000000380000003800000038000000380000003800000038000000380000003deb60003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003dfe200038000000380000003d8d000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003e4400003e83c0003ed200003eb8a0003e9520003f2740003e7c80003f0320003e88a00038000000380000003cda000038000000380000003e5ca00038000000380000003c87800038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003ede2000380000003e5080003da9c00038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003e07c0003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003800000038000000380000003de300003e21c0003de880003e6f80003e7d80003e5d80003e3580003ecd80003d2240003cfac0003da7e0003efc4000380000003dc8c00038000000380000003e3080003dce60003e0de0003d55c00038000000380000003e89a00038000000380000003800000038000000'
-    # ft = [hex_to_float(ft[i:i + 8]) for i in range(0, len(ft), 8)]
-    # ft = np.array(ft, dtype=np.float32)
-    # idx, res = predict(ft)
-    # pass
+    parser = argparse.ArgumentParser(description="python golden 模型在 hex 测试集上的评估")
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data")
+    parser.add_argument("--images", default=os.path.join(data_dir, "test_images_hex.txt"), help="每行一张图")
+    parser.add_argument("--labels", default=os.path.join(data_dir, "test_labels.txt"), help="不给出时只输出预测")
+    parser.add_argument("--weights", default=WEIGHT_DIR, help="权重目录")
+    parser.add_argument("--mode", choices=["float", "rtl", "int8"], default="float")
+    parser.add_argument("--output", default="test_output.txt", help="预测结果, FindMax 格式")
+    parser.add_argument("--logits", help="每张图的 logits 输出文件")
+    parser.add_argument("--report", help="准确率和混淆矩阵的 JSON 输出文件")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="每次读入和推理的图片数")
+    parser.add_argument("--workers", type=int, default=1, help="推理进程数, 大于1时使用 SimPool")
+    args = parser.parse_args()
+
+    start = time.time()
+    with contextlib.ExitStack() as stack:
+        if args.workers > 1:
+            sim = stack.enter_context(SimPool(args.weights, args.workers,
+                                              max(1, args.chunk_size // args.workers)))
+        else:
+            sim = LeNetSim(args.weights)
+        report = evaluate_hex(sim, args.images, args.labels or None, args.output, args.logits, args.mode,
+                              args.chunk_size)
+    seconds = time.time() - start
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    if "accuracy" in report:
+        from rtlRegression import format_confusion
+
+        print(format_confusion(report["confusion_matrix"]))
+        print(f"Accuracy: {report['correct']}/{report['total']} = {report['accuracy'] * 100:.2f}%")
+    print(f"{report['total']} images in {seconds:.1f}s ({report['total'] / max(seconds, 1e-9):.0f} img/s)")
@@ -1,83 +1,260 @@
+import argparse
+import json
+import os
 import struct
-import matplotlib.pyplot as plt
+import zipfile
+
 import numpy as np
 
+from hexCodec import hex4_to_float16, hex_to_bits, hex_to_float16
+
+# 各层的通道数, 用于按通道统计误差; 全连接层按神经元统计
+LAYER_CHANNELS = {
+    "conv1": 6, "relu1": 6, "pool1": 6,
+    "conv2": 16, "relu2": 16, "pool2": 16,
+    "conv3": 32, "relu3": 32, "pool3": 32,
+}
+FC_PREFIXES = ("ann_in", "fc", "relu_fc")
+
+
+def layer_width(name):
+    """卷积部分为FP16, 全连接部分为FP32"""
+    return 32 if name.startswith(FC_PREFIXES) else 16
+
+
+# ---------------- 数据流 ----------------
+def iter_hex_values(path, width=16, chunk_values=1 << 20):
+    """分块读取十六进制文本文件, 每次产出 chunk_values 个位模式 (最后一块可能更少)"""
+    n = width // 4
+    pending = ""
+    with open(path, "r") as f:
+        while True:
+            block = f.read(chunk_values * (n + 1))
+            pending += "".join(block.split())
+            while len(pending) >= chunk_values * n:
+                yield hex_to_bits(pending[:chunk_values * n], width)
+                pending = pending[chunk_values * n:]
+            if not block:
+                break
+    if pending:
+        yield hex_to_bits(pending, width)
+
+
+def iter_array_values(arr, chunk_values=1 << 20):
+    """按块遍历数组 (可以是内存映射), 每次产出一维位模式"""
+    flat = arr.reshape(-1)
+    for i in range(0, len(flat), chunk_values):
+        yield np.asarray(flat[i:i + chunk_values])
 
-def hex_to_float(hex_str):
-    """将8位16进制字符串转为IEEE754单精度浮点数"""
-    # 转成 int，再转成4字节
-    i = int(hex_str, 16)
-    b = i.to_bytes(4, byteorder='big')  # 假设大端（常见存储方式）
-    return struct.unpack('!f', b)[0]  # ! 表示network(big-endian)
 
+def load_npz_member(path, name):
+    """
+    以内存映射方式打开 .npz 中的一个数组: np.savez 不压缩, 每个成员就是原样存放的 .npy;
+    np.savez_compressed 的成员无法映射, 整个读入内存
+    """
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(f"{name}.npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(path) as data:
+            return data[name]
+    with open(path, "rb") as f:
+        # 本地文件头: 30 字节的固定部分, 之后是文件名和扩展字段, 再之后才是 .npy 的内容
+        f.seek(info.header_offset)
+        name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else \
+            np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
 
-def float_to_hex(f):
-    """将IEEE754单精度浮点数转为8位16进制字符串"""
-    b = struct.pack('!f', f)  # ! 表示 big-endian，4字节
-    return b.hex()
 
+def hex_line_length(path, width=16):
+    """hex 文件第一行包含的数值个数, 即每张图的元素个数"""
+    with open(path, "r") as f:
+        return len("".join(f.readline().split())) // (width // 4)
 
-def float16_to_hex4(value: float) -> list[str]:
+
+def open_layer(source, layer, width=None, chunk_values=1 << 20):
     """
-    将一个浮点数转换为 IEEE 754 半精度浮点数 (float16)，
-    并输出 4 个 16 进制字符串（每个2位）。
+    打开某一层的数据流, source 可以是:
+      目录 (export_trace_hex 导出的 {layer}_hex.txt), .npz (save_trace 保存的 trace, 见 load_npz_member),
+      .npy 或 hex 文本文件
+    返回: (数据流, 位宽, 每张图的元素个数)
     """
-    # 转换为float16
-    f16 = np.float16(value)
+    if os.path.isdir(source):
+        source = os.path.join(source, f"{layer}_hex.txt")
+    ext = os.path.splitext(source)[1]
+    if ext in (".npz", ".npy"):
+        arr = load_npz_member(source, layer) if ext == ".npz" else np.load(source, mmap_mode="r")
+        layer_size = arr.shape[1] if arr.ndim > 1 else len(arr)
+        return iter_array_values(arr, chunk_values), arr.dtype.itemsize * 8, layer_size
 
-    # 获取16位无符号整数表示
-    bits = f16.view(np.uint16)
+    width = width or layer_width(layer)
+    return iter_hex_values(source, width, chunk_values), width, hex_line_length(source, width)
 
-    # 拆分成4个十六进制字符串（每个代表4位）
-    hex_list = [f"{(bits >> shift) & 0xF:X}".lower() for shift in (12, 8, 4, 0)]
 
-    return hex_list
+# ---------------- 误差统计 ----------------
+def _ordered(bits, width):
+    """符号-幅值 -> 有序整数, 相邻可表示数相差1, +0 与 -0 相同"""
+    bits = bits.astype(np.int64)
+    sign = bits >> (width - 1)
+    magnitude = bits & ((1 << (width - 1)) - 1)
+    return np.where(sign == 1, -magnitude, magnitude)
 
 
-def hex4_to_float16(hexStr) -> float:
+class DiffStats:
     """
-    将4个16进制字符串（每个1位，合起来16位）
-    转换为IEEE 754半精度浮点数，并返回float值。
-    例如: ['3','c','0','0'] -> 1.0
+    流式累计两份位模式数据之间的误差
+    layer_size: 每张图的元素个数; channels: 每张图的通道数, 元素按 (C, H, W) 排列
     """
-    if len(hexStr) != 4:
-        raise ValueError("必须传入4个16进制字符串")
 
-    # 拼接成完整的16位十六进制
-    bits = int(hexStr, 16)  # 转换为整数
+    def __init__(self, width=16, layer_size=None, channels=1, first_n=10):
+        self.width = width
+        self.layer_size = layer_size
+        self.channels = channels
+        self.first_n = first_n
+        self.count = 0
+        self.sum_sq = 0.0
+        self.max_abs = 0.0
+        self.mismatches = 0
+        self.ulp_hist = np.zeros(width + 1, dtype=np.int64)  # 第k格: ulp 在 [2^(k-1), 2^k) 内, 第0格为完全一致
+        self.first_mismatches = []
+        self.ch_sum_sq = np.zeros(channels)
+        self.ch_max_abs = np.zeros(channels)
+        self.ch_mismatches = np.zeros(channels, dtype=np.int64)
+
+    def update(self, golden, rtl):
+        """golden, rtl: 一维位模式数组"""
+        float_dtype = np.float16 if self.width == 16 else np.float32
+        g = golden.view(float_dtype).astype(np.float64)
+        r = rtl.view(float_dtype).astype(np.float64)
+        err = r - g
+        abs_err = np.abs(err)
+
+        ulp = np.abs(_ordered(rtl, self.width) - _ordered(golden, self.width))
+        bucket = np.where(ulp == 0, 0, np.frexp(ulp.astype(np.float64))[1])
+        self.ulp_hist += np.bincount(bucket, minlength=len(self.ulp_hist))[:len(self.ulp_hist)]
+
+        mism = np.flatnonzero(ulp)
+        for i in mism[:max(0, self.first_n - len(self.first_mismatches))]:
+            self.first_mismatches.append((self.count + int(i), float(g[i]), float(r[i]), int(ulp[i])))
+
+        if self.layer_size:
+            pos = (self.count + np.arange(len(err))) % self.layer_size
+            ch = pos // max(1, self.layer_size // self.channels)
+        else:
+            ch = np.zeros(len(err), dtype=np.int64)
+        self.ch_sum_sq += np.bincount(ch, err ** 2, minlength=self.channels)
+        np.maximum.at(self.ch_max_abs, ch, abs_err)
+        self.ch_mismatches += np.bincount(ch[mism], minlength=self.channels)
+
+        self.sum_sq += float(np.sum(err ** 2))
+        self.max_abs = max(self.max_abs, float(abs_err.max(initial=0.0)))
+        self.mismatches += len(mism)
+        self.count += len(err)
 
-    # 转换为float16，再转为Python float
-    f16 = np.uint16(bits).view(np.float16)
-    return float(f16)
+    @property
+    def mse(self):
+        return self.sum_sq / self.count if self.count else 0.0
+
+    def report(self):
+        per_channel = self.count // self.channels if self.count else 1
+        hist = {(str(k) if k < 2 else f"{1 << (k - 1)}-{(1 << k) - 1}"): int(v)
+                for k, v in enumerate(self.ulp_hist) if v}
+        return {
+            "count": self.count,
+            "mse": self.mse,
+            "max_abs": self.max_abs,
+            "mismatches": self.mismatches,
+            "ulp_hist": hist,
+            "first_mismatches": [{"index": i, "golden": g, "rtl": r, "ulp": u}
+                                 for i, g, r, u in self.first_mismatches],
+            "channels": [{"channel": c, "mse": float(self.ch_sum_sq[c] / per_channel),
+                          "max_abs": float(self.ch_max_abs[c]), "mismatches": int(self.ch_mismatches[c])}
+                         for c in range(self.channels)],
+        }
+
+
+def diff_streams(golden, rtl, width=16, layer_size=None, channels=1, first_n=10):
+    """逐块比较两个位模式数据流, 长度不一致时报错"""
+    stats = DiffStats(width, layer_size, channels, first_n)
+    pending_g = pending_r = np.zeros(0, dtype=np.uint16 if width == 16 else np.uint32)
+    for g_chunk, r_chunk in _zip_longest_chunks(golden, rtl):
+        pending_g = np.concatenate([pending_g, g_chunk]) if g_chunk is not None else pending_g
+        pending_r = np.concatenate([pending_r, r_chunk]) if r_chunk is not None else pending_r
+        n = min(len(pending_g), len(pending_r))
+        stats.update(pending_g[:n], pending_r[:n])
+        pending_g, pending_r = pending_g[n:], pending_r[n:]
+    if len(pending_g) or len(pending_r):
+        raise ValueError(f"Length mismatch: golden has {stats.count + len(pending_g)} values, "
+                         f"rtl has {stats.count + len(pending_r)}")
+    return stats
+
+
+def _zip_longest_chunks(a, b):
+    a, b = iter(a), iter(b)
+    while True:
+        x, y = next(a, None), next(b, None)
+        if x is None and y is None:
+            return
+        yield x, y
+
+
+def diff_layer(golden_source, rtl_source, layer, width=None, channels=None, first_n=10, chunk_values=1 << 20):
+    """比较一层的 golden 和 RTL 结果, 返回 DiffStats"""
+    golden, g_width, layer_size = open_layer(golden_source, layer, width, chunk_values)
+    rtl, r_width, _ = open_layer(rtl_source, layer, width, chunk_values)
+    if g_width != r_width:
+        raise ValueError(f"Width mismatch for {layer}: golden {g_width}, rtl {r_width}")
+    if channels is None:
+        channels = layer_size if layer.startswith(FC_PREFIXES) else LAYER_CHANNELS.get(layer, 1)
+    return diff_streams(golden, rtl, g_width, layer_size, channels, first_n)
+
+
+def format_report(layer, stats, max_channels=8):
+    rep = stats.report()
+    lines = [f"[{layer}] {rep['count']} values | MSE {rep['mse']:.6g} | max abs {rep['max_abs']:.6g} "
+             f"| mismatches {rep['mismatches']}",
+             "  ULP histogram: " + ", ".join(f"{k}: {v}" for k, v in rep["ulp_hist"].items())]
+    for m in rep["first_mismatches"]:
+        lines.append(f"  #{m['index']}: golden {m['golden']:.6g} rtl {m['rtl']:.6g} ({m['ulp']} ulp)")
+    worst = sorted(rep["channels"], key=lambda c: -c["mismatches"])[:max_channels]
+    for c in worst:
+        if c["mismatches"]:
+            lines.append(f"  channel {c['channel']}: mismatches {c['mismatches']} | MSE {c['mse']:.6g} "
+                         f"| max abs {c['max_abs']:.6g}")
+    return "\n".join(lines)
+
+
+def _plot_errors(golden_hex, rtl_hex):
+    import matplotlib.pyplot as plt
+    plt.plot((hex_to_float16(rtl_hex).astype(np.float64) - hex_to_float16(golden_hex)) ** 2)
+    plt.show()
 
 
 def testSingleKernelConv():
     a = '2222222222222222222222222222222222222222222222222222222222222222222222222222222222222222222222222222'
     b = '2200220022002200220022002200220022002200220022002200220022002200220022002200220022002200220022002200'
-    res = 0
-    for i in range(0, len(a), 4):
-        res += hex4_to_float16(a[i:i + 4]) * hex4_to_float16(b[i:i + 4])
+    res = np.sum(hex_to_float16(a).astype(np.float64) * hex_to_float16(b))
     print(res)
     print(hex4_to_float16('1b28'))
 
 
-def testSingleLayerConv(simulateRes=None, targetRes=None):
+def testSingleLayerConv(simulateRes=None, targetRes=None, show=False):
     if simulateRes is None:
         simulateRes = 'bd08b974347bb8bfb861b422bc2cb8792d7d32782ef2ac06a98832a7b11ab58db9b9baceb8d7b82bba49ade6ae9ab463bb82bac0baebb73cb708bb2abc91b720b76eb73a37cb3487bd16b5c9b5a2b46dba4eb9beb050b89e35cdb946b53ab953bb3ab95cb5c0b803bbe236fbb71ebb5cbb32b4fa37a2b3a6b7bcbcd0b88cba2a312c28c8bd8dbca9bb8eb9a429df3018b96db86d38d9bd85b51cb5b9b8f8b491b332bae1ba48b810b7eeb882b550b6ceb116ad30b9dfb832b8c6b91bb560b846bc7eba7eb196ba09bb44b564b5ebb3cc35842f6bb092bc0ebbf6b4fbb6f4b91d322ab92aad9c2ed8bdc3b656b369b479b7d2bccbbeb8b157ad0eba50b9d6ba3eb81faf60bb2abd6ebc092f2ab86ab4bcb7a0ba32b9b2b728bd53b626322fbeebbe7cb6dfb80cb8a9bc4ebb16b6d6b964bbe6ae46bb62bb98bc10bb42bee8b340bbb8bd56b817b848a130b378b84da8e4b564af1cbc6b25b0b495343fb639bc7bb4f7bacf2ce0b721b554b7bcb100b1c43387bc31bb72b330b404b4acb636bb50baeabb10ba1bb6e6b8a3339abbfabbcc27c4363db93db8a5297833193155b552312db8c0b8e6b8baae28b8e8b600b4c72a88b4dfad06b9f7b6fab8fd341fbb2dbc90b5a434be395438afbcaeb8a4b449245d33dc2b9ab4e432a8a8cc2280b920bc4fbb4e962039c12954ba9ab7da347d1880bae9352626ce3655b7e2b9e9bc353543b914baec22ed2b4cb4f5b3dcb2d6ba5cbc7eb967bc9a1f60b922b814b79ebd62bcccbb98bbfab978b5c2b342bb7ebb36bdd7b0e2bd4cbc71b9c62e0ebb12be85b2deba04b9b2b6b5bbccbd05baa5b8eeb8bbb650b30abc603423b618b8c1b6aab12c3187bc533873b66cb352aa8ab4d1b896bc23a930ba22bc09ba7fba06bbe6b7ecbbf82608bb78baa0b2bcb784b919b0f5b970b34c3864a894bc4bab94bb2633a9b258b4dab9813c5db7a4b887af54ae0ab837b922bd97bb5abbc6ba2bb5b4b7ea2a08b8d9b86b1fa0b6f2b66cb178b15db54eb800b384b49bbdaeb498bc50b8bdb488b34cb94cb99fba292978b939b955b662b518b863300f3c3fb93cb1eab99bb9b8a90c2da52d94b57eba29acf83987b6f4bb1eb254b369bd99b0112d152f26b8e4b3782ed233f4b146aa34b63ab9c3bc77bbd0b93dbcdebc63b5a6bfe8bdd3bcddbcffb786b784bb48342cac1ab6272fa236dfbd9fba77bbc22aeab7d4b8dcb0e2bb6eaaa4b282a720b86cb579bc37b229396e3315aa40b868b75eb13db855bc89bb29b34ab98ab5ceb4c7b5aebab5b944b89cb677b17cb7c6b003bd03b5a1ba26ba8cb4f0ba23375bb7d4ba76b8c3b78cb576bb34aeb23450b4c6b819bc08aec0bb49bf78b8442000bd432260b9d3bd3abd4db8d3b8e7bb6fb918bd5fbbc4bbc8b676bb7eb8a4b9a9372434a0bc08b624b653b56ebac6aeccbad5b75cb8a1bafab80031d0b4833114b849336ebabdb9f0bdf2b8e5b060bca7b30ab9772c6bb919b8eb3466a874b3b2be76b5a334332c8cb5c82efa3749b4f42e7eb458beebb9c3b8deb5c7bc4ebc1bb83db50426c83578342eb78c20f0ba703060b975b57b31feb9c6b99aa358bda5baaf30e7bbaeba69b8c7bc5bb97ab5bcbc7db769bb04b224b3eab6b2b766b946ba12ba0eb01ab806bc353918b807bceabd322f363befbafbb80ab6dbb9482de0354ba890baf228e2bc38be04bd37babfbb96bc9abb583135bb26bc6abccab913b8d9b851b7d4b328b859b021bc4dbd432c102d51bb34b99abcf3bdc43795b4a0bac0ad50a448bba4b892b99ab5f2ba63bc9a358cae0cafacb61d32ebb76ab9c4b819b82ab8f7bc4fbda8b91bb856b550ba6ca5c0aa64b4c0348cbc32b6dcadac3166b837b823b4a4bf7cbba8b8cfb22028c4b8e1b89fb99db232b6f6bc7fb1e0b18bb7d4b8b1ba82bacdb618b4aeba89b696b18e2728b91834cbb901baa3bab7b3cea990bcf0bc88b9b8b8b6b44bbb6934a3b7a1b268b957bb94b70ab410bd69b7dab909b6a6b8b1b892ba90b8c1b882b8d0bed8b57cb726ba842806ae80b3eabb36b9f0bd0bbe8db770bc67bf63bc97adf8b2cab958b4fbafbeb803bcdbbe35ba5abc3abc37b91dbad0b58ebb74b4a8bc12b49bac2eb3b6b22ab796bb702804bc53b9dab9823128306bb376b588baa3bc4634992e182d4eb935b85dbb2bb60db6dcb843bcc2b85a28e43549baa0b5cfb55d'
     if targetRes is None:
         targetRes = 'bd09b973347cb8c0b862b424bc2bb87b2d7832782f03ac0da99632a3b11db591b9b8bacfb8d7b82cba4aadfaaea7b469bb84bac1bae8b73bb70abb2abc90b722b76db73b37cb3482bd18b5d0b5a0b46bba51b9bfb05ab89f35cdb947b537b958bb3bb95db5bdb803bbe336fbb71dbb5dbb32b4ff37a2b3a9b7bbbccfb88eba2c313028aebd8cbca8bb91b9a529cc3014b96eb86e38d8bd86b51bb5b7b8f8b492b330badfba47b813b7f0b883b551b6cdb116ad35b9e2b831b8c9b91bb563b846bc7fba7fb192ba0bbb46b562b5ecb3d335832f58b096bc0ebbfab4fbb6edb91d3227b92cada42ed7bdc4b65ab36cb47ab7d2bccbbeb6b153ad12ba53b9dbba3fb81faf64bb2cbd6ebc092f29b86cb4bcb7a0ba33b9b6b723bd54b6253226beecbe7eb6deb80bb8aabc4fbb1bb6d5b968bbe2ae48bb64bb98bc0fbb44bee7b347bbbbbd57b817b847a192b37cb84da8f2b568af1ebc6c25a5b494343bb63abc7db4f8bad12ccfb725b556b7beb100b1c33382bc32bb74b331b405b4acb636bb50baecbb11ba1bb6eab8a43393bbf9bbcb27da363bb940b8a4297633143156b553312eb8c0b8e6b8bcae2cb8ebb605b4cb2a7ab4ddad01b9f7b700b8fd3420bb2dbc8fb5aa34bb395538aebcafb8a3b44f242533dd2b8eb4e532a0a8cb22bcb921bc4fbb51989a39c22947ba9cb7dc34791858baed352526c13653b7e3b9e8bc383542b913baef22e82b51b4f4b3e2b2d8ba5dbc7eb96abc9c1e7eb923b816b79ebd65bccdbb98bbfdb979b5c7b341bb80bb37bdd9b0e3bd4cbc72b9c62e02bb16be85b2e8ba05b9b1b6b6bbc9bd05baa8b8efb8bbb652b306bc603424b61ab8c3b6aeb1303186bc533874b66db359aa84b4d0b895bc24a948ba24bc08ba7cba04bbe8b7eebbf625c0bb7bbaa2b2c0b789b918b0f9b971b34c3865a8adbc4daba0bb2d33a8b25bb4dcb9813c5cb7a4b889af61ae0db838b920bd97bb5cbbc8ba2fb5b7b7f029deb8dab86c1f60b6f2b66cb17cb15cb554b802b382b49ebdaeb499bc50b8beb488b34bb94eb9a1ba2e2971b938b954b662b519b861300d3c41b93cb1e4b99db9b7a9152da52d89b57dba2aacfe3987b6f6bb1fb256b368bd99b0172d1a2f26b8e5b37e2ebf33f3b149aa4eb63db9c4bc77bbd2b93ebce2bc64b5abbfeabdd4bcdebd02b787b786bb4a342cac1bb6292fa036dbbd9dba79bbc42af3b7d5b8dbb0e5bb6faaa5b283a734b86db57cbc37b230396b330daa65b869b75eb13eb854bc89bb29b34ab98cb5ccb4cab5aebab4b945b89bb679b17bb7c5b004bd04b5a3ba27ba8cb4f0ba23375ab7d3ba7ab8c5b78cb577bb32aeb43450b4c4b818bc09aec0bb4abf7ab8441f65bd442237b9d6bd3abd4eb8d2b8e8bb70b91cbd5fbbc6bbcab67bbb81b8a4b9aa372134a0bc09b624b653b570bac2aed9bad5b75db8a2bafab80131ceb481310eb8493368bac0b9f0bdf5b8e4b05ebca9b30db9772c59b91ab8ed3463a871b3afbe79b5a634342c78b5cb2eee374ab4f52e8db458beedb9c4b8dfb5c8bc50bc1cb83db50626a2357a342db78f20b7ba70305eb974b57d3202b9c7b99aa382bda9baae30e8bbaeba6db8c7bc5bb979b5bcbc7eb76bbb05b228b3e7b6b2b767b946ba16ba11b018b807bc353918b807bceabd322f3e3bedbafcb809b6dbb9492ddb354ca891baf128d4bc3abe07bd38bac3bb98bc9cbb573132bb26bc6abccab914b8dab851b7d5b325b85ab025bc4ebd422bea2d50bb31b99cbcf4bdc53794b4a5bac0ad50a452bba5b893b999b5f4ba66bc99358fae0dafb4b62032e8b76bb9c3b818b82cb8f6bc4cbda9b91cb857b550ba6ca5d2aa73b4c6348abc31b6e3adae3159b837b824b4a8bf7dbba8b8ceb22d28c2b8e1b89eb9a0b235b6f8bc7eb1e3b18fb7d4b8b2ba83baccb621b4b1ba87b696b1922707b91634cab900baa2bab7b3cea98fbcf0bc88b9bab8b6b44dbb6b34a4b7a3b269b959bb97b709b413bd6cb7d8b90ab6acb8b3b894ba94b8c2b884b8d0bed9b57fb725ba8627c9ae9cb3e9bb3ab9f0bd0bbe8db76fbc67bf69bc98ae07b2c3b95db4feafc6b802bcddbe35ba5bbc3bbc37b91cbad8b591bb76b4aabc13b49bac3ab3b8b233b798bb7027f8bc53b9dbb9833122306bb375b587baa4bc4934982e182d47b934b85cbb2cb612b6dbb843bcc3b85928f33548baa3b5d1b55f'
-    MSE = 0.0
-    MSEList = []
-    for i in range(0, len(simulateRes), 4):
-        MSE += (hex4_to_float16(simulateRes[i:i + 4]) - hex4_to_float16(targetRes[i:i + 4])) ** 2
-        MSEList.append((hex4_to_float16(simulateRes[i:i + 4]) - hex4_to_float16(targetRes[i:i + 4])) ** 2)
-    MSE /= (len(simulateRes) // 4)
-    print('MSE Loss is {:.6f}'.format(MSE))
-    plt.plot(MSEList)
-    plt.show()
+    stats = diff_streams([hex_to_bits(simulateRes)], [hex_to_bits(targetRes)])
+    print('MSE Loss is {:.6f}'.format(stats.mse))
+    print(format_report('result', stats))
+    if show:
+        _plot_errors(simulateRes, targetRes)
 
 
-def testMultiLayerConv(simulateResList=None, targetResList=None):
+def testMultiLayerConv(simulateResList=None, targetResList=None, show=False):
     if simulateResList is None:
         simulateResList = [
             '511c565c498ad8e5daa5d97ad464dc9cd1efd902d10fd9a8dcced964dc48d980d968d911dc18dc16d8b2d348de12d6f2dac6dc70dbd7d535dc6cdb12d21adcf9d756dabbccf6d8acd98dd339d19fd2f3d39cdb38dc7bdd4ec8b9c3d5d9ebd32dccf5d6b1d87cd4e155eed662cc28d008d80ddc71d8c6c87adb15da65d722d561d8c24435cfc7d92fd670d85d57bb550954ea4dd6452eda7dd65fd1dfd341da93da70d38f4b66d1aad8c1d864dd5dd77fd8f4d885db00cceb52c7dbfbd0edcc9bd498d0aec8e4d67dd29950e5555bd639d41454d3cf824ed650cf5265cc6bda7ddc72570dd9ddd8beda69db2ad1f5d92fdc88d224d6e7d81fd7fad5ddd51d524fcd2fd5f7d405d1c9d62bd678d5e8d53cd5e4d96cd498d0a0d6f8dc1acd43d033dc4356e6daf7d9f5d62bd725d649533c492edb78d821d0c0cfc6c9d0d5fad9e4d691d816581ed866d8db500346cadd7d4e26d621c264cd275285557f491d521dd780d86ddb6dd51fd628d844d717d64e567add16d8aadaf0d66ed6a7d87ad622d215d6a2dbd9d13a412d5978cd105737530bdc7b5566d8c5d8e1ce9bd8cddc0ed14bd75dc6e0d8bcdd1a4a04d41bd557d8824ef0d2cdd06ed641d41ad82dda3dd1b9d9cad483da56d7bbd6d0d913cb3cd346da2d51d2db0dd8ddd800dd02cc00db63d0c1dc67d966da0dd8f5d283d75dd9eed89b56e4db79dcefd715d0c6d943db73d509dcffd689523ed348db144d3cd8e1d515d50cd995d59dda8b39cccf2cd2cad509cc23d090d814dc2cd95355c7da85d4e1debd5590d4c3c9ac5780daf2d570ccdcdae1d6bcd530dbcf513fdc55d5a9cdf2dc55d918d97ad6f8db27d018d40d4a5ed3fa552fcfd4d89cd0e9d0f1d47bd438d63ccef8d8bedb70d3b9d70b5557ccb6db1bcd9ed690d8c55649cf32cf23d21ed8f24c6dd491d0edd7a9d420ddd8d185dbd3d9e5da82d95adc0fd62fd79f4adbd5d0db77da43d2a3d912d8f2dc3fd91bd92cd968dd03d8cf5063d4c454dddb1cd72ad82edd14d295d99ad9e3db4dc8ccd7f4da4dd538d504d3c5cc6fd9add15dd1becd58d5694d36d51055012b40dca9d75bdcfcd71edc28d829dc6c5552dabf4734cf3bd90ad6b7d95bda0ddc34dd67d871d8bed148d81d512b56d6d950dc02d939d81ad87dd9ded716d76fdc83dc1cd847d0b1d47dd95052b2507ed5b7d9d05045d9ea55f1455ed21c4f8856754ff2d9524fba5841d5cad06a5092d9e4d48adc03531cd614dc2bd52dd312daed53a2d7acdc5f562adba3d931d87bd582ca7bd46fd7bddb37d8ddd630dc9eda3bdc74d874d0f956b3d052c0b0cc625915c630daa8dc36d202d243d74c46cad999495d5822d4a24e26d73e4f36da88dbd7dd25d9e8d8b3d930d137cf45d286d8a7d42bd503d862d81a58dbd7d2ca43d5bfdb0dd80cd878dc5cd9c9d82ed5c1d973dd06d524d9e7d5aad87cdc9ed762ddcfd8aedc42d839ddfed4e4dca8d3c7d978dc42568dd9a4d2c4d92cd613d8f65236dacc4136d78fd8623d5adc9dd0a9d81adbfcd7d2472ed676d854dc7ed88adb9cd8ea49c5daa0594fd929d505ccdadb04d7f054ded61b5110d402d97551e0d2d1d2bed25350f1d433c9f74baedc43d682d9215309d744d6f8d76ad853d6f4d9cad462dac6d41c58044cf3da76592ad03b51edd11cd33ddc35d32ac556db72da25d715cf29d8ffcdc7563bdac7d89bd74ed48ad7bdd3b4da37bc18d715dd45db2ec7d5d9b9d3aad4075203d4f5d8ea47b2d823d539c8b1d961bd8ed728544fdccfd88c540ad86ddc27da45dcb8db27d284daddd8a2c664dc51d0f7d243dd4fdaecd5b1d73ad5b4d3adcf63d1ef541ed7a1d587d301ca9a48b1dbcd4f92d5d1d794d65a4ec55b21d90548ead9d2d920d0acdea1d094c982d951d8f8d49a4abad8184c96d76bd75853a5d752cd9ad70bdb00d0fbd8534f475a1ad44ed5e05359d76fd407d96fc8ff5280d14bcc7f48f5d93fdb37d665cb9ad40cd4eed088d84bdb40cf5ed2b8d68bd72d5659d172d65bcd22cfd2db1840344dabdc4f51f4d915d53041ccd7dfd83b564e516ad75bdc5bd986dd2fda9ed80adc5ad8a3d9794ff6d49adb60d1624bfedd35c6bfd4bbdcffce23d050d861d977d5f4d6844f56d710d88fda20d4c74d1ddb12da55dc7ad2c1d187d9d4d9d6cfb3c991d1b3da33d8d0d6b5dbf0d7f2d383cdc4d820dab4ca88',
@@ -98,25 +275,37 @@ def testMultiLayerConv(simulateResList=None, targetResList=None):
         ]
 
     for s, t in zip(simulateResList, targetResList):
-        testSingleLayerConv(s, t)
+        testSingleLayerConv(s, t, show)
 
 
-def testANN():
+def testANN(show=False):
     simulateRes = '0c80289e2dcf2cee28459f10a52ea0c620a324f5270e28792a212c432e043004310031a7315230652ed22c5121e0a98cacb6adcaad3aa5dc2c72318e324c30f42b652d6030562ede2b4ea3f2ac7aad22ab66a888a4399fa511402375265728df2ae32ca92d192d342c662c2a2da3300a30522d932034ac11ae82aeacafcc225c294828e82d4f2c522a5e23b6a8d8ad85af16ae85aceaaa37a68ba505a48ca43ca0d39cf59bbc237c249327972ba9305c32dd33df336531512be4a9cfafa5aefca0acaa3815cc204527e22b182b7124a1aa90aeb9b03eaff0ae88ad55accaac33ab6aaa2fa82ea536a809a928a85fa3729bdb27162d613067314830482c00203f1570a9bd29bc2dab2f55302d307a2f752c339956ac69aef6b037b0bcb0ebb0cfb0bfb03dadf1abdaaa3ca81ba7cfa89dac4eac32a83623a22c622e9c2a752d5629632638305e3252341e3478342832b2314330162d55284ca52cabc2ad9aae7faf26aeddad29aa1fa33124452a132aee29852c872e4b2f322ea72e89244a2df728d326d03063318d32d933d0341e33c9333d32433136301b2e732cc12bf92afd2a982b3a2b1a2b7e2c992da52e322d372be12c2e2c4b2cba2e4b2fb729ee2e452480a63c298829b52bb02c092d062fc1314e31a73119301f2f892f992fd02fda307b30bf30ec315931e432683238304f2c9b203faa78ada7acb2a4efa7d728a92686ab64a753a807a71ba890a92ca4dc281d2c8b2de92dd62e362e4b2e272dc62ed8300c30f5329433ea340d33e032ac31692e021742ad9cb00cb047b08fabf62980a9081e53a954ae49aed4ae9dae05acf2aa459dd8279c2c712d572da02e022e8a2dd52f7330f231ab30ea2ffc2fcf30d53102306d2d882654a83eadf2aa3e2d0822b82c3e16b2acddaf31b069b0dfb02baddba9791e462c3a2eff306f30ac30112e092e0a2db92c3e265a2258243f293d2cac304731ce320930be2b262c332d792c12310a2f782dcb2be8284520ee20c4249b29072c292dea2f9f30e730b72dc229c72abf29ff26e09e2da3f9a19490de21552a172de8304d308b2c242e9f2ed92ea632db3339344a3464345433e4335332df320f310e300e2f0e2ed22d10270b9ebf192322a024cb1ec89b00a05aa235a534a62ca5dca4649c00a94f2b1d2fc52f5e3355341a34443419341533e933ef33c3338832c8316830992fdf2d82292e22fe23f623da259d2281992fa519a9d2acd1ae67af56aebeac78ad5727392fa22d8c314d30de2ff62ee62e5c2eb92f752f44300b304a30a93115312530ac2ee02b8227a488b8a499a907ab75ad0caf04b04eb069aefbac71a860aa9929632bc723282ca729c72571262224ab257827e6270b29222a282c2a2d522ec02f342d96296f1961ac33af71b0ceb118b10db07fadd1a6b224e02abf2b751e882ad5a64cad390a28181694f19e53a0121d5621d022b525f725f325b92601280426602410231f212ba6b2ac62aeb1af5cadeca89625ea2c642ec2300e2efc28cb2afbab72b068ad15ac32a938a52d9f88921695d41df722b4234c211b0d5aa106a59a18e12afe2de12f042ed52e872e362d582d582d462ca82d8b2e0d2d9125532ada2900add6aee6b0e2b083aea8ac15a936a6c9a557a3119e439eb69d22a060a11a25942d1f30443109311d318331a831a3316830bd303b30112e4d2e3322092b3e2df429482848ac0cb03eb190b1cdb170b0f8b041af26af12adf7a9d1a605a0ce25802bb92d9d2f03303b317632da343734a63493344b340e32fd32492bc52e3d2c612dd63280330031242b79aa10b071b1afb1a6b1b7b1a4b075ada2aa5f1a352aed2d912e8f3045321b33b034553485346d3459345834133420342f301b31c22b732bc831b734203506352e345a32352f5d2a881d91a1f0903023ac27192c442ee1304f30d3320132cc325d31562fe12df92d432d2b2d562f7730a22d383195a5caab4924f92a532e5831dc342134f5352a34b0335a321131ad3101306f301e2fb52f312fde30c42fd82b561da8a477a5dea7d8a875a686a16f9e13a7be2c60a7d4af78ae89afacae91ac33a2112cb231a2336833e53401337d3226318b30a22dc7287526cd2869236ca2dba6cba82ba6bfa6aea679a71da971aaf5aa94a8b82d7b9ef0a874af18b0d5b157b0e2b00aad519d912e4c3144315d308d30362dcb281aa882ac37ae06ad4aab16a90da600a685a8a4aa55ac99adaaae98ae4eaf7d307d2d3c2d752503aadfaedfb0dab1d2b217b201b039ab8d1f3829c22c6f2bc12b34291ca243ad5caf72b048b075afbcb004b07fb120b16ab091af36afdaad672dcd29142c6d2d112cc529159d18abd5af9db132b26fb2d3b123ac90227d2a972e8f307c30682e94290ea7d7ac93ad4bacb2a9bca7db9c8e289f2d0627f02d97a400a952246d2a812e3a302130cc313730f12fcf2b819c98a9f3a9e49e4528b52d542f2f303b3211337433c1333032a832d6331e33c2344c343a340b3072323ba9b4ab991b722b002e3d302c321d3438353435df35c0356134b733aa321d315a30e12fe32e522ef1304b31fa335c333232fc3213318931a73106307e2cf43036a48a9e702b8e2d012d7a2d632ec7309531e03279335b346134ba34f234c534633389322930222a71a067a6c3a733a4839e56a02b946aa12ca4b29de1a08027793407355f3667363535a534a3333131042d2f27302352253c28f52bda2cd72e84300a3114319e31ae307c2d9728c71c10a49ea740a758a75ea74fa64ca39398c432bb322a337b331b326b31e430c02da0288b8040a5f1a9afab5cab6bab48a9a6a81da11027a22d132eca2f0e2d75298b241118c09cd59ef7a0069fbf9b679750'
     targetRes = '0ddc289d2dd32cf328459ecea522a0bf20a324f7270f287b2a242c442e063006310131a9315330662ed22c5421f0a987acb5adc6ad38a5d72c723190324d30f52b612d6330582ee32b5ea3e9ac75ad1dab61a881a4369fa111892378265f28e22ae62cad2d1b2d3a2c692c2a2da7300d30562d95203eac0dae7eaea6afca2263294828e32d512c592a6623fea8dbad86af11ae7eace5aa34a688a505a48ba43ba0d29ce49bb52381249a27a22bb0305e32e033e6336b31512be9a9ccafa1aefaa0b9aa361696205227f32b252b7524afaa92aeb2b038afeeae85ad53acc7ac33ab68aa2ea830a536a809a92aa859a3639be2271b2d643069314d30482bfc20511579a9b229c72db52f5c302e30812f822c3a98b9ac67aeeeb034b0b8b0eab0ccb0bbb03cadedabd3aa2aa825a7c5a897ac4cac33a83823ac2c662e9d2a772d5529672639305f32563422347a342a32b5314430192d5b2856a525abb7ad9aae76af21aed7ad27aa20a32724612a1e2af329892c892e4e2f382eac2e8e24512dfc28cf26d43066318f32e333d6342033d1334532493139301e2e782cc92c012b082a9f2b412b202b832ca02dad2e372d382be62c302c4c2cbc2e4d2fbd29f52e49247fa644298d29b82bbb2c0c2d0c2fcb314f31ac311f30222f902f9d2fd52fe2307f30c130ec315b31e7326f323c30522c9f2040aa73ada4acafa4e9a7d528ab267eab66a765a803a714a88ea92ca4dc28222c8f2dee2dd72e3e2e512e312dcc2edd301030fb329c33ee341033e732b2316c2e06176cad9bb00ab045b08dabf0297ca9011e39a94aae44aed1ae97adffacefaa479da027b82c742d5f2d9f2e052e8f2de02f7830f931b030ec30032fd730d93105306e2d87265fa833adeeaa382d0822b32c4416eaacd9af2fb066b0dcb027add6a9701e972c3f2f02307430ae30142e102e0c2dc12c41266f227f244829422cb4304a31d1320b30be2b2c2c332d772c12310d2f782dd12bf92843211320ef24b029112c2e2df02fa230e930b92dca29cd2ac22a0626ed9e1ba3eda188903f21612a1e2df0305030902c272ea22ed72ead32e43342344d3467345533e5335932e3320f3112300e2f112ed42d1627059eb6199422af24cf1ecc9aefa059a22da532a62ba5d9a4629bb9a94a2b202fc82f60335d341d3447341b341833ed33f433c6338d32c9316b309a2fe62d88293f232723fa23f1259d22829929a517a9d1acd0ae64af51aebeac6fad54273f2fa42d91315130e02ffb2eea2e632ec02f7b2f4b300f304e30ab3118312630ae2ee92b8b27a988d8a499a902ab6ead0caf06b04ab065aef2ac6fa85caa9029682bcc23352cab29cf257e262e24bc258427f92712292d2a302c2e2d5a2ec52f392d99297619cbac2daf6fb0cbb112b109b07dadc9a69c24e82ac42b7b1ebb2adca642ad3a0d4f184094789e21a0011d8321de22c62600260425c2260f280c266a2421234d2157a6ccac5faeaeaf55ade5a88626002c692ec630152f0228c42b02ab71b069ad13ac2fa936a52b9f8691ae95af1e0222bc235b21220f12a0fea59419612b132deb2f062ee22e8d2e392d5d2d612d462cac2d9a2e172d9e25592adb28fdadd9aee4b0deb080aea5ac12a933a6c6a556a3149e319e9f9d2ea066a0eb258e2d203048310a3123318631a931a2316b30c0303f30122e4c2e3922192b462df629462852ac06b03eb18fb1cdb16eb0f8b03eaf23af0fadf6a9d0a5f7a0d025852bbe2d9f2f0a303d317832e1343934a63497344f34103302324c2bcb2e3f2c602dd73285330331232b82aa0db070b1adb1a3b1b4b19fb073ad9eaa561ab12af52d972e99304a321f33b6345a348a346f345d345a341634223433301d31c32b772bc631bb3422350a3530345c32382f622a8f1dc1a1e08c7c23b627242c4d2ee3305330d5320532ce3265315b2feb2e042d462d302d5e2f7830a42d393196a5ccab4324ff2a5a2e5d31e0342434f7352e34b1335b321231b13105307330252fc02f352fe630c82fe12b5b1dd8a471a5d6a7d1a875a67ca15a9dcea7b12c62a7dcaf78ae87afa8ae8fac32a1f72cb731a7336d33e9340233803228319030a62dce287b26d92874237da2d4a6c9a82aa6bba6ada677a71aa971aaf5aa8fa8b72d7e9f0ea86faf16b0d1b153b0e0b00aad519d4f2e5531483162308f303a2dd2282aa878ac38ae03ad49ab13a90ca5ffa685a8a2aa53ac99ada8ae96ae4baf79307e2d3f2d782501aae0aed7b0d3b1cfb214b1feb038ab841f5929ca2c742bd02b3b292aa213ad57af68b048b073afb8b002b07bb11db167b08daf32afd4ad652dcd29122c722d182cc6291b9d2babc9af99b134b26bb2ccb122ac9022952a952e91307f306b2e97290fa7cdac91ad45acb2a9baa7db9c7c28a52d0927eb2d9aa401a955247d2a812e42302630d0313930f32fd42b899c67a9eca9d99dfe28be2d5b2f33303f3215337d33c7333432ac32d9332033c4344e343d34103075323ea9b1ab941bc52b0c2e42302f3221343b353535e235c5356434b933af321f315b30e42fe22e552ef3304e31ff335f333633013215318c31a9310830822cf63038a48b9e8d2b992d082d822d642ecf309731e3327c335f346234bd34f534c834663392322d30232a7da057a6b9a72ea47f9e3ca02b9406a11fa4aa9dcda07b277e34083563366b363835a734a6333a31082d35273b2361254929052be02cdd2e89300e311831a431b3307e2d9b28cf1c25a49aa73ca757a75da750a64ba39398b732bd322f33823321327031e730c32da42891014ea5eca9afab5cab6aab44a9a7a81ca10327ab2d1b2ed22f132d76298b241218c49cd49ef6a0079fbe9b649746'
-    MSE = 0.0
-    MSEList = []
-    for i in range(0, len(simulateRes), 4):
-        MSE += (hex4_to_float16(simulateRes[i:i + 4]) - hex4_to_float16(targetRes[i:i + 4])) ** 2
-        MSEList.append(((hex4_to_float16(simulateRes[i:i + 4]) - hex4_to_float16(targetRes[i:i + 4])) ** 2))
-    MSE /= (len(simulateRes) // 4)
-    print('MSE Loss is {:.6f}'.format(MSE))
-    plt.plot(MSEList)
-    plt.show()
+    stats = diff_streams([hex_to_bits(simulateRes)], [hex_to_bits(targetRes)])
+    print('MSE Loss is {:.6f}'.format(stats.mse))
+    print(format_report('result', stats))
+    if show:
+        _plot_errors(simulateRes, targetRes)
 
 
 if __name__ == "__main__":
-    # testSingleKernelConv()
-    # testSingleLayerConv()
-    # testMultiLayerConv()
-    testANN()
+    parser = argparse.ArgumentParser(description="比较 golden 模型与 RTL 的逐层输出")
+    parser.add_argument("golden", help="golden 输出: 目录 / .npz trace / .npy / hex 文件")
+    parser.add_argument("rtl", help="RTL 输出, 格式同上")
+    parser.add_argument("--layers", nargs="+", default=["data"],
+                        help="要比较的层名, 目录和 .npz 按层名查找文件")
+    parser.add_argument("--width", type=int, choices=[16, 32], help="hex 文件的位宽, 默认按层名判断")
+    parser.add_argument("--channels", type=int, help="每张图的通道数, 默认按层名判断")
+    parser.add_argument("--first-n", type=int, default=10, help="列出的前N个不一致的位置")
+    parser.add_argument("--chunk", type=int, default=1 << 20, help="每次比较的数值个数")
+    parser.add_argument("--json", help="把报告写入 json 文件")
+    args = parser.parse_args()
+
+    reports = {}
+    for layer in args.layers:
+        stats = diff_layer(args.golden, args.rtl, layer, args.width, args.channels, args.first_n, args.chunk)
+        print(format_report(layer, stats))
+        reports[layer] = stats.report()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
@@ -1,8 +1,11 @@
+import argparse
 import gzip
+import json
 import numpy as np
-import torch
 import os
 
+from hexCodec import bits_to_hex, hex_to_bits
+
 
 def read_idx_images(filename):
     with gzip.open(filename, 'rb') as f:
@@ -30,34 +33,109 @@ def read_idx_labels(filename):
     return labels
 
 
-def image_to_fp16_hex_line(image):
+def quantize_images(images):
+    """[N,H,W] uint8 -> FP32归一化 -> FP16, 返回 [N,1,H,W] 的 FP16 位模式 (uint16)"""
+    images_fp16 = (images.astype(np.float32) / 255.0).astype(np.float16)
+    return images_fp16.view(np.uint16)[:, np.newaxis]
+
+
+def save_testset_npy(bits, labels, image_file="test_images_fp16.npy", label_file="test_labels.npy"):
+    """保存为小端 uint16 的 .npy 图像文件和 uint8 的 .npy 标签文件"""
+    np.save(image_file, np.ascontiguousarray(bits, dtype='<u2'))
+    np.save(label_file, np.asarray(labels, dtype=np.uint8))
+
+
+def load_testset_npy(image_file="test_images_fp16.npy", label_file="test_labels.npy"):
+    """
+    以内存映射方式读取 save_testset_npy 保存的测试集, 不拷贝数据
+    返回: (images [N,1,32,32] float16 只读视图, labels [N] uint8)
+    """
+    bits = np.load(image_file, mmap_mode='r')
+    labels = np.load(label_file, mmap_mode='r')
+    return bits.view('<f2'), labels
+
+
+def hex_file_to_npy(hex_file="test_images_hex.txt", label_txt_file="test_labels.txt",
+                    image_file="test_images_fp16.npy", label_file="test_labels.npy"):
+    """没有原始数据集时, 从已有的 hex 测试集生成 .npy 缓存"""
+    with open(hex_file, 'r') as f:
+        bits = hex_to_bits(f.read(), 16).reshape(-1, 1, 32, 32)
+    labels = np.loadtxt(label_txt_file, dtype=np.uint8, ndmin=1)
+    save_testset_npy(bits, labels, image_file, label_file)
+    print(f"Finished. {len(bits)} images cached to '{image_file}', labels cached to '{label_file}'.")
+
+
+def write_hex_images(f_img, bits, sep=" ", chunk_size=1000):
+    """
+    FP16 位模式 [N,1,H,W] -> 每张图一行写入 f_img, 按 chunk_size 张图分块写出
+    sep 为像素间的分隔符, 为空时每行是一个 $readmemh 可读的宽字
+    """
+    bits = bits.reshape(len(bits), -1)
+    for i in range(0, len(bits), chunk_size):
+        chunk = bits[i:i + chunk_size]
+        f_img.write("\n".join(bits_to_hex(row, 16, sep) for row in chunk) + "\n")
+
+
+def write_labels(f_label, labels):
+    if len(labels):
+        f_label.write("\n".join(map(str, labels)) + "\n")
+
+
+def export_hex_shards(bits, labels, output_dir=".", prefix="test", num_shards=1, sep=" ", chunk_size=1000):
     """
-    将单张图像 numpy array [H,W] -> FP32归一化 -> FP16 -> 16进制字符串
-    返回一行字符串，每个像素 4 位 hex，用空格分隔
+    把量化后的数据集拆成 num_shards 份连续的 hex 图像文件和标签文件,
+    并写出 {prefix}_index.json 记录每份的文件名、起始下标和图片数, 便于多个 testbench 并行仿真
     """
-    image_fp32 = image.astype(np.float32) / 255.0
-    tensor_fp16 = torch.tensor(image_fp32, dtype=torch.float16)
-    tensor_uint16 = tensor_fp16.numpy().view(np.uint16)
-    hex_list = [f"{val:04x}" for val in tensor_uint16.flatten()]
-    return " ".join(hex_list)
+    if num_shards <= 0:
+        raise ValueError(f"num_shards must be positive, got {num_shards}")
+    os.makedirs(output_dir, exist_ok=True)
+    bounds = np.linspace(0, len(bits), num_shards + 1).astype(int)
+    shards = []
+    for k in range(num_shards):
+        suffix = f"_{k:03d}" if num_shards > 1 else ""
+        image_file = f"{prefix}_images_hex{suffix}.txt"
+        label_file = f"{prefix}_labels{suffix}.txt"
+        start, end = bounds[k], bounds[k + 1]
+        with open(os.path.join(output_dir, image_file), 'w') as f_img, \
+                open(os.path.join(output_dir, label_file), 'w') as f_label:
+            write_hex_images(f_img, bits[start:end], sep, chunk_size)
+            write_labels(f_label, labels[start:end])
+        shards.append({"images": image_file, "labels": label_file, "start": int(start), "count": int(end - start)})
+
+    index = {"split": prefix, "total": len(bits), "shape": list(bits.shape[1:]), "sep": sep, "shards": shards}
+    with open(os.path.join(output_dir, f"{prefix}_index.json"), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
 
 
-def process_spots10_testset_single_file(image_path="./Dataset/test-images-idx3-ubyte.gz",
-                                        label_path="./Dataset/test-labels-idx1-ubyte.gz",
-                                        output_image_file="test_images_hex.txt",
-                                        output_label_file="test_labels.txt"):
-    images = read_idx_images(image_path)
-    labels = read_idx_labels(label_path)
+def export_spots10(dataset_dir="./Dataset", output_dir=".", kinds=("train", "test"),
+                   num_shards=1, sep=" ", chunk_size=1000):
+    """
+    一次量化整个数据集的各个划分, 每个划分输出:
+    .npy 缓存 ({kind}_images_fp16.npy, {kind}_labels.npy) 和分片的 hex 文件
+    """
+    for kind in kinds:
+        images = read_idx_images(os.path.join(dataset_dir, f"{kind}-images-idx3-ubyte.gz"))
+        labels = read_idx_labels(os.path.join(dataset_dir, f"{kind}-labels-idx1-ubyte.gz"))
+        bits = quantize_images(images)
 
-    with open(output_image_file, 'w') as f_img, open(output_label_file, 'w') as f_label:
-        for idx, image in enumerate(images):
-            hex_line = image_to_fp16_hex_line(image)
-            f_img.write(hex_line + "\n")
-            f_label.write(str(labels[idx]) + "\n")
-            if (idx + 1) % 100 == 0:
-                print(f"Processed {idx + 1}/{len(images)} images")
+        os.makedirs(output_dir, exist_ok=True)
+        save_testset_npy(bits, labels,
+                         os.path.join(output_dir, f"{kind}_images_fp16.npy"),
+                         os.path.join(output_dir, f"{kind}_labels.npy"))
+        index = export_hex_shards(bits, labels, output_dir, kind, num_shards, sep, chunk_size)
+        print(f"Finished {kind}: {index['total']} images in {num_shards} shard(s) -> '{output_dir}'")
 
-    print(f"Finished. Hex images saved to '{output_image_file}', labels saved to '{output_label_file}'.")
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SPOTS-10 数据集 FP16 量化与 $readmemh 导出")
+    parser.add_argument("--dataset-dir", default="./Dataset")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--kinds", nargs="+", default=["test"], choices=["train", "test"])
+    parser.add_argument("--shards", type=int, default=1, help="每个划分拆成的文件数")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="每次写出的图片数")
+    parser.add_argument("--concat", action="store_true", help="像素之间不加空格, 每行一个宽字")
+    args = parser.parse_args()
 
-process_spots10_testset_single_file()
+    export_spots10(args.dataset_dir, args.output_dir, args.kinds, args.shards,
+                   "" if args.concat else " ", args.chunk_size)